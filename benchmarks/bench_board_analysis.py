@@ -0,0 +1,103 @@
+"""
+Micro-benchmark of the bitboard board analysis against the original
+dict-of-lists implementation of analize_board, on the FENs in fens.txt.
+
+    python -m benchmarks.bench_board_analysis [--repeat 20]
+"""
+import argparse
+import os
+import timeit
+
+import chess
+
+from src.board_analysis import board_features
+
+CORPUS = os.path.join(os.path.dirname(__file__), "fens.txt")
+LEGACY_FIELDS = ["checkers", "material", "pieces_info", "pawn_structure"]
+
+
+def get_piece_info(board: chess.Board, square: chess.Square) -> dict:
+    piece = board.piece_at(square)
+    return {
+        "square": square,
+        "position": chess.square_name(square),
+        "piece": piece.symbol(),
+        "color": "white" if piece.color else "black",
+    }
+
+
+def legacy_board_features(board: chess.Board) -> dict:
+    """analize_board before the bitboard rewrite, without the engine call."""
+    pieces = board.piece_map()
+
+    piece_values = {"p": 1, "n": 3, "b": 3, "r": 5, "q": 9}
+    material = {"white": {"pieces": {}}, "black": {"pieces": {}}}
+    for square, piece in pieces.items():
+        color = "white" if piece.color else "black"
+        symbol = piece.symbol()
+        if symbol in ["K", "k"]:
+            continue
+        if symbol in material[color]["pieces"]:
+            material[color]["pieces"][symbol]["count"] += 1
+        else:
+            material[color]["pieces"][symbol] = {"value": piece_values[symbol.lower()], "count": 1}
+    for color in material:
+        material[color]["total"] = sum(
+            [piece["value"] * piece["count"] for piece in material[color]["pieces"].values()])
+
+    checkers = board.checkers()
+
+    attackers = {square: [] for square in chess.SQUARES}
+    attacked = {square: [] for square in chess.SQUARES}
+    for square in pieces:
+        for attacker in board.attackers(not pieces[square].color, square):
+            attacked[attacker].append(square)
+            attackers[square].append(attacker)
+
+    pawn_structure = {
+        "white": [chess.square_file(pawn) for pawn in board.pieces(chess.PAWN, chess.WHITE)],
+        "black": [chess.square_file(pawn) for pawn in board.pieces(chess.PAWN, chess.BLACK)],
+    }
+
+    pieces_info = [get_piece_info(board, square) for square in pieces.keys()]
+    for pi in pieces_info:
+        pi["attacked_by"] = [get_piece_info(board, square) for square in attackers[pi["square"]]]
+        pi["attacking"] = [get_piece_info(board, square) for square in attacked[pi["square"]]]
+
+    return {
+        "checkers": [get_piece_info(board, square) for square in checkers],
+        "material": material,
+        "pieces_info": pieces_info,
+        "pawn_structure": pawn_structure,
+    }
+
+
+def load_boards(path: str = CORPUS) -> list[chess.Board]:
+    with open(path) as f:
+        return [chess.Board(line.strip()) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    boards = load_boards()
+    for board in boards:
+        new = board_features(board)
+        old = legacy_board_features(board)
+        mismatched = [field for field in LEGACY_FIELDS if new[field] != old[field]]
+        if mismatched:
+            raise SystemExit(f"Output differs for {board.fen()}: {mismatched}")
+
+    results = {}
+    for name, fn in [("legacy", legacy_board_features), ("bitboard", board_features)]:
+        seconds = min(timeit.repeat(lambda: [fn(board) for board in boards], number=1, repeat=args.repeat))
+        results[name] = seconds / len(boards) * 1e6
+        print(f"{name:>9}: {results[name]:8.1f} us/position")
+    print(f"  speedup: {results['legacy'] / results['bitboard']:.2f}x over {len(boards)} positions "
+          "(bitboard also computes hanging, pinned, mobility and pawn features)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Compare embedding backends on the chess expert store: query latency, and
+recall@k of each backend's retrieval against the torch backend's top-k, on
+the questions in queries.txt.
+
+    python -m benchmarks.bench_embeddings [--backends torch onnx onnx-int8] [--k 2 5]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+from llama_index.core.schema import MetadataMode, TextNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+
+from src.config import get_agent_settings
+from src.embeddings import EMBEDDING_BACKENDS, create_embed_model
+
+QUERIES = os.path.join(os.path.dirname(__file__), "queries.txt")
+
+
+def load_queries(path: str = QUERIES) -> list[str]:
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def load_passages(store_path: str) -> list[str]:
+    docstore = SimpleDocumentStore.from_persist_dir(store_path)
+    return [
+        node.get_content(metadata_mode=MetadataMode.EMBED)
+        for node in docstore.docs.values()
+        if isinstance(node, TextNode)
+    ]
+
+
+def normalized(embeddings: list[list[float]]) -> np.ndarray:
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def top_k(queries: np.ndarray, passages: np.ndarray, k: int) -> list[set[int]]:
+    scores = queries @ passages.T
+    return [set(np.argsort(-row)[:k]) for row in scores]
+
+
+def run_backend(backend: str, queries: list[str], passages: list[str]) -> dict:
+    start = time.perf_counter()
+    embed_model = create_embed_model(backend, cache_size=0)
+    load_seconds = time.perf_counter() - start
+
+    passage_embeddings = normalized(embed_model.get_text_embedding_batch(passages))
+
+    latencies = []
+    query_embeddings = []
+    for query in queries:
+        start = time.perf_counter()
+        query_embeddings.append(embed_model.get_query_embedding(query))
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        "load_seconds": load_seconds,
+        "query_ms": np.percentile(latencies, [50, 95]) * 1000,
+        "queries": normalized(query_embeddings),
+        "passages": passage_embeddings,
+    }
+
+
+def main():
+    settings = get_agent_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store", default=settings.store_path)
+    parser.add_argument("--backends", nargs="+", default=list(EMBEDDING_BACKENDS), choices=EMBEDDING_BACKENDS)
+    parser.add_argument("--k", nargs="+", type=int, default=[2, 5])
+    args = parser.parse_args()
+
+    queries = load_queries()
+    passages = load_passages(args.store)
+    print(f"{len(queries)} queries against {len(passages)} passages")
+
+    results = {backend: run_backend(backend, queries, passages) for backend in args.backends}
+    reference = results.get("torch") or run_backend("torch", queries, passages)
+
+    for backend, result in results.items():
+        recalls = []
+        for k in args.k:
+            expected = top_k(reference["queries"], reference["passages"], k)
+            # Candidate backends embed both sides, as they would after a re-ingest.
+            actual = top_k(result["queries"], result["passages"], k)
+            recalls.append(np.mean([len(e & a) / k for e, a in zip(expected, actual)]))
+        p50, p95 = result["query_ms"]
+        print(
+            f"{backend:>9}: load {result['load_seconds']:6.1f}s  query p50 {p50:6.1f}ms p95 {p95:6.1f}ms  "
+            + "  ".join(f"recall@{k} {recall:.3f}" for k, recall in zip(args.k, recalls))
+        )
+
+    cached = create_embed_model(args.backends[0])
+    for query in queries:
+        cached.get_query_embedding(query)
+    start = time.perf_counter()
+    for query in queries:
+        cached.get_query_embedding(query)
+    print(f"cached query: {(time.perf_counter() - start) / len(queries) * 1e6:.1f} us ({cached.stats()})")
+
+
+if __name__ == "__main__":
+    main()
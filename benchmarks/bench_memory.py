@@ -0,0 +1,73 @@
+"""
+Memory per worker of the API under uvicorn --workers and under src.serve.
+
+For each server mode the API starts with `--workers` processes against the
+fake services, waits until ready, serves a short warm-up load so every
+worker has touched its state, and reports the RSS, USS and PSS of the parent
+and each worker. USS is what each worker holds alone; PSS splits shared
+pages between the processes sharing them, so the total PSS is what the
+whole server really occupies:
+
+- uvicorn: every worker loads its own components.
+- fork: src.serve --no-preload, workers forked after importing the app.
+- preload: src.serve, workers forked after loading the components.
+
+The components load only when the embedding model is in the local Hugging
+Face cache (HF_HUB_OFFLINE=1); otherwise the comparison covers the
+imported modules alone.
+
+    python -m benchmarks.bench_memory [--servers uvicorn fork preload] [--workers 4] [--requests 200]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks.common import process_memory
+from benchmarks.fake_services import FakeServices, free_port, wait_until_up
+from benchmarks.load_test import SERVERS, STARTUP_TIMEOUT, print_memory, run_load, start_api, wait_until_ready
+
+
+def measure(server: str, workers: int, env: dict[str, str], endpoints: list[str], requests: int, ready_timeout: float) -> dict[int, dict]:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    api = start_api(port, workers, env, server)
+    try:
+        start = time.perf_counter()
+        wait_until_up(f"{url}/", timeout=STARTUP_TIMEOUT, process=api)
+        wait_until_ready(url, ready_timeout)
+        print(f"{server}: ready after {time.perf_counter() - start:.1f}s")
+        asyncio.run(run_load(url, endpoints, requests, concurrency=workers * 4, warmup=0))
+        return {usage["pid"]: usage for usage in process_memory(api.pid)}
+    finally:
+        api.terminate()
+        api.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", nargs="+", default=list(SERVERS), choices=SERVERS)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--endpoints", nargs="+", default=["game"])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--ready-timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    with FakeServices(engine_latency=0.005, llm_latency=0.01, token_latency=0) as services, tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, "metrics"))
+        env = {
+            **services.env(),
+            "EVAL_CACHE_PATH": os.path.join(tmp, "evaluations.sqlite3"),
+            "GAME_CACHE_PATH": os.path.join(tmp, "games.sqlite3"),
+            "RESPONSE_CACHE_PATH": os.path.join(tmp, "responses.sqlite3"),
+            "LOG_LEVEL": "WARNING",
+            "PROMETHEUS_MULTIPROC_DIR": os.path.join(tmp, "metrics"),
+        }
+        for server in args.servers:
+            memory = measure(server, args.workers, env, args.endpoints, args.requests, args.ready_timeout)
+            print_memory(memory)
+
+
+if __name__ == "__main__":
+    main()
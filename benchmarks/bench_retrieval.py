@@ -0,0 +1,83 @@
+"""
+Retrieval benchmark of ChessExpertRAG on the questions in queries.txt, for
+the persisted SimpleVectorStore and the memory-mapped store.
+
+Reports the store load time, the end-to-end retrieve latency (query
+embedding included, with the query embedding cache off), the vector search
+alone on precomputed query embeddings, and the memory the store adds. Runs
+offline once the embedding model is in the local Hugging Face cache
+(HF_HUB_OFFLINE=1).
+
+    python -m benchmarks.bench_retrieval [--formats simple mmap] [--top-k 2] [--repeat 5]
+"""
+import argparse
+import os
+import time
+
+from llama_index.core import QueryBundle
+
+from benchmarks.common import QUERIES, format_latencies, load_lines, process_memory
+from src.config import get_agent_settings
+from src.embeddings import create_embed_model
+from src.rags import ChessExpertRAG
+
+
+def rss_mb() -> float:
+    return process_memory(os.getpid())[0]["rss_mb"]
+
+
+def load_retriever(fmt: str, store_path: str, mmap_store_path: str, top_k: int, embed_model):
+    rag = ChessExpertRAG(
+        store_path=store_path,
+        mmap_store_path=mmap_store_path if fmt == "mmap" else None,
+        similarity_top_k=top_k,
+        embed_model=embed_model,
+    )
+    return rag.retriever or rag.index.as_retriever(similarity_top_k=top_k)
+
+
+def main():
+    settings = get_agent_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store", default=settings.store_path)
+    parser.add_argument("--mmap-store", default=settings.mmap_store_path)
+    parser.add_argument("--formats", nargs="+", default=["simple", "mmap"], choices=["simple", "mmap"])
+    parser.add_argument("--top-k", type=int, default=settings.similarity_top_k)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    queries = load_lines(QUERIES)
+    embed_model = create_embed_model(cache_size=0)
+    query_embeddings = [embed_model.get_query_embedding(query) for query in queries]
+    print(f"{len(queries)} queries, top {args.top_k}, {settings.embedding_backend} embeddings")
+
+    for fmt in args.formats:
+        if fmt == "mmap" and not os.path.exists(args.mmap_store):
+            print(f"{fmt:>7}: skipped, {args.mmap_store} does not exist (python -m src.ingest --mmap)")
+            continue
+
+        rss_before = rss_mb()
+        start = time.perf_counter()
+        retriever = load_retriever(fmt, args.store, args.mmap_store, args.top_k, embed_model)
+        load_seconds = time.perf_counter() - start
+        rss_delta = rss_mb() - rss_before
+
+        end_to_end = []
+        search = []
+        for _ in range(args.repeat):
+            for query, embedding in zip(queries, query_embeddings):
+                start = time.perf_counter()
+                retriever.retrieve(query)
+                end_to_end.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                retriever.retrieve(QueryBundle(query, embedding=embedding))
+                search.append(time.perf_counter() - start)
+
+        print(f"{fmt:>7}: load {load_seconds * 1000:8.1f}ms  +{rss_delta:6.1f} MiB RSS")
+        print(f"{'':>7}  retrieve {format_latencies(end_to_end)}  {len(end_to_end) / sum(end_to_end):8.1f} queries/s")
+        print(f"{'':>7}  search   {format_latencies(search)}  {len(search) / sum(search):8.1f} queries/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Micro-benchmarks of the agent tools (get_best_move, analize_board,
+analize_move and analyze_player) over fens.txt and games.pgn, against the
+local fake chess-api.com.
+
+Each tool runs twice over the corpus: cold, with an empty evaluation cache so
+every position costs an engine call, and warm, served from the cache.
+
+    python -m benchmarks.bench_tools [--engine-latency 0.05] [--repeat 3]
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import Callable
+
+from benchmarks.common import FENS, format_latencies, game_moves, load_games, load_lines
+from benchmarks.fake_services import FakeServices
+
+
+def measure(fn: Callable, calls: list[tuple]) -> list[float]:
+    latencies = []
+    for args in calls:
+        start = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engine-latency", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=3, help="Warm passes over the corpus")
+    args = parser.parse_args()
+
+    with FakeServices(engine_latency=args.engine_latency) as services, tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(services.env())
+        os.environ["EVAL_CACHE_PATH"] = os.path.join(tmp, "evaluations.sqlite3")
+        os.environ["POSITION_TABLE_ENABLED"] = "false"
+
+        # src reads its settings on import, so it is only imported once they point at the fakes.
+        from src.cache import get_evaluation_cache
+        from src.tools import analize_board, analize_move, analyze_player, get_best_move
+
+        fens = load_lines(FENS)
+        games = load_games()
+        moves = [move for game in games for move in game_moves(game)]
+        players = [
+            (player, [san for _, san in game_moves(game)]) for game in games for player in (0, 1)
+        ]
+        cases = [
+            ("get_best_move", get_best_move, [(fen,) for fen in fens]),
+            ("analize_board", analize_board, [(fen,) for fen in fens]),
+            ("analize_move", analize_move, moves),
+            ("analyze_player", analyze_player, players),
+        ]
+
+        print(f"{len(fens)} positions, {len(games)} games ({len(moves)} moves), engine latency {args.engine_latency * 1000:.0f}ms")
+        for name, fn, calls in cases:
+            get_evaluation_cache().clear()
+            cold = measure(fn, calls)
+            warm = [latency for _ in range(args.repeat) for latency in measure(fn, calls)]
+            print(f"{name:>14} cold: {format_latencies(cold)}  {len(cold) / sum(cold):8.1f} calls/s")
+            print(f"{name:>14} warm: {format_latencies(warm)}  {len(warm) / sum(warm):8.1f} calls/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Corpus loading and reporting helpers shared by the benchmarks."""
+import os
+
+import chess
+import chess.pgn
+import numpy as np
+
+FENS = os.path.join(os.path.dirname(__file__), "fens.txt")
+GAMES = os.path.join(os.path.dirname(__file__), "games.pgn")
+QUERIES = os.path.join(os.path.dirname(__file__), "queries.txt")
+
+
+def load_lines(path: str) -> list[str]:
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def load_games(path: str = GAMES) -> list[chess.pgn.Game]:
+    games = []
+    with open(path) as f:
+        while (game := chess.pgn.read_game(f)) is not None:
+            games.append(game)
+    return games
+
+
+def game_moves(game: chess.pgn.Game) -> list[tuple[str, str]]:
+    """(FEN before the move, SAN) for every move of the game."""
+    board = game.board()
+    moves = []
+    for move in game.mainline_moves():
+        moves.append((board.fen(), board.san(move)))
+        board.push(move)
+    return moves
+
+
+def percentiles(seconds: list[float]) -> dict[str, float]:
+    """p50/p95/p99 in milliseconds."""
+    if not seconds:
+        return {"p50": float("nan"), "p95": float("nan"), "p99": float("nan")}
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99]) * 1000
+    return {"p50": p50, "p95": p95, "p99": p99}
+
+
+def format_latencies(seconds: list[float]) -> str:
+    p = percentiles(seconds)
+    return f"p50 {p['p50']:8.2f}ms  p95 {p['p95']:8.2f}ms  p99 {p['p99']:8.2f}ms"
+
+
+def process_memory(pid: int) -> list[dict]:
+    """
+    RSS, USS and PSS in MiB of a process and each of its children, e.g. a
+    server and its workers. USS is the memory only that process would free on
+    exit; PSS adds its share of the pages it shares with other processes, so
+    the PSS of a process tree sums to what it really occupies. PSS is only
+    reported on Linux.
+    """
+    try:
+        import psutil
+    except ImportError as e:
+        raise ImportError("Memory reports need `pip install psutil`") from e
+
+    process = psutil.Process(pid)
+    usage = []
+    for p in [process, *process.children(recursive=True)]:
+        try:
+            info = p.memory_full_info()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        usage.append({
+            "pid": p.pid,
+            "rss_mb": info.rss / 2**20,
+            "uss_mb": info.uss / 2**20,
+            "pss_mb": info.pss / 2**20 if hasattr(info, "pss") else None,
+        })
+    return usage
@@ -0,0 +1,248 @@
+"""
+Local stand-ins for chess-api.com and the OpenAI chat completions API, so
+benchmarks and load tests run offline and with a known upstream latency.
+
+- `POST /chess-api`: a chess-api.com style analysis. The move and score are
+  derived from the FEN, so they are stable between runs.
+- `POST /v1/chat/completions`: an OpenAI-compatible chat endpoint, streamed
+  or not. ReAct prompts get answers in the ReAct format, calling
+  `analize_board` on the FEN of the question `--agent-tool-calls` times
+  before answering; requests with `tools` get that many rounds of parallel
+  native tool calls, one to every tool that takes just a FEN or a query;
+  batch explanation prompts get a JSON array.
+
+    python -m benchmarks.fake_services [--port 8900] [--engine-latency 0.05] [--llm-latency 0.4] [--token-latency 0.005]
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+import zlib
+
+import chess
+import httpx
+from fastapi import FastAPI, Form, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from src.engines import build_analysis
+
+FEN_PATTERN = re.compile(r"([rnbqkpRNBQKP1-8]+/){7}[rnbqkpRNBQKP1-8]+ [wb] [KQkq-]+ (?:[a-h][36]|-) \d+ \d+")
+ANSWER = (
+    "This move improves the position of your pieces and keeps your king safe. "
+    "Look at which squares it controls and how it prepares the next attack, "
+    "and try to find moves like it in your own games."
+)
+
+
+def fake_analysis(fen: str) -> dict:
+    board = chess.Board(fen)
+    moves = sorted(board.legal_moves, key=lambda move: move.uci())
+    seed = zlib.crc32(fen.encode())
+    move = moves[seed % len(moves)] if moves else None
+    return build_analysis(board, move, centipawns=seed % 201 - 100, depth=18, continuation=[move] if move else [])
+
+
+def react_answer(messages: list[dict], tool_calls: int) -> str:
+    observations = sum("Observation:" in str(message.get("content")) for message in messages[1:])
+    fens = FEN_PATTERN.search(" ".join(str(message.get("content")) for message in messages[1:]))
+    if fens and observations < tool_calls:
+        return (
+            "Thought: The current language of the user is: English. I need to use a tool to help me answer the question.\n"
+            "Action: analize_board\n"
+            f"Action Input: {json.dumps({'fen': fens.group(0)})}"
+        )
+    return f"Thought: I can answer without using any more tools. I'll use the user's language to answer\nAnswer: {ANSWER}"
+
+
+def function_tool_calls(body: dict, rounds: int) -> list[dict]:
+    """The tool calls of a native function calling turn; none once `rounds` turns have called tools."""
+    messages = body["messages"]
+    fens = FEN_PATTERN.search(" ".join(str(message.get("content")) for message in messages[1:]))
+    if not body.get("tools") or not fens or sum(bool(message.get("tool_calls")) for message in messages) >= rounds:
+        return []
+    calls = []
+    for tool in body["tools"]:
+        function = tool["function"]
+        parameters = set(function.get("parameters", {}).get("properties", {}))
+        if parameters == {"fen"}:
+            arguments = {"fen": fens.group(0)}
+        elif parameters == {"query"}:
+            arguments = {"query": "How to improve piece activity"}
+        else:
+            continue
+        calls.append({
+            "id": f"call_{len(messages)}_{len(calls)}",
+            "type": "function",
+            "function": {"name": function["name"], "arguments": json.dumps(arguments)},
+        })
+    return calls
+
+
+def answer_for(messages: list[dict], tool_calls: int) -> str:
+    prompt = "\n".join(str(message.get("content")) for message in messages)
+    if "Action Input:" in prompt:
+        return react_answer(messages, tool_calls)
+    if "JSON array" in prompt:
+        return json.dumps([ANSWER] * len(FEN_PATTERN.findall(prompt)))
+    return ANSWER
+
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def create_app(
+    engine_latency: float = 0.05,
+    engine_error_rate: float = 0.0,
+    llm_latency: float = 0.4,
+    token_latency: float = 0.005,
+    agent_tool_calls: int = 1,
+) -> FastAPI:
+    app = FastAPI(title="Fake chess-api.com and OpenAI")
+
+    @app.get("/health")
+    async def health():
+        return "ok"
+
+    @app.post("/chess-api")
+    async def chess_api(fen: str = Form(...)):
+        await asyncio.sleep(engine_latency)
+        if random.random() < engine_error_rate:
+            return Response(status_code=503, headers={"Retry-After": "0"})
+        return fake_analysis(fen)
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        tool_calls = function_tool_calls(body, agent_tool_calls)
+        answer = "" if tool_calls else answer_for(body["messages"], agent_tool_calls)
+        tokens = re.findall(r"\S+\s*", answer)
+        prompt_tokens = count_tokens(json.dumps(body["messages"]))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens) + 10 * len(tool_calls),
+            "total_tokens": prompt_tokens + len(tokens) + 10 * len(tool_calls),
+        }
+        finish_reason = "tool_calls" if tool_calls else "stop"
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": body["model"]}
+
+        if not body.get("stream"):
+            await asyncio.sleep(llm_latency + token_latency * len(tokens))
+            message = {"role": "assistant", "content": answer or None}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            return JSONResponse({
+                **base,
+                "object": "chat.completion",
+                "choices": [{
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": finish_reason,
+                    "logprobs": None,
+                }],
+                "usage": usage,
+            })
+
+        def chunk(delta: dict, finish_reason: str | None = None) -> str:
+            choice = {"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}
+            return f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [choice]})}\n\n"
+
+        async def events():
+            await asyncio.sleep(llm_latency)
+            yield chunk({"role": "assistant", "content": ""})
+            for index, tool_call in enumerate(tool_calls):
+                yield chunk({"tool_calls": [{"index": index, **tool_call}]})
+            for token in tokens:
+                await asyncio.sleep(token_latency)
+                yield chunk({"content": token})
+            yield chunk({}, finish_reason)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url: str, timeout: float = 30.0, process: subprocess.Popen | None = None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(f"{url} did not come up in {timeout}s")
+
+
+class FakeServices:
+    """
+    Runs the fake services in a subprocess, so their sleeps and JSON encoding
+    do not compete with the process being measured.
+
+        with FakeServices(engine_latency=0.05) as services:
+            os.environ.update(services.env())
+    """
+
+    def __init__(self, port: int | None = None, **options):
+        self.port = port or free_port()
+        self.options = options
+        self.process: subprocess.Popen | None = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def env(self) -> dict[str, str]:
+        """Settings that point the API at these services instead of the real ones."""
+        return {
+            "EVALUATION_BACKEND": "chess_api",
+            "CHESS_API_URL": f"{self.url}/chess-api",
+            "OPENAI_API_BASE": f"{self.url}/v1",
+            "OPENAI_API_KEY": "fake",
+        }
+
+    def __enter__(self) -> "FakeServices":
+        command = [sys.executable, "-m", "benchmarks.fake_services", "--port", str(self.port)]
+        for name, value in self.options.items():
+            command += [f"--{name.replace('_', '-')}", str(value)]
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_until_up(f"{self.url}/health", process=self.process)
+        return self
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--engine-latency", type=float, default=0.05, help="Seconds per chess-api call")
+    parser.add_argument("--engine-error-rate", type=float, default=0.0, help="Share of chess-api calls answered with 503")
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="Seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="Seconds per generated token")
+    parser.add_argument("--agent-tool-calls", type=int, default=1, help="Tool calls before a ReAct answer")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    app = create_app(args.engine_latency, args.engine_error_rate, args.llm_latency, args.token_latency, args.agent_tool_calls)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
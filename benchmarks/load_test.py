@@ -0,0 +1,281 @@
+"""
+End-to-end load test of the API, offline.
+
+Starts the fake chess-api.com/OpenAI services and the API with `--workers`
+processes (under uvicorn, or forked by src.serve with `--server preload`
+or `--server fork`), drives the selected endpoints with
+`--concurrency` clients, and reports per endpoint the p50/p95/p99 latency
+(and time to first token for streams), the throughput, the peak memory of
+every server process, and the mean time per stage from /metrics.
+
+Agent endpoints (state, player, chat, and best-move with
+BEST_MOVE_MODE=agent) need the embedding model in the local Hugging Face
+cache (HF_HUB_OFFLINE=1). best-move in its default fast mode and game only
+need the fakes; without the model /ready never turns 200, so pass a short
+`--ready-timeout` to start the load after a warning. Caches start empty, so
+each corpus position is evaluated once and then served from the evaluation
+cache. Pass --url to load an API that is already running instead.
+
+    python -m benchmarks.load_test [--endpoints best-move game state] [--requests 500] [--concurrency 16] [--workers 2] [--server preload]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import chess
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+
+from benchmarks.common import FENS, QUERIES, format_latencies, load_games, load_lines, percentiles, process_memory
+from benchmarks.fake_services import FakeServices, free_port, wait_until_up
+
+STARTUP_TIMEOUT = 120
+SERVERS = ("uvicorn", "preload", "fork")
+ENDPOINTS = [
+    "best-move", "best-move/stream", "state", "state/stream", "player", "player/stream", "game", "chat", "chat/stream",
+]
+
+
+def history(game) -> list[dict]:
+    """The game's moves in the chess.js format of ApiRequest.history."""
+    from src.engines import move_flags
+
+    board = game.board()
+    moves = []
+    for move in game.mainline_moves():
+        piece = board.piece_at(move.from_square)
+        moves.append({
+            "color": "w" if piece.color else "b",
+            "flags": move_flags(board, move),
+            "from": chess.square_name(move.from_square),
+            "to": chess.square_name(move.to_square),
+            "piece": chess.piece_symbol(piece.piece_type),
+            "san": board.san(move),
+        })
+        board.push(move)
+    return moves
+
+
+def request_bodies(endpoint: str) -> list[dict]:
+    base = endpoint.removesuffix("/stream")
+    if base in ("best-move", "state"):
+        return [{"fen": fen, "language": "en"} for fen in load_lines(FENS)]
+    if base == "player":
+        return [
+            {"fen": game.end().board().fen(), "player": player, "history": history(game), "language": "en"}
+            for game in load_games() for player in (0, 1)
+        ]
+    if base == "game":
+        return [{"pgn": str(game)} for game in load_games()]
+    if base == "chat":
+        return [{"message": query} for query in load_lines(QUERIES)]
+    raise ValueError(f"Unknown endpoint: {endpoint}")
+
+
+async def send(client: httpx.AsyncClient, endpoint: str, body: dict) -> dict:
+    start = time.perf_counter()
+    first_token = None
+    try:
+        if endpoint.endswith("/stream"):
+            async with client.stream("POST", f"/{endpoint}", json=body) as response:
+                async for line in response.aiter_lines():
+                    if first_token is None and line == "event: token":
+                        first_token = time.perf_counter() - start
+                status = response.status_code
+        else:
+            response = await client.post(f"/{endpoint}", json=body)
+            status = response.status_code
+    except httpx.HTTPError as e:
+        status = repr(e)
+    return {"endpoint": endpoint, "status": status, "seconds": time.perf_counter() - start, "first_token": first_token}
+
+
+async def run_load(url: str, endpoints: list[str], requests: int, concurrency: int, warmup: int) -> tuple[list[dict], float]:
+    bodies = {endpoint: itertools.cycle(request_bodies(endpoint)) for endpoint in endpoints}
+    schedule = itertools.cycle(endpoints)
+    jobs = [(endpoint, next(bodies[endpoint])) for endpoint in itertools.islice(schedule, warmup + requests)]
+    results = []
+
+    async with httpx.AsyncClient(base_url=url, timeout=300, limits=httpx.Limits(max_connections=concurrency)) as client:
+        for endpoint, body in jobs[:warmup]:
+            await send(client, endpoint, body)
+
+        queue = iter(jobs[warmup:])
+
+        async def client_loop():
+            for endpoint, body in queue:
+                results.append(await send(client, endpoint, body))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        return results, time.perf_counter() - start
+
+
+class MemorySampler(threading.Thread):
+    """Peak RSS and last USS/PSS of a server process and its workers, sampled every `interval` seconds."""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak: dict[int, dict] = {}
+        self._stopped = threading.Event()
+
+    def sample(self):
+        for usage in process_memory(self.pid):
+            peak = self.peak.setdefault(usage["pid"], {"rss_mb": 0.0})
+            peak["rss_mb"] = max(peak["rss_mb"], usage["rss_mb"])
+            peak["uss_mb"] = usage["uss_mb"]
+            peak["pss_mb"] = usage["pss_mb"]
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self.sample()
+
+
+def stage_means(url: str) -> dict[str, float]:
+    """Mean milliseconds per stage from the API's /metrics."""
+    totals = defaultdict(lambda: [0.0, 0.0])
+    for family in text_string_to_metric_families(httpx.get(f"{url}/metrics").text):
+        if family.name != "chess_mentor_stage_seconds":
+            continue
+        for sample in family.samples:
+            if sample.name.endswith("_sum"):
+                totals[sample.labels["stage"]][0] += sample.value
+            elif sample.name.endswith("_count"):
+                totals[sample.labels["stage"]][1] += sample.value
+    return {stage: seconds / count * 1000 for stage, (seconds, count) in totals.items() if count}
+
+
+def report(results: list[dict], elapsed: float, memory: dict[int, dict] | None, stages: dict[str, float]) -> dict:
+    summary = {"throughput": len(results) / elapsed, "elapsed": elapsed, "endpoints": {}, "memory": memory, "stages": stages}
+    print(f"{len(results)} requests in {elapsed:.1f}s: {summary['throughput']:.1f} req/s")
+
+    for endpoint in sorted({result["endpoint"] for result in results}):
+        rows = [result for result in results if result["endpoint"] == endpoint]
+        ok = [row["seconds"] for row in rows if row["status"] == 200]
+        first_tokens = [row["first_token"] for row in rows if row["first_token"] is not None]
+        summary["endpoints"][endpoint] = {
+            "requests": len(rows),
+            "errors": len(rows) - len(ok),
+            "latency_ms": percentiles(ok),
+            "first_token_ms": percentiles(first_tokens) if first_tokens else None,
+        }
+        print(f"{endpoint:>17}: {len(rows):5d} req  {len(rows) - len(ok):4d} errors  {format_latencies(ok)}")
+        if first_tokens:
+            print(f"{'first token':>17}:                   {format_latencies(first_tokens)}")
+
+    if memory:
+        print_memory(memory)
+    for stage, ms in sorted(stages.items()):
+        print(f"{stage:>17}: {ms:8.2f}ms mean")
+    return summary
+
+
+def print_memory(memory: dict[int, dict]):
+    for pid, usage in memory.items():
+        pss = f"  PSS {usage['pss_mb']:7.1f} MiB" if usage.get("pss_mb") is not None else ""
+        print(f"{'pid ' + str(pid):>17}: peak RSS {usage['rss_mb']:7.1f} MiB  USS {usage['uss_mb']:7.1f} MiB{pss}")
+    if all(usage.get("pss_mb") is not None for usage in memory.values()):
+        print(f"{'total':>17}: PSS {sum(usage['pss_mb'] for usage in memory.values()):7.1f} MiB")
+
+
+def start_api(port: int, workers: int, env: dict[str, str], server: str = "uvicorn") -> subprocess.Popen:
+    if server == "uvicorn":
+        command = [
+            sys.executable, "-m", "uvicorn", "src.app:app",
+            "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning",
+        ]
+    else:
+        command = [sys.executable, "-m", "src.serve", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+        if server == "fork":
+            command.append("--no-preload")
+    return subprocess.Popen(command, env={**os.environ, **env})
+
+
+def wait_until_ready(url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = httpx.get(f"{url}/ready")
+        if response.status_code == 200:
+            return
+        time.sleep(0.5)
+    print(f"Not ready after {timeout}s, agent endpoints may fail: {json.dumps(response.json())}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", default=["best-move", "game"], choices=ENDPOINTS)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--server", default="uvicorn", choices=SERVERS)
+    parser.add_argument("--url", help="Load an already running API instead of starting one")
+    parser.add_argument("--engine-latency", type=float, default=0.05)
+    parser.add_argument("--engine-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-latency", type=float, default=0.4)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--agent-tool-calls", type=int, default=1)
+    parser.add_argument("--response-cache", action="store_true", help="Serve repeated explanations from the response cache")
+    parser.add_argument("--ready-timeout", type=float, default=300)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    if args.url:
+        results, elapsed = asyncio.run(run_load(args.url, args.endpoints, args.requests, args.concurrency, args.warmup))
+        summary = report(results, elapsed, None, stage_means(args.url))
+    else:
+        fakes = FakeServices(
+            engine_latency=args.engine_latency,
+            engine_error_rate=args.engine_error_rate,
+            llm_latency=args.llm_latency,
+            token_latency=args.token_latency,
+            agent_tool_calls=args.agent_tool_calls,
+        )
+        with fakes as services, tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, "metrics"))
+            env = {
+                **services.env(),
+                "EVAL_CACHE_PATH": os.path.join(tmp, "evaluations.sqlite3"),
+                "GAME_CACHE_PATH": os.path.join(tmp, "games.sqlite3"),
+                "RESPONSE_CACHE_PATH": os.path.join(tmp, "responses.sqlite3"),
+                "RESPONSE_CACHE_ENABLED": str(args.response_cache).lower(),
+                "LOG_LEVEL": "WARNING",
+                "PROMETHEUS_MULTIPROC_DIR": os.path.join(tmp, "metrics"),
+            }
+            port = free_port()
+            url = f"http://127.0.0.1:{port}"
+            api = start_api(port, args.workers, env, args.server)
+            try:
+                wait_until_up(f"{url}/", timeout=STARTUP_TIMEOUT, process=api)
+                wait_until_ready(url, args.ready_timeout)
+                sampler = MemorySampler(api.pid)
+                sampler.start()
+                results, elapsed = asyncio.run(run_load(url, args.endpoints, args.requests, args.concurrency, args.warmup))
+                sampler.stop()
+                summary = report(results, elapsed, sampler.peak, stage_means(url))
+            finally:
+                api.terminate()
+                api.wait()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
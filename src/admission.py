@@ -0,0 +1,269 @@
+"""
+Admission control for the expensive endpoints.
+
+Every admitted request holds a slot of its endpoint (a `/stream` variant
+shares the slots of its endpoint) and one of the server-wide slots until its
+response, streamed body included, is sent. Requests that find no free slot
+wait in one priority queue, ordered by endpoint priority and then by
+deadline, so cheap interactive calls like `/best-move` pass `/player`
+analyses that arrived earlier. When a slot frees up, the first waiter whose
+endpoint has room is admitted.
+
+Overload fails fast instead of timing out:
+
+- a full queue answers 503 with a Retry-After estimated from the recent
+  service time of the endpoint; a waiter of a more urgent endpoint takes
+  the place of the least urgent one, which gets the 503 instead;
+- clients may send `X-Request-Timeout-Ms`; a request still queued or still
+  being served, before any byte of its response, when that deadline passes
+  is dropped with 504. The header is capped at ADMISSION_MAX_WAIT, and
+  invalid or non-positive values are ignored. Without the header, requests
+  wait in the queue at most ADMISSION_MAX_WAIT seconds.
+
+Paths without a configured limit (health, readiness, metrics) bypass the
+queue.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import math
+from dataclasses import dataclass, field
+from functools import cache
+
+from src.config import get_agent_settings
+from src.metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED, ADMISSION_WAIT_SECONDS
+
+TIMEOUT_HEADER = b"x-request-timeout-ms"
+# Weight of the latest request in the moving average of service times.
+SERVICE_TIME_ALPHA = 0.2
+
+
+class Rejected(Exception):
+    def __init__(self, status: int, reason: str, detail: str, retry_after: int | None = None):
+        super().__init__(detail)
+        self.status = status
+        self.reason = reason
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+@dataclass(order=True)
+class Waiter:
+    priority: int
+    deadline: float
+    seq: int
+    endpoint: str = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        limits: dict[str, int],
+        priorities: dict[str, int],
+        max_concurrency: int = 64,
+        queue_size: int = 128,
+        max_wait: float = 10.0,
+    ):
+        self.limits = limits
+        self.priorities = priorities
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+
+        self.in_flight: dict[str, int] = {endpoint: 0 for endpoint in limits}
+        self.service_seconds: dict[str, float] = {}
+        self._total = 0
+        self._queue: list[Waiter] = []
+        self._seq = itertools.count()
+
+    def endpoint(self, path: str) -> str | None:
+        """The endpoint whose slots a path uses, or None when it is not admission controlled."""
+        endpoint = path.removesuffix("/stream")
+        return endpoint if endpoint in self.limits else None
+
+    def _has_room(self, endpoint: str) -> bool:
+        return self._total < self.max_concurrency and self.in_flight[endpoint] < self.limits[endpoint]
+
+    def _admit(self, endpoint: str):
+        self._total += 1
+        self.in_flight[endpoint] += 1
+        ADMISSION_IN_FLIGHT.labels(endpoint).inc()
+
+    def retry_after(self, endpoint: str) -> int:
+        """Seconds until the endpoint has likely worked through the requests ahead."""
+        waiting = sum(1 for waiter in self._queue if waiter.endpoint == endpoint)
+        seconds = self.service_seconds.get(endpoint, 1.0) * (waiting + 1) / self.limits[endpoint]
+        return max(1, math.ceil(seconds))
+
+    def _remove(self, waiter: Waiter):
+        self._queue.remove(waiter)
+        heapq.heapify(self._queue)
+        ADMISSION_QUEUE_DEPTH.labels(waiter.endpoint).dec()
+
+    def _evict_for(self, priority: int) -> bool:
+        """Reject the least urgent waiter if it is less urgent than `priority`."""
+        worst = max(self._queue)
+        if worst.priority <= priority:
+            return False
+        self._remove(worst)
+        worst.future.set_exception(Rejected(
+            503, "evicted", "Server busy, request displaced by more urgent work", self.retry_after(worst.endpoint),
+        ))
+        return True
+
+    async def acquire(self, endpoint: str, deadline: float):
+        """Wait for a slot of `endpoint` until `deadline` (event loop time); raises Rejected."""
+        # Whoever is queued is blocked by the limit of its own endpoint, so a
+        # request whose endpoint has room does not overtake anyone.
+        if self._has_room(endpoint):
+            self._admit(endpoint)
+            ADMISSION_WAIT_SECONDS.labels(endpoint, "admitted").observe(0)
+            return
+
+        priority = self.priorities.get(endpoint, max(self.priorities.values(), default=0))
+        if len(self._queue) >= self.queue_size and not self._evict_for(priority):
+            ADMISSION_REJECTED.labels(endpoint, "queue_full").inc()
+            raise Rejected(503, "queue_full", "Server busy, try again later", self.retry_after(endpoint))
+
+        loop = asyncio.get_running_loop()
+        waiter = Waiter(priority, deadline, next(self._seq), endpoint, loop.create_future())
+        heapq.heappush(self._queue, waiter)
+        ADMISSION_QUEUE_DEPTH.labels(endpoint).inc()
+
+        start = loop.time()
+        try:
+            async with asyncio.timeout_at(deadline):
+                await asyncio.shield(waiter.future)
+        except TimeoutError:
+            if waiter.future.done() and waiter.future.exception() is None:
+                # Admitted at the same moment the deadline passed.
+                self.release(endpoint)
+            elif not waiter.future.done():
+                self._remove(waiter)
+                waiter.future.cancel()
+            ADMISSION_WAIT_SECONDS.labels(endpoint, "expired").observe(loop.time() - start)
+            ADMISSION_REJECTED.labels(endpoint, "deadline").inc()
+            raise Rejected(504, "deadline", "Deadline exceeded while queued") from None
+        except Rejected:
+            ADMISSION_WAIT_SECONDS.labels(endpoint, "evicted").observe(loop.time() - start)
+            ADMISSION_REJECTED.labels(endpoint, "evicted").inc()
+            raise
+        except asyncio.CancelledError:
+            # The client went away while queued.
+            if waiter.future.done() and waiter.future.exception() is None:
+                self.release(endpoint)
+            elif not waiter.future.done():
+                self._remove(waiter)
+                waiter.future.cancel()
+            raise
+        ADMISSION_WAIT_SECONDS.labels(endpoint, "admitted").observe(loop.time() - start)
+
+    def release(self, endpoint: str, seconds: float | None = None):
+        self._total -= 1
+        self.in_flight[endpoint] -= 1
+        ADMISSION_IN_FLIGHT.labels(endpoint).dec()
+        if seconds is not None:
+            average = self.service_seconds.get(endpoint, seconds)
+            self.service_seconds[endpoint] = average + SERVICE_TIME_ALPHA * (seconds - average)
+        self._dispatch()
+
+    def _dispatch(self):
+        """Admit queued waiters, most urgent first, while their endpoints have room."""
+        blocked = []
+        while self._queue and self._total < self.max_concurrency:
+            waiter = heapq.heappop(self._queue)
+            if not self._has_room(waiter.endpoint):
+                blocked.append(waiter)
+                continue
+            ADMISSION_QUEUE_DEPTH.labels(waiter.endpoint).dec()
+            self._admit(waiter.endpoint)
+            waiter.future.set_result(None)
+        for waiter in blocked:
+            heapq.heappush(self._queue, waiter)
+
+
+async def send_rejection(send, rejection: Rejected):
+    headers = [(b"content-type", b"application/json")]
+    if rejection.retry_after is not None:
+        headers.append((b"retry-after", str(rejection.retry_after).encode()))
+    await send({"type": "http.response.start", "status": rejection.status, "headers": headers})
+    await send({"type": "http.response.body", "body": json.dumps({"detail": rejection.detail}).encode()})
+
+
+class AdmissionMiddleware:
+    """ASGI middleware that runs every request of a controlled endpoint through the AdmissionController."""
+
+    def __init__(self, app, controller: "AdmissionController | None" = None):
+        self.app = app
+        self.controller = controller or get_admission_controller()
+
+    def deadline(self, scope, now: float) -> tuple[float, bool]:
+        """The request deadline in event loop time, and whether the client set it."""
+        for name, value in scope["headers"]:
+            if name == TIMEOUT_HEADER:
+                try:
+                    timeout = float(value) / 1000
+                except ValueError:
+                    break
+                # nan, inf and non-positive values would never fire or fire at once; treat them as absent.
+                if not math.isfinite(timeout) or timeout <= 0:
+                    break
+                return now + min(timeout, self.controller.max_wait), True
+        return now + self.controller.max_wait, False
+
+    async def __call__(self, scope, receive, send):
+        endpoint = self.controller.endpoint(scope["path"]) if scope["type"] == "http" else None
+        if endpoint is None or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        loop = asyncio.get_running_loop()
+        deadline, client_deadline = self.deadline(scope, loop.time())
+        try:
+            await self.controller.acquire(endpoint, deadline)
+        except Rejected as rejection:
+            await send_rejection(send, rejection)
+            return
+
+        start = loop.time()
+        try:
+            if not client_deadline:
+                await self.app(scope, receive, send)
+                return
+
+            timeout = asyncio.timeout_at(deadline)
+            started = False
+
+            async def send_with_start(message):
+                nonlocal started
+                if not started and not timeout.expired():
+                    # Once the response has started it runs to completion; a 504 can no longer be sent.
+                    timeout.reschedule(None)
+                started = True
+                await send(message)
+
+            try:
+                async with timeout:
+                    await self.app(scope, receive, send_with_start)
+            except TimeoutError:
+                if not timeout.expired():
+                    raise
+                ADMISSION_REJECTED.labels(endpoint, "deadline").inc()
+                if not started:
+                    await send_rejection(send, Rejected(504, "deadline", "Deadline exceeded"))
+        finally:
+            self.controller.release(endpoint, loop.time() - start)
+
+
+@cache
+def get_admission_controller() -> AdmissionController:
+    settings = get_agent_settings()
+    return AdmissionController(
+        limits=settings.admission_limits,
+        priorities=settings.admission_priorities,
+        max_concurrency=settings.admission_max_concurrency,
+        queue_size=settings.admission_queue_size,
+        max_wait=settings.admission_max_wait,
+    )
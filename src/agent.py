@@ -1,36 +1,311 @@
-from llama_index.core import PromptTemplate, Settings
+import asyncio
+import json
+import logging
+from typing import AsyncIterator
+
+from llama_index.core import PromptTemplate
 from llama_index.core.agent import ReActAgent
-from llama_index.llms.openai import OpenAI
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.core.callbacks import CallbackManager, CBEventType, EventPayload
+from llama_index.core.chat_engine.types import AgentChatResponse
+from llama_index.core.llms import LLM, ChatMessage, ChatResponse, MessageRole
+from llama_index.core.llms.function_calling import FunctionCallingLLM
+from llama_index.core.memory import BaseMemory
+from llama_index.core.tools import BaseTool, ToolMetadata, ToolOutput
+from llama_index.core.tools.calling import acall_tool
+from llama_index.core.utilities.token_counting import TokenCounter
 
-from src.prompts import magnus_carlsen_prompt_text
 from src.config import get_agent_settings
-from src.tools import best_move_tool, analize_move_tool, analize_board_tool, analize_player_tool, chess_expert_tool
+from src.metrics import AGENT_BUDGET_EXHAUSTED, current_endpoint
+from src.prompts import (
+    magnus_carlsen_prompt_text,
+    function_calling_prompt_text,
+    partial_answer_prompt_text,
+    best_move_explanation_tpl,
+    best_move_batch_explanation_tpl,
+)
+from src.tools import best_move_tool, analize_move_tool, analize_board_tool, analize_player_tool
+
+AGENT_MODES = ("react", "function_calling")
+
+
+def endpoint_budget(budgets: dict[str, int], endpoint: str) -> int | None:
+    """The budget of an endpoint, shared with its /stream variant, else the "default" one."""
+    return budgets.get(endpoint.removesuffix("/stream"), budgets.get("default"))
+
+
+class StreamingAnswer:
+    """The streamed answer of a FunctionCallingChessAgent, consumed like a StreamingAgentChatResponse."""
+
+    def __init__(self, tokens: AsyncIterator[str]):
+        self._tokens = tokens
+        self.response = ""
+
+    async def async_response_gen(self) -> AsyncIterator[str]:
+        async for token in self._tokens:
+            self.response += token
+            yield token
+
+    def __str__(self) -> str:
+        return self.response
+
+
+class FunctionCallingChessAgent:
+    """
+    Agent loop on the LLM's native function calling. Every tool call of one
+    LLM turn runs concurrently, so a turn asking for the best move, the board
+    analysis and a chess_expert lookup costs about as much as the slowest of
+    them, where the ReAct loop spends one LLM turn per tool.
+
+    A run takes at most `max_iterations` LLM turns and stops calling tools
+    once it has used `token_budget` LLM tokens; either way, one last turn
+    without tools answers from what the tools returned so far. Only the
+    question and the final answer are written to `memory`. When streaming,
+    an answer given in a turn that could have called tools arrives in one
+    piece, since no text of a turn is sent before it is known to be final.
+    """
+
+    def __init__(
+        self,
+        llm: FunctionCallingLLM,
+        tools: list[BaseTool],
+        memory: BaseMemory,
+        system_prompt: str,
+        max_iterations: int = 6,
+        token_budget: int | None = None,
+        callback_manager: CallbackManager | None = None,
+    ):
+        if not llm.metadata.is_function_calling_model:
+            raise ValueError(f"{llm.metadata.model_name} does not support function calling")
+        self.llm = llm
+        self.tools = tools
+        self.memory = memory
+        self.system_prompt = system_prompt
+        self.max_iterations = max_iterations
+        self.token_budget = token_budget
+        self.callback_manager = callback_manager or llm.callback_manager
+        self._tools_by_name = {tool.metadata.name: tool for tool in tools}
+        self._token_counter = TokenCounter()
+
+    def _tokens(self, messages: list[ChatMessage], response: ChatResponse) -> int:
+        # OpenAI reports usage on complete responses; streamed ones are estimated.
+        raw = response.raw
+        usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+        total = usage.get("total_tokens") if isinstance(usage, dict) else getattr(usage, "total_tokens", None)
+        if total:
+            return total
+        return (
+            self._token_counter.estimate_tokens_in_messages(messages)
+            + self._token_counter.get_string_tokens(response.message.content or "")
+        )
+
+    async def _call_tool(self, tool_call) -> ChatMessage:
+        tool = self._tools_by_name.get(tool_call.tool_name)
+        metadata = tool.metadata if tool is not None else ToolMetadata(description="", name=tool_call.tool_name)
+        arguments = json.dumps(tool_call.tool_kwargs)
+        with self.callback_manager.event(
+            CBEventType.FUNCTION_CALL,
+            payload={EventPayload.FUNCTION_CALL: arguments, EventPayload.TOOL: metadata},
+        ) as event:
+            if tool is None:
+                output = ToolOutput(
+                    content=f"Tool {tool_call.tool_name} does not exist",
+                    tool_name=tool_call.tool_name,
+                    raw_input=tool_call.tool_kwargs,
+                    raw_output=None,
+                    is_error=True,
+                )
+            else:
+                output = await acall_tool(tool, tool_call.tool_kwargs)
+            event.on_end(payload={EventPayload.FUNCTION_OUTPUT: str(output)})
+
+        return ChatMessage(
+            role=MessageRole.TOOL,
+            content=str(output),
+            additional_kwargs={"name": tool_call.tool_name, "tool_call_id": tool_call.tool_id},
+        )
+
+    async def _turn(self, messages: list[ChatMessage], stream: bool, use_tools: bool = True) -> AsyncIterator[str | ChatResponse]:
+        """
+        One LLM turn: yields the answer text, then the complete response. A
+        turn that may call tools is only known to be the answer once it is
+        complete, so only the final turn without tools streams its text.
+        """
+        if use_tools:
+            response = await self.llm.achat_with_tools(self.tools, chat_history=messages, allow_parallel_tool_calls=True)
+            if not self.llm.get_tool_calls_from_response(response, error_on_no_tool_call=False):
+                yield response.message.content or ""
+            yield response
+            return
 
-SETTINGS = get_agent_settings()
+        if not stream:
+            response = await self.llm.achat(messages)
+            yield response.message.content or ""
+            yield response
+            return
 
-llm = OpenAI(model=SETTINGS.openai_model, api_key=SETTINGS.openai_api_key)
-embed_model = HuggingFaceEmbedding(model_name=SETTINGS.hf_embeddings_model)
-Settings.embed_model = embed_model
-Settings.llm = llm
+        response = None
+        async for response in await self.llm.astream_chat(messages):
+            if response.delta:
+                yield response.delta
+        yield response
+
+    async def _answer(self, message: str, stream: bool) -> AsyncIterator[str]:
+        # Without an open trace every LLM call starts its own, detached from the agent step.
+        with self.callback_manager.as_trace("chat"):
+            async for token in self._run(message, stream):
+                yield token
+
+    async def _run(self, message: str, stream: bool) -> AsyncIterator[str]:
+        endpoint = current_endpoint.get()
+        user_message = ChatMessage(role=MessageRole.USER, content=message)
+        messages = [
+            ChatMessage(role=MessageRole.SYSTEM, content=self.system_prompt),
+            *self.memory.get(input=message),
+            user_message,
+        ]
+        answer = []
+        tokens = 0
+        exhausted = "iterations"
+        tool_calls = True
+        for _ in range(self.max_iterations):
+            if self.token_budget is not None and tokens >= self.token_budget:
+                exhausted = "tokens"
+                break
+            with self.callback_manager.event(CBEventType.AGENT_STEP, payload={EventPayload.MESSAGES: [message]}):
+                response = None
+                async for item in self._turn(messages, stream):
+                    if isinstance(item, str):
+                        answer.append(item)
+                        yield item
+                    else:
+                        response = item
+                tokens += self._tokens(messages, response)
+                tool_calls = self.llm.get_tool_calls_from_response(response, error_on_no_tool_call=False)
+                if not tool_calls:
+                    break
+                messages.append(response.message)
+                messages.extend(await asyncio.gather(*(self._call_tool(tool_call) for tool_call in tool_calls)))
+
+        if tool_calls:
+            # Out of budget with tool results the LLM has not answered from yet.
+            AGENT_BUDGET_EXHAUSTED.labels(endpoint, exhausted).inc()
+            messages.append(ChatMessage(role=MessageRole.USER, content=partial_answer_prompt_text))
+            with self.callback_manager.event(CBEventType.AGENT_STEP, payload={EventPayload.MESSAGES: [message]}):
+                async for item in self._turn(messages, stream, use_tools=False):
+                    if isinstance(item, str):
+                        answer.append(item)
+                        yield item
+
+        self.memory.put(user_message)
+        self.memory.put(ChatMessage(role=MessageRole.ASSISTANT, content="".join(answer)))
+
+    async def achat(self, message: str) -> AgentChatResponse:
+        return AgentChatResponse(response="".join([token async for token in self._answer(message, stream=False)]))
+
+    async def aquery(self, message: str) -> AgentChatResponse:
+        return await self.achat(message)
+
+    async def astream_chat(self, message: str) -> StreamingAnswer:
+        return StreamingAnswer(self._answer(message, stream=True))
+
+
+Agent = ReActAgent | FunctionCallingChessAgent
 
 
-    
 class ChessAgent:
-    def __init__(self):
-        self.agent = ReActAgent.from_tools(
-            [
-                best_move_tool,
-                analize_move_tool,
-                analize_board_tool,
-                analize_player_tool,
-                chess_expert_tool,
-            ],
-            verbose=True,
+    """
+    Builds agents around a caller-provided memory: ReAct agents, or with
+    AGENT_MODE=function_calling, FunctionCallingChessAgent bounded by the
+    iteration and token budgets of the current endpoint. The LLM, the tools
+    and the RAG index behind them are shared by every agent it creates.
+
+    AGENT_MAX_ITERATIONS and AGENT_TOKEN_BUDGET apply to function_calling
+    only. ReActAgent's max_iterations counts reasoning steps rather than LLM
+    turns and fails the request when reached, so ReAct agents keep
+    llama-index's limit.
+    """
+
+    def __init__(self, llm: LLM, chess_expert_tool: BaseTool):
+        self.llm = llm
+        self.tools = [
+            best_move_tool,
+            analize_move_tool,
+            analize_board_tool,
+            analize_player_tool,
+            chess_expert_tool,
+        ]
+        self.system_prompt = PromptTemplate(magnus_carlsen_prompt_text)
+        self.mode = get_agent_settings().agent_mode
+        if self.mode not in AGENT_MODES:
+            raise ValueError(f"Unknown agent mode: {self.mode}")
+
+    def create_agent(self, memory: BaseMemory) -> Agent:
+        if self.mode == "function_calling":
+            settings = get_agent_settings()
+            endpoint = current_endpoint.get()
+            return FunctionCallingChessAgent(
+                self.llm,
+                self.tools,
+                memory,
+                function_calling_prompt_text,
+                max_iterations=endpoint_budget(settings.agent_max_iterations, endpoint) or 6,
+                token_budget=endpoint_budget(settings.agent_token_budget, endpoint),
+            )
+
+        # The ReAct trace is printed only when debugging; /metrics has the iteration counts.
+        verbose = logging.getLogger(__name__).isEnabledFor(logging.DEBUG)
+        agent = ReActAgent.from_tools(self.tools, llm=self.llm, memory=memory, verbose=verbose)
+        agent.update_prompts({"agent_worker:system_prompt": self.system_prompt})
+        return agent
+
+
+class BestMoveExplainer:
+    """
+    Explains an already computed engine result with a single LLM call,
+    skipping the ReAct loop and its duplicate tool calls.
+    """
+
+    def __init__(self, llm: LLM):
+        self.llm = llm
+
+    def get_prompt(self, fen: str, best_move: dict, language: str, board_analysis: dict | None = None) -> str:
+        return best_move_explanation_tpl.format(
+            fen=fen,
+            best_move=json.dumps(best_move),
+            board_analysis=f"Board analysis:\n{json.dumps(board_analysis)}\n" if board_analysis else "",
+            language=language,
         )
 
-        system_prompt = PromptTemplate(magnus_carlsen_prompt_text)
-        self.agent.update_prompts({"agent_worker:system_prompt": system_prompt})
+    async def aexplain(self, fen: str, best_move: dict, language: str, board_analysis: dict | None = None) -> str:
+        response = await self.llm.acomplete(self.get_prompt(fen, best_move, language, board_analysis))
+        return response.text
 
-    def get_agent(self) -> ReActAgent:
-        return self.agent
+    async def astream_explain(
+        self, fen: str, best_move: dict, language: str, board_analysis: dict | None = None
+    ) -> AsyncIterator[str]:
+        response = await self.llm.astream_complete(self.get_prompt(fen, best_move, language, board_analysis))
+        async for chunk in response:
+            yield chunk.delta or ""
+
+    async def aexplain_batch(self, positions: list[tuple[str, dict]], language: str) -> list[str]:
+        """
+        Explain several (fen, best_move) pairs with one LLM call. Falls back
+        to one call per position if the answer is not a list of the right length.
+        """
+        prompt = best_move_batch_explanation_tpl.format(
+            positions="\n".join(
+                f"{i}. FEN: \"{fen}\"; best move: {json.dumps(best_move)}"
+                for i, (fen, best_move) in enumerate(positions, start=1)
+            ),
+            language=language,
+        )
+        response = await self.llm.acomplete(prompt)
+        try:
+            explanations = json.loads(response.text.strip().removeprefix("```json").strip("`"))
+        except json.JSONDecodeError:
+            explanations = None
+        if isinstance(explanations, list) and len(explanations) == len(positions):
+            return [str(explanation) for explanation in explanations]
+        return list(await asyncio.gather(
+            *(self.aexplain(fen, best_move, language) for fen, best_move in positions)
+        ))
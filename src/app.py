@@ -1,20 +1,113 @@
-from fastapi import FastAPI, Depends
-from llama_index.core.agent import ReActAgent
-from functools import cache
+import io
+import json
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
+from uuid import uuid4
 
-from src.models import ApiRequest, ApiResponse, ChatApiRequest, Move
-from src.agent import ChessAgent
-from src.tools import get_best_move
+from fastapi import FastAPI, Depends, Header, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from src.models import ApiRequest, ApiResponse, ChatApiRequest, GameRequest, Move
+from src.admission import AdmissionMiddleware
+from src.agent import Agent, ChessAgent, BestMoveExplainer
+from src.bulk import read_items, run_bulk
+from src.cache import get_response_cache, response_key
+from src.concurrency import AsyncSingleFlight
+from src.config import get_agent_settings
+from src.engines import get_evaluation_backend
+from src.game_analysis import aanalyze_game, parse_game
+from src.logs import configure_logging
+from src.metrics import MetricsMiddleware, render
+from src.prefetch import PrefetchUser, get_prefetcher
+from src.registry import get_registry
+from src.sessions import get_session_store, new_memory
+from src.prompts import (
+    magnus_carlsen_prompt_text,
+    function_calling_prompt_text,
+    best_move_prompt_tpl,
+    best_move_explanation_tpl,
+    board_state_prompt_tpl,
+    player_analysis_prompt_tpl,
+)
+from src.streaming import agent_tokens, event_stream_response, stream_agent_events
+from src.tools import aget_best_move, aanalize_board
 from fastapi.middleware.cors import CORSMiddleware
 
 
-@cache
-def get_agent() -> ReActAgent:
-    return ChessAgent().get_agent()
+SETTINGS = get_agent_settings()
+configure_logging()
+
+
+async def get_chess_agent() -> ChessAgent:
+    return await get_registry().aget("chess_agent")
+
+
+def get_agent(chess_agent: ChessAgent = Depends(get_chess_agent)) -> Agent:
+    """A stateless agent: position endpoints never see other requests' history."""
+    return chess_agent.create_agent(new_memory())
+
+
+async def load_agent() -> Agent:
+    """get_agent for handlers that need the agent only on some paths, so the others never wait on the RAG index."""
+    return get_agent(await get_chess_agent())
+
+
+def get_session_id(x_session_id: str | None = Header(default=None)) -> str:
+    return x_session_id or uuid4().hex
+
+
+async def get_explainer() -> BestMoveExplainer:
+    return await get_registry().aget("explainer")
 
 
-app = FastAPI(title="Chess Mentor API")
+def use_fast_path(x_agent_mode: str | None = Header(default=None)) -> bool:
+    """`X-Agent-Mode: agent` falls back to the full agent, `fast` forces the fast path."""
+    return (x_agent_mode or SETTINGS.best_move_mode) == "fast"
 
+
+def get_user_id(request: Request, x_session_id: str | None = Header(default=None)) -> PrefetchUser:
+    """
+    Who prefetch budgets and cancellation apply to. Budgets follow the client
+    address; X-Session-Id only tells apart sessions sharing an address, so it
+    cannot reach another client's prefetch or reset a budget. Behind a
+    reverse proxy, run uvicorn with --forwarded-allow-ips set to the proxy:
+    it then takes the address from X-Forwarded-For, which it ignores from
+    any other peer.
+    """
+    return PrefetchUser(request.client.host if request.client else "anonymous", x_session_id or None)
+
+
+async def prefetch_next(req: ApiRequest, user: PrefetchUser = Depends(get_user_id)) -> AsyncIterator[None]:
+    """Mark a position request as foreground work and, once it is served, prefetch its likely continuations."""
+    prefetcher = get_prefetcher()
+    if not prefetcher.running:
+        yield
+        return
+    with prefetcher.foreground(user):
+        yield
+    prefetcher.submit(user, req.fen, req.language, req.player, req.next_move.san if req.next_move else None)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    registry = get_registry()
+    if SETTINGS.eager_startup:
+        registry.start()
+    prefetcher = get_prefetcher()
+    if SETTINGS.prefetch_enabled:
+        explanations = SETTINGS.prefetch_explanations and SETTINGS.response_cache_enabled
+        prefetcher.start(explain=prefetch_explanation if explanations else None)
+    yield
+    await prefetcher.stop()
+    await registry.stop()
+    await get_evaluation_backend().aclose()
+
+
+app = FastAPI(title="Chess Mentor API", lifespan=lifespan)
+
+# Innermost, so rejections still get CORS headers and are counted by the metrics.
+if SETTINGS.admission_enabled:
+    app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -22,23 +115,145 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 
 @app.get("/")
-def get_health():
+async def get_health():
     return "Server is running"
 
 
-@app.post("/best-move")
-def calculate_best_move(req: ApiRequest, agent: ReActAgent = Depends(get_agent)):
-    best_move = get_best_move(fen=req.fen)
-    prompt = f"""
-        Given this position in the chessboard in FEN notation: "{req.fen}".
-        Can you provide the next best move I can do,
-        then explain it as a chess master that is teaching me how to improve my games.
-        Summarize your answer in one short paragraph in the following language: {req.language}.
+@app.get("/ready")
+async def get_readiness():
+    """503 until the LLM, embedding model and RAG index have loaded; `/` only reports liveness."""
+    registry = get_registry()
+    return JSONResponse(registry.status(), status_code=200 if registry.ready else 503)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: per-stage latencies, tool calls, LLM tokens and agent iterations by endpoint."""
+    content, content_type = render()
+    return Response(content, media_type=content_type)
+
+
+def best_move_prompt(req: ApiRequest) -> str:
+    return best_move_prompt_tpl.format(fen=req.fen, language=req.language)
+
+
+def board_state_prompt(req: ApiRequest) -> str:
+    return board_state_prompt_tpl.format(fen=req.fen, language=req.language)
+
+
+def player_analysis_prompt(req: ApiRequest) -> str:
+    return player_analysis_prompt_tpl.format(
+        history=req.history,
+        player="white" if req.player == 1 else "black",
+        player_id=req.player,
+        san_moves=[move.san for move in req.history],
+        language=req.language,
+    )
+
+
+async def fast_path_board_analysis(req: ApiRequest) -> dict | None:
+    if not SETTINGS.fast_path_board_analysis:
+        return None
+    return await aanalize_board(req.fen)
+
+
+single_flight = AsyncSingleFlight()
+
+
+# The agent's system prompt is part of what an agent answer depends on.
+AGENT_PROMPT_TEXT = function_calling_prompt_text if SETTINGS.agent_mode == "function_calling" else magnus_carlsen_prompt_text
+
+
+def explanation_key(endpoint: str, req: ApiRequest, *templates: str) -> str:
+    return response_key(endpoint, req.fen, req.language, SETTINGS.openai_model, "\n".join(templates))
+
+
+def best_move_key(req: ApiRequest, fast_path: bool) -> str:
+    if fast_path:
+        variant = f"board_analysis:{SETTINGS.tool_verbosity}" if SETTINGS.fast_path_board_analysis else "engine_only"
+        return explanation_key("best-move", req, best_move_explanation_tpl.template, variant)
+    return explanation_key("best-move", req, AGENT_PROMPT_TEXT, best_move_prompt_tpl.template)
+
+
+def board_state_key(req: ApiRequest) -> str:
+    return explanation_key("state", req, AGENT_PROMPT_TEXT, board_state_prompt_tpl.template)
+
+
+async def cached_explanation(key: str, explain: Callable[[], Awaitable[str]]) -> str:
+    """
+    Serve an LLM explanation from the response cache, generating and storing
+    it on a miss. Concurrent misses for the same key share one LLM call.
     """
-    response = agent.query(prompt)
+    if not SETTINGS.response_cache_enabled:
+        return await explain()
+
+    response_cache = get_response_cache()
+    cached = await response_cache.aget(key)
+    if cached is not None:
+        return cached["agent_response"]
+
+    async def explain_and_store() -> str:
+        agent_response = await explain()
+        await response_cache.aset(key, {"agent_response": agent_response})
+        return agent_response
+
+    if SETTINGS.response_cache_single_flight:
+        return await single_flight.do(key, explain_and_store)
+    return await explain_and_store()
+
+
+async def cached_tokens(key: str, stream: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+    """Streaming counterpart of cached_explanation; a hit is sent as a single token."""
+    if not SETTINGS.response_cache_enabled:
+        async for token in stream():
+            yield token
+        return
+
+    response_cache = get_response_cache()
+    cached = await response_cache.aget(key)
+    if cached is not None:
+        yield cached["agent_response"]
+        return
+
+    answer = []
+    async for token in stream():
+        answer.append(token)
+        yield token
+    await response_cache.aset(key, {"agent_response": "".join(answer)})
+
+
+async def prefetch_explanation(fen: str, language: str):
+    """Generate the fast path best-move explanation of a position into the response cache."""
+    req = ApiRequest(fen=fen, language=language)
+    best_move = await aget_best_move(fen=fen)
+    explainer = await get_explainer()
+
+    async def explain() -> str:
+        return await explainer.aexplain(fen, best_move, language, await fast_path_board_analysis(req))
+
+    await cached_explanation(best_move_key(req, fast_path=True), explain)
+
+
+@app.post("/best-move", dependencies=[Depends(prefetch_next)])
+async def calculate_best_move(
+    req: ApiRequest,
+    explainer: BestMoveExplainer = Depends(get_explainer),
+    fast_path: bool = Depends(use_fast_path),
+):
+    best_move = await aget_best_move(fen=req.fen)
+
+    async def explain() -> str:
+        if fast_path:
+            board_analysis = await fast_path_board_analysis(req)
+            return await explainer.aexplain(req.fen, best_move, req.language, board_analysis)
+        agent = await load_agent()
+        return str(await agent.aquery(best_move_prompt(req)))
+
+    response = await cached_explanation(best_move_key(req, fast_path), explain)
     return ApiResponse(
         message="Best move calculated succesfully",
         agent_response=str(response),
@@ -46,54 +261,150 @@ def calculate_best_move(req: ApiRequest, agent: ReActAgent = Depends(get_agent))
     )
 
 
-@app.post("/state")
-def calculate_board_state(req: ApiRequest, agent: ReActAgent = Depends(get_agent)):
-    prompt = f"""
-        Given this position in the chessboard in FEN notation: "{req.fen}".
-        Provide an analisys of the current board state.
+@app.post("/best-move/stream", dependencies=[Depends(prefetch_next)])
+async def stream_best_move(
+    req: ApiRequest,
+    explainer: BestMoveExplainer = Depends(get_explainer),
+    fast_path: bool = Depends(use_fast_path),
+):
+    best_move = await aget_best_move(fen=req.fen)
 
-        Once you have the information you need, please explain it as a chess master that is teaching me how to improve my games.
-        I want to understand the board state and how to take advantage of it.
-        Please tell me the strategy I should follow to win the game.
+    async def stream() -> AsyncIterator[str]:
+        if fast_path:
+            board_analysis = await fast_path_board_analysis(req)
+            tokens = explainer.astream_explain(req.fen, best_move, req.language, board_analysis)
+        else:
+            agent = await load_agent()
+            tokens = agent_tokens(lambda: agent.astream_chat(best_move_prompt(req)))
+        async for token in tokens:
+            yield token
 
-        Summarize your answer in a small list containing the main insights of the game, make sure each line is a relevant insight only,
-        not trivial information, 5 items are enough and each item should be at most 1 line.
-        Don't use markdown or any other special formatting, just plain text.
-        Don't use specific values, just general insights about the board state.
-        Don't make a comment at the end of the list, just the insights IMPORTANT.
-        Use this language for your answer: {req.language}.
-    """
-    response = agent.query(prompt)
+    return event_stream_response(stream_agent_events(
+        cached_tokens(best_move_key(req, fast_path), stream),
+        message="Best move calculated succesfully",
+        data=best_move,
+    ))
+
+
+@app.post("/state", dependencies=[Depends(prefetch_next)])
+async def calculate_board_state(req: ApiRequest, agent: Agent = Depends(get_agent)):
+    async def explain() -> str:
+        return str(await agent.aquery(board_state_prompt(req)))
+
+    response = await cached_explanation(board_state_key(req), explain)
     return ApiResponse(
         message="Board state generated succesfully",
         agent_response=str(response),
     )
 
 
+@app.post("/state/stream", dependencies=[Depends(prefetch_next)])
+async def stream_board_state(req: ApiRequest, agent: Agent = Depends(get_agent)):
+    return event_stream_response(stream_agent_events(
+        cached_tokens(
+            board_state_key(req),
+            lambda: agent_tokens(lambda: agent.astream_chat(board_state_prompt(req))),
+        ),
+        message="Board state generated succesfully",
+    ))
+
+
 @app.post("/player")
-def analyze_player(req: ApiRequest, agent: ReActAgent = Depends(get_agent)):
-    player = "white" if req.player == 1 else "black"
-    prompt = f"""
-        Given the following moves: {req.history}.
-        Analyze the game state for each movement of the player {player} represented by {req.player},
-        for this use the san moves: {[move.san for move in req.history]}.
-        Provide a short paragraph explaining how the player is playing during the match.
-        Don't use markdown or any other special formatting, just plain text.
-        Don't use specific values, just general insights about the player's strategy.
-        Don't use chess notation, translate it to pieces movements in natural language IMPORTANT.
-        Use this language for your answer: {req.language}.
-    """
-    response = agent.query(prompt)
+async def analyze_player(req: ApiRequest, agent: Agent = Depends(get_agent)):
+    response = await agent.aquery(player_analysis_prompt(req))
     return ApiResponse(
         message="Match analysis generated succesfully",
         agent_response=str(response),
     )
 
 
+@app.post("/player/stream")
+async def stream_player_analysis(req: ApiRequest, agent: Agent = Depends(get_agent)):
+    return event_stream_response(stream_agent_events(
+        agent_tokens(lambda: agent.astream_chat(player_analysis_prompt(req))),
+        message="Match analysis generated succesfully",
+    ))
+
+
+@app.post("/game")
+async def analyze_game(req: GameRequest):
+    try:
+        start_fen, moves = parse_game(req.pgn, req.moves, req.fen)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    return ApiResponse(
+        message="Game analysis generated succesfully",
+        agent_response="",
+        data=await aanalyze_game(start_fen, moves),
+    )
+
+
+@app.post("/bulk")
+async def bulk_analysis(
+    request: Request,
+    explain: bool = False,
+    language: str = "en",
+    concurrency: int | None = None,
+):
+    """
+    Analyse a JSON Lines body of positions/games, or a PGN body (Content-Type
+    application/x-chess-pgn), streaming one JSON result per line as items finish.
+    """
+    fmt = "pgn" if "pgn" in request.headers.get("content-type", "") else "jsonl"
+    try:
+        items = list(read_items(io.StringIO((await request.body()).decode()), fmt))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if len(items) > SETTINGS.bulk_max_items:
+        raise HTTPException(status_code=413, detail=f"At most {SETTINGS.bulk_max_items} items per request")
+
+    concurrency = min(concurrency or SETTINGS.bulk_max_concurrency, SETTINGS.bulk_max_concurrency)
+    explainer = await get_explainer() if explain else None
+
+    async def lines() -> AsyncIterator[str]:
+        async for result in run_bulk(items, concurrency, explainer, language, SETTINGS.bulk_explain_batch_size):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 @app.post("/chat")
-def chat(req: ChatApiRequest, agent: ReActAgent = Depends(get_agent)):
-    response = agent.chat(req.message)
+async def chat(
+    req: ChatApiRequest,
+    response: Response,
+    session_id: str = Depends(get_session_id),
+    chess_agent: ChessAgent = Depends(get_chess_agent),
+):
+    session_store = get_session_store()
+    memory = await session_store.aload(session_id)
+    agent_response = await chess_agent.create_agent(memory).achat(req.message)
+    await session_store.asave(session_id, memory)
+    response.headers["X-Session-Id"] = session_id
     return ApiResponse(
         message="Chat response generated succesfully",
-        agent_response=str(response),
+        agent_response=str(agent_response),
     )
+
+
+@app.post("/chat/stream")
+async def stream_chat(
+    req: ChatApiRequest,
+    session_id: str = Depends(get_session_id),
+    chess_agent: ChessAgent = Depends(get_chess_agent),
+):
+    session_store = get_session_store()
+    memory = await session_store.aload(session_id)
+    agent = chess_agent.create_agent(memory)
+
+    async def stream() -> AsyncIterator[str]:
+        async for token in agent_tokens(lambda: agent.astream_chat(req.message)):
+            yield token
+        await session_store.asave(session_id, memory)
+
+    response = event_stream_response(stream_agent_events(
+        stream(),
+        message="Chat response generated succesfully",
+    ))
+    response.headers["X-Session-Id"] = session_id
+    return response
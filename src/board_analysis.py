@@ -0,0 +1,172 @@
+import chess
+
+PIECE_VALUES = {
+    chess.PAWN: 1,
+    chess.KNIGHT: 3,
+    chess.BISHOP: 3,
+    chess.ROOK: 5,
+    chess.QUEEN: 9,
+}
+
+COLOR_NAMES = {chess.WHITE: "white", chess.BLACK: "black"}
+
+
+def _adjacent_files_mask(file: int) -> chess.Bitboard:
+    mask = chess.BB_EMPTY
+    if file > 0:
+        mask |= chess.BB_FILES[file - 1]
+    if file < 7:
+        mask |= chess.BB_FILES[file + 1]
+    return mask
+
+
+def _front_span_mask(color: chess.Color, square: chess.Square) -> chess.Bitboard:
+    """Squares on the pawn's file and both adjacent files that are ahead of it."""
+    rank = chess.square_rank(square)
+    ahead = range(rank + 1, 8) if color == chess.WHITE else range(0, rank)
+    ranks = chess.BB_EMPTY
+    for r in ahead:
+        ranks |= chess.BB_RANKS[r]
+    file = chess.square_file(square)
+    return ranks & (chess.BB_FILES[file] | _adjacent_files_mask(file))
+
+
+ADJACENT_FILES = [_adjacent_files_mask(file) for file in range(8)]
+FRONT_SPANS = {
+    color: [_front_span_mask(color, square) for square in chess.SQUARES]
+    for color in chess.COLORS
+}
+
+
+def _squares(mask: chess.Bitboard) -> list[str]:
+    return [chess.square_name(square) for square in chess.scan_forward(mask)]
+
+
+def material_summary(board: chess.Board) -> dict:
+    material = {}
+    for color in chess.COLORS:
+        pieces = {}
+        for piece_type, value in PIECE_VALUES.items():
+            count = chess.popcount(board.pieces_mask(piece_type, color))
+            if count:
+                symbol = chess.piece_symbol(piece_type)
+                pieces[symbol.upper() if color else symbol] = {"value": value, "count": count}
+        material[COLOR_NAMES[color]] = {
+            "pieces": pieces,
+            "total": sum(piece["value"] * piece["count"] for piece in pieces.values()),
+        }
+    return material
+
+
+def pawn_features(board: chess.Board) -> dict:
+    features = {}
+    for color in chess.COLORS:
+        pawns = board.pieces_mask(chess.PAWN, color)
+        enemy_pawns = board.pieces_mask(chess.PAWN, not color)
+        passed = isolated = doubled = chess.BB_EMPTY
+        for square in chess.scan_forward(pawns):
+            file = chess.square_file(square)
+            if not FRONT_SPANS[color][square] & enemy_pawns:
+                passed |= chess.BB_SQUARES[square]
+            if not ADJACENT_FILES[file] & pawns:
+                isolated |= chess.BB_SQUARES[square]
+            if chess.popcount(pawns & chess.BB_FILES[file]) > 1:
+                doubled |= chess.BB_SQUARES[square]
+        features[COLOR_NAMES[color]] = {
+            "passed": _squares(passed),
+            "isolated": _squares(isolated),
+            "doubled": _squares(doubled),
+        }
+    return features
+
+
+def pinned_mask(board: chess.Board, color: chess.Color) -> chess.Bitboard:
+    """Pieces of `color` pinned to their king, found from the king's slider rays in one pass."""
+    king = board.king(color)
+    if king is None:
+        return chess.BB_EMPTY
+    snipers = (
+        (chess.BB_RANK_ATTACKS[king][0] | chess.BB_FILE_ATTACKS[king][0]) & (board.rooks | board.queens)
+        | chess.BB_DIAG_ATTACKS[king][0] & (board.bishops | board.queens)
+    ) & board.occupied_co[not color]
+    pinned = chess.BB_EMPTY
+    for sniper in chess.scan_forward(snipers):
+        blockers = chess.between(king, sniper) & board.occupied
+        if blockers and not blockers & (blockers - 1) and blockers & board.occupied_co[color]:
+            pinned |= blockers
+    return pinned
+
+
+def board_features(board: chess.Board) -> dict:
+    """
+    Compute the engine-independent part of analize_board from bitboards.
+    Every square's piece record is built once from the piece masks, and the
+    attack, defence and mobility maps come from one attacks_mask per piece.
+    Returns:
+        - checkers, material, pieces_info and pawn_structure as analize_board
+          always returned them, plus hanging pieces, pinned pieces, mobility
+          and pawn features (passed, isolated and doubled pawns).
+    """
+    occupied_co = board.occupied_co
+    records = {}
+    colors = {}
+    types = {}
+    for color in chess.COLORS:
+        for piece_type in chess.PIECE_TYPES:
+            symbol = chess.Piece(piece_type, color).symbol()
+            for square in chess.scan_forward(board.pieces_mask(piece_type, color)):
+                records[square] = {
+                    "square": square,
+                    "position": chess.SQUARE_NAMES[square],
+                    "piece": symbol,
+                    "color": COLOR_NAMES[color],
+                }
+                colors[square] = color
+                types[square] = piece_type
+    # Same order as Board.piece_map(), which analize_board always used.
+    squares = sorted(records, reverse=True)
+
+    attacks = {}
+    attacked_by = dict.fromkeys(squares, chess.BB_EMPTY)
+    defended = set()
+    for square in squares:
+        color = colors[square]
+        attacks[square] = board.attacks_mask(square)
+        for target in chess.scan_forward(attacks[square] & board.occupied):
+            if colors[target] == color:
+                defended.add(target)
+            else:
+                attacked_by[target] |= chess.BB_SQUARES[square]
+
+    mobility = {chess.WHITE: 0, chess.BLACK: 0}
+    pieces_info = []
+    hanging = []
+    for square in squares:
+        color = colors[square]
+        pieces_info.append({
+            **records[square],
+            "attacked_by": [records[s] for s in chess.scan_forward(attacked_by[square])],
+            "attacking": [records[s] for s in chess.scan_reversed(attacks[square] & occupied_co[not color])],
+        })
+        if types[square] == chess.KING:
+            continue
+        if types[square] != chess.PAWN:
+            mobility[color] += chess.popcount(attacks[square] & ~occupied_co[color])
+        if attacked_by[square] and square not in defended:
+            hanging.append(records[square])
+
+    pinned = pinned_mask(board, chess.WHITE) | pinned_mask(board, chess.BLACK)
+
+    return {
+        "checkers": [records[square] for square in chess.scan_forward(board.checkers_mask())],
+        "material": material_summary(board),
+        "pieces_info": pieces_info,
+        "pawn_structure": {
+            COLOR_NAMES[color]: [chess.square_file(pawn) for pawn in chess.scan_forward(board.pieces_mask(chess.PAWN, color))]
+            for color in chess.COLORS
+        },
+        "hanging": hanging,
+        "pinned": [records[square] for square in chess.scan_forward(pinned)],
+        "mobility": {COLOR_NAMES[color]: mobility[color] for color in chess.COLORS},
+        "pawn_features": pawn_features(board),
+    }
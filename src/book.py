@@ -0,0 +1,224 @@
+"""
+Precomputed position table served before any engine call.
+
+The table is a directory of two arrays, loaded with np.load(mmap_mode="r"):
+
+- `keys.npy`: sorted Polyglot Zobrist hashes (uint64).
+- `entries.npy`: for each key, the best move, centipawns, mate and depth.
+
+Both are written into a new version of the table directory and swapped in
+together (see `src.versions`), so a reader never pairs keys of one build
+with entries of another.
+
+A lookup is one binary search, and the hit is expanded into the same dict
+chess-api.com returns, through engines.build_analysis.
+
+Build or extend it from PGN games and/or a Polyglot opening book. Games are
+parsed in parallel processes, and the positions seen often enough are
+evaluated concurrently with the configured evaluation backend:
+
+    python -m src.book --pgn games.pgn [--polyglot book.bin] [--max-ply 24] [--min-count 2] [--workers 8]
+"""
+import argparse
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
+
+import chess
+import chess.pgn
+import chess.polyglot
+import numpy as np
+
+from src.config import get_agent_settings
+from src.engines import build_analysis
+from src.versions import current_version, new_version_path, swap_in
+
+KEYS_FILE = "keys.npy"
+ENTRIES_FILE = "entries.npy"
+ENTRY_DTYPE = np.dtype([
+    ("move", "<u2"),
+    ("centipawns", "<i4"),
+    ("mate", "<i2"),
+    ("depth", "u1"),
+])
+NO_MATE = np.iinfo(np.int16).min
+
+
+def encode_move(move: chess.Move) -> int:
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def decode_move(code: int) -> chess.Move:
+    return chess.Move(code & 0x3F, code >> 6 & 0x3F, code >> 12 or None)
+
+
+class PositionTable:
+    def __init__(self, path: str):
+        self.path = path
+        self.keys = np.load(os.path.join(path, KEYS_FILE), mmap_mode="r")
+        self.entries = np.load(os.path.join(path, ENTRIES_FILE), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def lookup(self, fen: str) -> dict | None:
+        board = chess.Board(fen)
+        key = chess.polyglot.zobrist_hash(board)
+        i = int(np.searchsorted(self.keys, key))
+        if i == len(self.keys) or int(self.keys[i]) != key:
+            return None
+
+        entry = self.entries[i]
+        move = decode_move(int(entry["move"]))
+        # Guards against Zobrist collisions with an unrelated position.
+        if move not in board.legal_moves:
+            return None
+        mate = int(entry["mate"])
+        return build_analysis(
+            board,
+            move,
+            centipawns=int(entry["centipawns"]),
+            mate=None if mate == NO_MATE else mate,
+            depth=int(entry["depth"]),
+            continuation=[move],
+        )
+
+    @classmethod
+    def write(cls, path: str, analyses: dict[int, dict]):
+        """Write `zobrist key -> chess-api style analysis` as a table, replacing any previous one."""
+        keys = np.array(sorted(analyses), dtype=np.uint64)
+        entries = np.zeros(len(keys), dtype=ENTRY_DTYPE)
+        for i, key in enumerate(keys):
+            analysis = analyses[int(key)]
+            entries[i] = (
+                encode_move(chess.Move.from_uci(analysis["move"])),
+                analysis["centipawns"],
+                NO_MATE if analysis.get("mate") is None else analysis["mate"],
+                min(analysis.get("depth") or 0, 255),
+            )
+
+        version_path = new_version_path(path)
+        os.makedirs(version_path)
+        np.save(os.path.join(version_path, ENTRIES_FILE), entries)
+        np.save(os.path.join(version_path, KEYS_FILE), keys)
+        swap_in(version_path, path)
+
+    def items(self) -> dict[int, dict]:
+        analyses = {}
+        for key, entry in zip(self.keys, self.entries):
+            mate = int(entry["mate"])
+            analyses[int(key)] = {
+                "move": decode_move(int(entry["move"])).uci(),
+                "centipawns": int(entry["centipawns"]),
+                "mate": None if mate == NO_MATE else mate,
+                "depth": int(entry["depth"]),
+            }
+        return analyses
+
+
+@cache
+def get_position_table() -> PositionTable | None:
+    settings = get_agent_settings()
+    path = current_version(settings.position_table_path)
+    if not settings.position_table_enabled or not os.path.exists(os.path.join(path, KEYS_FILE)):
+        return None
+    return PositionTable(path)
+
+
+def lookup_position(fen: str) -> dict | None:
+    position_table = get_position_table()
+    return position_table.lookup(fen) if position_table is not None else None
+
+
+def pgn_positions(path: str, max_ply: int) -> dict[int, tuple[str, int]]:
+    """Zobrist key -> (FEN, number of games) for the first `max_ply` plies of every game in a PGN file."""
+    counts = Counter()
+    fens = {}
+    with open(path, encoding="utf-8", errors="replace") as f:
+        while (game := chess.pgn.read_game(f)) is not None:
+            board = game.board()
+            seen = set()
+            for ply, move in enumerate(game.mainline_moves()):
+                if ply >= max_ply:
+                    break
+                key = chess.polyglot.zobrist_hash(board)
+                if key not in seen:
+                    seen.add(key)
+                    counts[key] += 1
+                    fens.setdefault(key, board.fen())
+                board.push(move)
+    return {key: (fens[key], count) for key, count in counts.items()}
+
+
+def polyglot_positions(path: str, max_ply: int) -> dict[int, str]:
+    """Every position reachable through the book's moves within `max_ply` plies."""
+    positions = {}
+    with chess.polyglot.open_reader(path) as reader:
+        stack = [(chess.Board(), 0)]
+        while stack:
+            board, ply = stack.pop()
+            key = chess.polyglot.zobrist_hash(board)
+            if key in positions or ply > max_ply:
+                continue
+            positions[key] = board.fen()
+            for entry in reader.find_all(board):
+                child = board.copy(stack=False)
+                child.push(entry.move)
+                stack.append((child, ply + 1))
+    return positions
+
+
+def collect_positions(pgn_paths: list[str], polyglot_path: str | None, max_ply: int, min_count: int, workers: int) -> dict[int, str]:
+    counts = Counter()
+    fens = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(pgn_positions, pgn_paths, [max_ply] * len(pgn_paths)):
+            for key, (fen, count) in result.items():
+                counts[key] += count
+                fens.setdefault(key, fen)
+    positions = {key: fens[key] for key, count in counts.items() if count >= min_count}
+
+    if polyglot_path is not None:
+        for key, fen in polyglot_positions(polyglot_path, max_ply).items():
+            positions.setdefault(key, fen)
+    return positions
+
+
+def main():
+    settings = get_agent_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pgn", nargs="*", default=[], help="PGN files, parsed one process per file")
+    parser.add_argument("--polyglot", help="Polyglot .bin opening book whose positions are added too")
+    parser.add_argument("--out", default=settings.position_table_path)
+    parser.add_argument("--max-ply", type=int, default=24)
+    parser.add_argument("--min-count", type=int, default=2, help="Games a PGN position must appear in")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    # Imported here so the position table itself stays importable from src.tools.
+    from src.logs import configure_logging
+    from src.tools import get_stockfish_analyses
+
+    configure_logging()
+
+    positions = collect_positions(args.pgn, args.polyglot, args.max_ply, args.min_count, args.workers)
+    existing = current_version(args.out)
+    analyses = PositionTable(existing).items() if os.path.exists(os.path.join(existing, KEYS_FILE)) else {}
+    missing = {key: fen for key, fen in positions.items() if key not in analyses}
+    print(f"{len(positions)} positions, {len(missing)} to evaluate")
+
+    for i, (key, analysis) in enumerate(
+        zip(missing, get_stockfish_analyses(list(missing.values()), max_concurrency=args.workers)), start=1
+    ):
+        if "move" in analysis:
+            analyses[key] = analysis
+        if i % 100 == 0:
+            print(f"Evaluated {i}/{len(missing)}")
+
+    PositionTable.write(args.out, analyses)
+    print(f"Wrote {len(analyses)} positions to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Bulk analysis of many positions or games.
+
+Items are read from JSON Lines (`{"id": ..., "fen": ...}` for a position,
+`{"id": ..., "pgn": ...}` or `{"id": ..., "moves": [...]}` for a game) or
+from a PGN file with one game per item. At most `concurrency` items are
+analysed at once, and results come out as JSON Lines in completion order.
+Best-move explanations are optional and requested from the LLM in batches.
+
+The CLI treats its output file as the checkpoint: items already written
+without an error are skipped when it is run again, and error, truncated or
+malformed lines are dropped from the file before their items are retried.
+
+    python -m src.bulk tournament.pgn --out results.jsonl [--explain] [--concurrency 8]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Iterator, TextIO
+
+import chess.pgn
+
+from src.agent import BestMoveExplainer
+from src.config import get_agent_settings
+from src.game_analysis import aanalyze_game, parse_game
+from src.logs import configure_logging
+from src.tool_output import format_board
+from src.tools import aget_stockfish_analysis, describe_best_move, describe_board
+
+
+def read_jsonl(lines: Iterable[str]) -> Iterator[dict]:
+    for i, line in enumerate(lines, start=1):
+        if line.strip():
+            item = json.loads(line)
+            item.setdefault("id", str(i))
+            yield item
+
+
+def read_pgn(f: TextIO) -> Iterator[dict]:
+    i = 0
+    while (game := chess.pgn.read_game(f)) is not None:
+        i += 1
+        yield {"id": str(i), "pgn": str(game), "headers": dict(game.headers)}
+
+
+def read_items(f: TextIO, fmt: str) -> Iterator[dict]:
+    if fmt == "pgn":
+        return read_pgn(f)
+    if fmt == "jsonl":
+        return read_jsonl(f)
+    raise ValueError(f"Unknown bulk input format: {fmt}")
+
+
+async def analyse_item(item: dict) -> dict:
+    """The same structured data as get_best_move and analize_board, or /game for games."""
+    try:
+        if "pgn" in item or "moves" in item:
+            start_fen, moves = parse_game(item.get("pgn"), item.get("moves"), item.get("fen"))
+            return {**item, "game": await aanalyze_game(start_fen, moves)}
+
+        analysis = await aget_stockfish_analysis(item["fen"])
+        return {
+            **item,
+            "best_move": describe_best_move(analysis),
+            "board": format_board(describe_board(item["fen"], analysis)),
+        }
+    except Exception as e:
+        return {**item, "error": repr(e)}
+
+
+async def bounded_map(fn: Callable[[dict], Awaitable[dict]], items: Iterable[dict], concurrency: int) -> AsyncIterator[dict]:
+    """Run `fn` over `items` with at most `concurrency` calls in flight, yielding results as they finish."""
+    pending = set()
+    try:
+        for item in items:
+            pending.add(asyncio.ensure_future(fn(item)))
+            if len(pending) >= concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        # The consumer went away (e.g. a client disconnected from /bulk).
+        for task in pending:
+            task.cancel()
+
+
+async def explain_batches(
+    results: AsyncIterator[dict], explainer: BestMoveExplainer, language: str, batch_size: int
+) -> AsyncIterator[dict]:
+    """Add an `explanation` to analysed positions, `batch_size` positions per LLM call."""
+    batch = []
+
+    async def flush() -> list[dict]:
+        try:
+            explanations = await explainer.aexplain_batch(
+                [(result["fen"], result["best_move"]) for result in batch], language
+            )
+        except Exception as e:
+            return [{**result, "explanation_error": repr(e)} for result in batch]
+        return [{**result, "explanation": explanation} for result, explanation in zip(batch, explanations)]
+
+    async for result in results:
+        if "best_move" not in result:
+            yield result
+            continue
+        batch.append(result)
+        if len(batch) >= batch_size:
+            for explained in await flush():
+                yield explained
+            batch = []
+    if batch:
+        for explained in await flush():
+            yield explained
+
+
+async def run_bulk(
+    items: Iterable[dict],
+    concurrency: int,
+    explainer: BestMoveExplainer | None = None,
+    language: str = "en",
+    explain_batch_size: int = 8,
+) -> AsyncIterator[dict]:
+    results = bounded_map(analyse_item, items, concurrency)
+    if explainer is not None:
+        results = explain_batches(results, explainer, language, explain_batch_size)
+    async for result in results:
+        yield result
+
+
+def completed_results(path: str) -> dict[str, str]:
+    """Item id -> output line of every item already written without an error; the first line of an id wins."""
+    if not os.path.exists(path):
+        return {}
+    done = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interrupted run; its item is retried.
+                continue
+            if not isinstance(result, dict) or "id" not in result or "error" in result:
+                continue
+            done.setdefault(str(result["id"]), line if line.endswith("\n") else line + "\n")
+    return done
+
+
+def compact_output(path: str, done: dict[str, str]):
+    """Rewrite `path` with only the completed lines, so retried items do not leave a stale error line behind."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.writelines(done.values())
+    os.replace(tmp_path, path)
+
+
+async def run_cli(args: argparse.Namespace):
+    fmt = args.format or ("pgn" if args.input.endswith(".pgn") else "jsonl")
+    done = {}
+    if not args.restart and os.path.exists(args.out):
+        done = completed_results(args.out)
+        compact_output(args.out, done)
+
+    with open(args.input, encoding="utf-8", errors="replace") as f:
+        items = [item for item in read_items(f, fmt) if str(item["id"]) not in done]
+    if done:
+        print(f"Resuming: {len(done)} items already in {args.out}", file=sys.stderr)
+
+    explainer = None
+    if args.explain:
+        from src.registry import get_registry
+
+        explainer = await get_registry().aget("explainer")
+
+    start = time.perf_counter()
+    errors = 0
+    with open(args.out, "w" if args.restart else "a") as out:
+        i = 0
+        async for result in run_bulk(items, args.concurrency, explainer, args.language, args.explain_batch_size):
+            i += 1
+            errors += "error" in result
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            if i % args.progress_every == 0 or i == len(items):
+                rate = i / (time.perf_counter() - start)
+                print(
+                    f"{i}/{len(items)} items, {errors} errors, {rate:.1f} items/s, "
+                    f"eta {(len(items) - i) / rate:.0f}s",
+                    file=sys.stderr,
+                )
+
+
+def main():
+    settings = get_agent_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSON Lines of positions/games, or a PGN file")
+    parser.add_argument("--out", required=True, help="JSON Lines output, also used as the checkpoint")
+    parser.add_argument("--format", choices=["jsonl", "pgn"], help="Defaults to the input file extension")
+    parser.add_argument("--concurrency", type=int, default=settings.bulk_max_concurrency)
+    parser.add_argument("--explain", action="store_true", help="Add LLM explanations of the best moves")
+    parser.add_argument("--explain-batch-size", type=int, default=settings.bulk_explain_batch_size)
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--restart", action="store_true", help="Ignore and overwrite an existing output")
+    parser.add_argument("--progress-every", type=int, default=10)
+    args = parser.parse_args()
+    configure_logging()
+    asyncio.run(run_cli(args))
+
+
+if __name__ == "__main__":
+    main()
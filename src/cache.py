@@ -0,0 +1,252 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import cache
+
+import chess
+import chess.polyglot
+
+from src.config import get_agent_settings
+
+
+def position_key(fen: str) -> str:
+    """
+    Normalize a FEN into a cache key.
+    The Zobrist hash ignores the halfmove and fullmove counters, so the same
+    position reached through different move orders shares one entry.
+    """
+    return f"{chess.polyglot.zobrist_hash(chess.Board(fen)):016x}"
+
+
+def response_key(endpoint: str, fen: str, language: str, model: str, template: str) -> str:
+    """Cache key for an LLM explanation of a position."""
+    template_hash = hashlib.sha256(template.encode()).hexdigest()
+    parts = [endpoint, position_key(fen), language.strip().lower(), model, template_hash]
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+
+class SqliteCache:
+    """
+    Two level key/value cache: a byte-bounded in-process LRU in front of a
+    SQLite file that every worker process shares. Entries expire after `ttl`
+    seconds (0 disables expiry) and the file keeps at most `max_entries` rows,
+    evicting the least recently accessed ones.
+    """
+
+    table = "entries"
+    prune_every = 256
+    # Memory hits refresh the row's accessed_at at most this often, so pruning sees hot entries as recent.
+    touch_interval = 60.0
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 100_000,
+        ttl: int = 0,
+        memory_mb: int = 32,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.memory_limit = memory_mb * 1024 * 1024
+
+        # key -> (created_at, value, when accessed_at was last written to SQLite)
+        self._memory: OrderedDict[str, tuple[float, str, float]] = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._conn_pid: int | None = None
+        self._writes = 0
+
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection must not cross a fork, so reopen it in every worker.
+        if self._conn is None or self._conn_pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_accessed_at "
+                f"ON {self.table} (accessed_at)"
+            )
+            conn.commit()
+            self._conn = conn
+            self._conn_pid = os.getpid()
+            self._memory.clear()
+            self._memory_size = 0
+        return self._conn
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - created_at > self.ttl
+
+    def _remember(self, key: str, created_at: float, value: str, touched_at: float):
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key)[1])
+        self._memory[key] = (created_at, value, touched_at)
+        self._memory_size += len(value)
+        while self._memory_size > self.memory_limit and self._memory:
+            _, (_, evicted, _) = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def get(self, key: str) -> dict | None:
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[0], now):
+                self._memory.move_to_end(key)
+                if now - entry[2] >= self.touch_interval:
+                    conn.execute(
+                        f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key)
+                    )
+                    conn.commit()
+                    self._memory[key] = (entry[0], entry[1], now)
+                self.hits += 1
+                self.memory_hits += 1
+                return json.loads(entry[1])
+
+            row = conn.execute(
+                f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or self._expired(row[1], now):
+                self.misses += 1
+                return None
+
+            value, created_at = row
+            conn.execute(
+                f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            conn.commit()
+            self._remember(key, created_at, value, now)
+            self.hits += 1
+            return json.loads(value)
+
+    def set(self, key: str, value: dict):
+        now = time.time()
+        serialized = json.dumps(value)
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} "
+                "(key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, serialized, now, now),
+            )
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                self._prune(conn, now)
+            conn.commit()
+            self._remember(key, now, serialized, now)
+
+    async def aget(self, key: str) -> dict | None:
+        # SQLite may wait up to 30s on another writer; keep that off the event loop.
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: dict):
+        await asyncio.to_thread(self.set, key, value)
+
+    def _prune(self, conn: sqlite3.Connection, now: float):
+        if self.ttl > 0:
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE created_at < ?", (now - self.ttl,)
+            )
+        (count,) = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        if count > self.max_entries:
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f"SELECT key FROM {self.table} ORDER BY accessed_at ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute(f"DELETE FROM {self.table}")
+            conn.commit()
+            self._memory.clear()
+            self._memory_size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+            }
+
+
+class EvaluationCache(SqliteCache):
+    """Engine evaluations keyed by position, independent of move counters."""
+
+    table = "evaluations"
+
+    def get(self, fen: str) -> dict | None:
+        return super().get(position_key(fen))
+
+    def set(self, fen: str, value: dict):
+        super().set(position_key(fen), value)
+
+
+class ResponseCache(SqliteCache):
+    """LLM explanations keyed by response_key."""
+
+    table = "responses"
+
+
+class GameCache(SqliteCache):
+    """Per-ply game analysis keyed by the hash of the game prefix ending with that ply."""
+
+    table = "games"
+
+
+@cache
+def get_evaluation_cache() -> EvaluationCache:
+    settings = get_agent_settings()
+    return EvaluationCache(
+        path=settings.eval_cache_path,
+        max_entries=settings.eval_cache_max_entries,
+        ttl=settings.eval_cache_ttl,
+        memory_mb=settings.eval_cache_memory_mb,
+    )
+
+
+@cache
+def get_response_cache() -> ResponseCache:
+    settings = get_agent_settings()
+    return ResponseCache(
+        path=settings.response_cache_path,
+        max_entries=settings.response_cache_max_entries,
+        ttl=settings.response_cache_ttl,
+        memory_mb=settings.response_cache_memory_mb,
+    )
+
+
+@cache
+def get_game_cache() -> GameCache:
+    settings = get_agent_settings()
+    return GameCache(
+        path=settings.game_cache_path,
+        max_entries=settings.game_cache_max_entries,
+        ttl=settings.game_cache_ttl,
+        memory_mb=settings.game_cache_memory_mb,
+    )
@@ -0,0 +1,336 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Awaitable, Callable, Iterator, Mapping, TypeVar
+
+import httpx
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class AsyncSingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one in-flight task.
+    The task is shielded, so a caller that disconnects does not cancel the
+    work the other callers are waiting on.
+    """
+
+    def __init__(self):
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """Thread counterpart of AsyncSingleFlight: one thread runs `fn`, the others wait for its result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: dict[str, _Call] = {}
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.done.set()
+
+
+class TokenBucket:
+    """
+    `rate` requests per second with bursts of up to `burst`. Callers that find
+    the bucket empty reserve the next token and sleep until it is due, so
+    waiting requests queue in arrival order instead of failing.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token and return how long to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def try_acquire(self) -> bool:
+        """Take a token only if one is available now."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def aacquire(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class Limiter:
+    """
+    Per-backend concurrency ceiling plus optional token-bucket rate limit.
+    Threads and coroutines use separate semaphores, each capped at `max_concurrency`.
+    """
+
+    def __init__(self, max_concurrency: int | None = None, rate: float | None = None, burst: int = 1):
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self._semaphore = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._async_semaphore: asyncio.Semaphore | None = None
+
+    def acquire(self):
+        if self.bucket is not None:
+            self.bucket.acquire()
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+
+    def release(self):
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    async def aacquire(self):
+        if self.bucket is not None:
+            await self.bucket.aacquire()
+        if self.max_concurrency:
+            if self._async_semaphore is None:
+                self._async_semaphore = asyncio.Semaphore(self.max_concurrency)
+            await self._async_semaphore.acquire()
+
+    def arelease(self):
+        if self._async_semaphore is not None:
+            self._async_semaphore.release()
+
+    @contextmanager
+    def limit(self) -> Iterator[None]:
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def alimit(self) -> AsyncIterator[None]:
+        await self.aacquire()
+        try:
+            yield
+        finally:
+            self.arelease()
+
+
+class UpstreamError(Exception):
+    """A retryable answer from an upstream service (429 or 5xx)."""
+
+    def __init__(self, status_code: int, retry_after: float | None = None):
+        super().__init__(f"Upstream returned {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def retry_after_seconds(headers: Mapping[str, str]) -> float | None:
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def raise_for_retry(status_code: int, headers: Mapping[str, str]):
+    if status_code in RETRY_STATUSES:
+        raise UpstreamError(status_code, retry_after_seconds(headers))
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float, error: BaseException | None = None) -> float:
+    """Full-jitter exponential backoff, or the upstream's Retry-After when it sent one."""
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        return min(retry_after, max_delay)
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def retry(
+    fn: Callable[[], T],
+    attempts: int = 3,
+    base_delay: float = 0.5,
+    max_delay: float = 8.0,
+    retry_on: tuple[type[BaseException], ...] = (UpstreamError,),
+) -> T:
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except retry_on as e:
+            if attempt == attempts - 1:
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay, e)
+            logger.warning("Retrying in %.2fs after %r", delay, e, extra={"attempt": attempt + 1})
+            time.sleep(delay)
+
+
+async def aretry(
+    fn: Callable[[], Awaitable[T]],
+    attempts: int = 3,
+    base_delay: float = 0.5,
+    max_delay: float = 8.0,
+    retry_on: tuple[type[BaseException], ...] = (UpstreamError,),
+) -> T:
+    for attempt in range(attempts):
+        try:
+            return await fn()
+        except retry_on as e:
+            if attempt == attempts - 1:
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay, e)
+            logger.warning("Retrying in %.2fs after %r", delay, e, extra={"attempt": attempt + 1})
+            await asyncio.sleep(delay)
+
+
+class _ReleasingByteStream(httpx.SyncByteStream):
+    def __init__(self, stream: httpx.SyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+
+class _AsyncReleasingByteStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+def _once(fn: Callable[[], None]) -> Callable[[], None]:
+    called = False
+
+    def wrapper():
+        nonlocal called
+        if not called:
+            called = True
+            fn()
+
+    return wrapper
+
+
+class LimitedTransport(httpx.BaseTransport):
+    """
+    httpx transport that holds a Limiter slot from sending the request until
+    the response body is closed, so streamed responses count while they stream.
+    """
+
+    def __init__(self, limiter: Limiter, transport: httpx.BaseTransport | None = None):
+        self.limiter = limiter
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.limiter.acquire()
+        release = _once(self.limiter.release)
+        try:
+            response = self.transport.handle_request(request)
+        except BaseException:
+            release()
+            raise
+        if response.is_closed:
+            # Already read into memory, so the body will never be closed through the stream.
+            release()
+        else:
+            response.stream = _ReleasingByteStream(response.stream, release)
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncLimitedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, limiter: Limiter, transport: httpx.AsyncBaseTransport | None = None):
+        self.limiter = limiter
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await self.limiter.aacquire()
+        release = _once(self.limiter.arelease)
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        if response.is_closed:
+            release()
+        else:
+            response.stream = _AsyncReleasingByteStream(response.stream, release)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
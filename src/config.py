@@ -9,9 +9,115 @@ class AgentSettings(BaseSettings):
 
     openai_model: str = "gpt-4o-mini"
     hf_embeddings_model: str = "intfloat/multilingual-e5-base"
+    embedding_backend: str = "torch"
+    embedding_onnx_quantization: str = "avx2"
+    embedding_onnx_path: str = "cache/onnx"
+    query_embedding_cache_size: int = 1024
     openai_api_key: str = ""
+    openai_timeout: float = 60.0
+    openai_max_retries: int = 3
+    openai_max_concurrency: int | None = 32
+    openai_rate_limit: float | None = None
+    openai_burst: int = 10
     store_path :str = "chess_expert_store"
     docs_path :str = "docs"
+    vector_store_format: str = "simple"
+    mmap_store_path: str = "chess_expert_mmap"
+    similarity_top_k: int = 2
+    chess_expert_mode: str = "synthesize"
+    chess_expert_candidates: int = 8
+    chess_expert_passage_chars: int = 800
+    chess_expert_hybrid: bool = False
+    chess_expert_bm25_weight: float = 0.3
+    chess_expert_cache_size: int = 256
+    ingest_batch_size: int = 32
+    ingest_workers: int = 0
+
+    eager_startup: bool = True
+    serve_workers: int = 1
+    serve_preload: bool = True
+
+    log_level: str = "INFO"
+    log_format: str = "json"
+
+    session_backend: str = "memory"
+    session_store_path: str = "cache/sessions.sqlite3"
+    session_max: int = 10_000
+    session_ttl: int = 2 * 3600
+    session_token_limit: int = 3000
+
+    admission_enabled: bool = True
+    admission_max_concurrency: int = 64
+    admission_queue_size: int = 128
+    admission_max_wait: float = 10.0
+    admission_limits: dict[str, int] = {
+        "/best-move": 32, "/game": 32, "/state": 16, "/chat": 16, "/player": 4, "/bulk": 2,
+    }
+    admission_priorities: dict[str, int] = {
+        "/best-move": 0, "/game": 0, "/state": 1, "/chat": 1, "/player": 2, "/bulk": 3,
+    }
+
+    agent_mode: str = "react"
+    agent_max_iterations: dict[str, int] = {"default": 6, "/best-move": 3, "/state": 3}
+    agent_token_budget: dict[str, int] = {"default": 16_000, "/player": 24_000}
+
+    tool_verbosity: str = "full"
+
+    best_move_mode: str = "fast"
+    fast_path_board_analysis: bool = False
+
+    evaluation_backend: str = "chess_api"
+    chess_api_url: str = "https://chess-api.com/v1"
+    chess_api_max_connections: int = 100
+    chess_api_timeout: float = 10.0
+    chess_api_max_concurrency: int | None = 32
+    chess_api_rate_limit: float | None = None
+    chess_api_burst: int = 10
+    chess_api_retries: int = 3
+    retry_base_delay: float = 0.5
+    retry_max_delay: float = 8.0
+    uci_engine_path: str = "stockfish"
+    uci_pool_size: int = 2
+    uci_depth: int | None = 18
+    uci_time_limit: float | None = None
+    uci_hash_mb: int = 64
+    uci_threads: int = 1
+    uci_checkout_timeout: float | None = 30.0
+    evaluation_max_concurrency: int = 8
+
+    bulk_max_concurrency: int = 16
+    bulk_max_items: int = 10_000
+    bulk_explain_batch_size: int = 8
+
+    prefetch_enabled: bool = False
+    prefetch_depth: int = 2
+    prefetch_queue_size: int = 256
+    prefetch_workers: int = 2
+    prefetch_user_budget: int = 20
+    prefetch_budget_window: float = 60.0
+    prefetch_max_foreground: int = 4
+    prefetch_max_users: int = 10_000
+    prefetch_explanations: bool = False
+
+    position_table_enabled: bool = True
+    position_table_path: str = "position_table"
+
+    eval_cache_path: str = "cache/evaluations.sqlite3"
+    eval_cache_max_entries: int = 200_000
+    eval_cache_ttl: int = 30 * 24 * 3600
+    eval_cache_memory_mb: int = 32
+
+    game_cache_path: str = "cache/games.sqlite3"
+    game_cache_max_entries: int = 500_000
+    game_cache_ttl: int = 2 * 24 * 3600
+    game_cache_memory_mb: int = 16
+
+    response_cache_enabled: bool = True
+    response_cache_path: str = "cache/responses.sqlite3"
+    response_cache_max_entries: int = 50_000
+    response_cache_ttl: int = 7 * 24 * 3600
+    response_cache_memory_mb: int = 16
+    response_cache_single_flight: bool = True
 
 
 @cache
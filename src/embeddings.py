@@ -0,0 +1,171 @@
+"""
+Embedding backends for the chess expert index.
+
+`EMBEDDING_BACKEND` selects how multilingual-e5-base runs on CPU:
+
+- `torch`: the original sentence-transformers model.
+- `onnx`: the same weights exported to ONNX Runtime.
+- `onnx-int8`: the ONNX export with dynamic int8 quantization, built once
+  under `EMBEDDING_ONNX_PATH` and reused afterwards.
+
+The ONNX backends need `optimum[onnxruntime]`, which is not a hard
+requirement. Whatever the backend, query embeddings go through a bounded
+LRU cache, since the agent keeps asking the same conceptual questions.
+"""
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.callbacks import CallbackManager
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.embeddings.huggingface.utils import (
+    get_query_instruct_for_model_name,
+    get_text_instruct_for_model_name,
+)
+
+from src.config import get_agent_settings
+from src.metrics import EMBEDDING_CACHE, get_callback_manager
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+class ThreadedHuggingFaceEmbedding(HuggingFaceEmbedding):
+    """HuggingFace embeddings whose async API runs the model off the event loop."""
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    async def _aget_text_embedding(self, text: str) -> list[float]:
+        return await asyncio.to_thread(self._get_text_embedding, text)
+
+
+class CachedQueryEmbedding(BaseEmbedding):
+    """Wraps an embedding model with an LRU cache of query embeddings; text embeddings pass through."""
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _cache: OrderedDict = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+    _max_entries: int = PrivateAttr()
+    _hits: int = PrivateAttr(default=0)
+    _misses: int = PrivateAttr(default=0)
+
+    def __init__(self, embed_model: BaseEmbedding, max_entries: int = 1024, callback_manager: CallbackManager | None = None):
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            callback_manager=callback_manager or embed_model.callback_manager,
+        )
+        self._embed_model = embed_model
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_entries = max_entries
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedQueryEmbedding"
+
+    @staticmethod
+    def _key(query: str) -> str:
+        return " ".join(query.split())
+
+    def _lookup(self, key: str) -> list[float] | None:
+        with self._lock:
+            embedding = self._cache.get(key)
+            if embedding is None:
+                self._misses += 1
+                EMBEDDING_CACHE.labels("miss").inc()
+                return None
+            self._cache.move_to_end(key)
+            self._hits += 1
+            EMBEDDING_CACHE.labels("hit").inc()
+            return embedding
+
+    def _store(self, key: str, embedding: list[float]):
+        with self._lock:
+            self._cache[key] = embedding
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._max_entries:
+                self._cache.popitem(last=False)
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        key = self._key(query)
+        embedding = self._lookup(key)
+        if embedding is None:
+            embedding = self._embed_model.get_query_embedding(query)
+            self._store(key, embedding)
+        return embedding
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        key = self._key(query)
+        embedding = self._lookup(key)
+        if embedding is None:
+            embedding = await self._embed_model.aget_query_embedding(query)
+            self._store(key, embedding)
+        return embedding
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        return self._embed_model.get_text_embedding(text)
+
+    async def _aget_text_embedding(self, text: str) -> list[float]:
+        return await self._embed_model.aget_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        return self._embed_model.get_text_embedding_batch(texts)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._cache), "hits": self._hits, "misses": self._misses}
+
+
+def quantized_onnx_model(model_name: str, quantization: str, out_dir: str) -> tuple[str, str]:
+    """
+    Export `model_name` to ONNX and quantize it to int8 for the given CPU
+    instruction set (arm64, avx2, avx512 or avx512_vnni), unless that was
+    already done in `out_dir`.
+    Returns:
+        - tuple[str, str]: The local model directory and the ONNX file to load from it.
+    """
+    try:
+        from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+    except ImportError as e:
+        raise ImportError("The onnx-int8 embedding backend needs `pip install optimum[onnxruntime]`") from e
+
+    model_dir = os.path.join(out_dir, model_name.replace("/", "--"))
+    file_name = f"onnx/model_qint8_{quantization}.onnx"
+    if not os.path.exists(os.path.join(model_dir, file_name)):
+        model = SentenceTransformer(model_name, backend="onnx")
+        model.save_pretrained(model_dir)
+        export_dynamic_quantized_onnx_model(model, quantization, model_dir)
+    return model_dir, file_name
+
+
+def create_embed_model(backend: str | None = None, cache_size: int | None = None) -> BaseEmbedding:
+    settings = get_agent_settings()
+    backend = backend or settings.embedding_backend
+    cache_size = settings.query_embedding_cache_size if cache_size is None else cache_size
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    model_name = settings.hf_embeddings_model
+    # Loading from a local export changes model_name, so the e5 "query: "/"passage: "
+    # prefixes are pinned to the original model.
+    kwargs = {
+        "query_instruction": get_query_instruct_for_model_name(model_name),
+        "text_instruction": get_text_instruct_for_model_name(model_name),
+    }
+    if backend == "onnx":
+        kwargs["backend"] = "onnx"
+    elif backend == "onnx-int8":
+        model_name, file_name = quantized_onnx_model(
+            model_name, settings.embedding_onnx_quantization, settings.embedding_onnx_path
+        )
+        kwargs["backend"] = "onnx"
+        kwargs["model_kwargs"] = {"file_name": file_name}
+
+    # Only the outermost model reports embedding events, so cached queries are not timed twice.
+    if cache_size:
+        embed_model = ThreadedHuggingFaceEmbedding(model_name=model_name, **kwargs)
+        return CachedQueryEmbedding(embed_model, max_entries=cache_size, callback_manager=get_callback_manager())
+    return ThreadedHuggingFaceEmbedding(model_name=model_name, callback_manager=get_callback_manager(), **kwargs)
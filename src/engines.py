@@ -0,0 +1,315 @@
+import asyncio
+import atexit
+import logging
+import math
+import queue
+import threading
+from contextlib import contextmanager
+from functools import cache
+from typing import Iterator
+
+import chess
+import chess.engine
+import httpx
+import requests
+
+from src.concurrency import Limiter, UpstreamError, aretry, raise_for_retry, retry
+from src.config import get_agent_settings
+
+logger = logging.getLogger(__name__)
+
+
+def win_chance(centipawns: int) -> float:
+    """Win chance for white in percent, using the same curve as chess-api.com."""
+    return 50 + 50 * (2 / (1 + math.exp(-0.00368208 * centipawns)) - 1)
+
+
+def move_flags(board: chess.Board, move: chess.Move) -> str:
+    """Move flags in the chess.js format used by chess-api.com."""
+    flags = ""
+    if board.is_en_passant(move):
+        flags += "e"
+    elif board.is_capture(move):
+        flags += "c"
+    if move.promotion:
+        flags += "p"
+    if board.is_kingside_castling(move):
+        flags += "k"
+    elif board.is_queenside_castling(move):
+        flags += "q"
+    if (
+        board.piece_type_at(move.from_square) == chess.PAWN
+        and abs(chess.square_rank(move.to_square) - chess.square_rank(move.from_square)) == 2
+    ):
+        flags += "b"
+    return flags or "n"
+
+
+def mate_win_chance(board: chess.Board, mate: int) -> float:
+    """White's win chance for a forced mate; mate 0 means the side to move is already checkmated."""
+    if mate == 0:
+        return 0.0 if board.turn == chess.WHITE else 100.0
+    return 100.0 if mate > 0 else 0.0
+
+
+def build_analysis(
+    board: chess.Board,
+    move: chess.Move | None,
+    centipawns: int,
+    mate: int | None = None,
+    depth: int | None = None,
+    continuation: list[chess.Move] | None = None,
+) -> dict:
+    """
+    Describe an engine result with the same fields chess-api.com returns, so
+    every backend can feed get_best_move, analize_board and analyze_player.
+    Scores are always from white's point of view.
+    """
+    analysis = {
+        "fen": board.fen(),
+        "depth": depth,
+        "eval": centipawns / 100,
+        "centipawns": centipawns,
+        "mate": mate,
+        "winChance": mate_win_chance(board, mate) if mate is not None else win_chance(centipawns),
+        "turn": "w" if board.turn else "b",
+        "continuationArr": [m.uci() for m in continuation or []],
+    }
+    if move is None:
+        analysis["text"] = f"No legal moves. Evaluation: [{analysis['eval']}]."
+        return analysis
+
+    piece = board.piece_at(move.from_square)
+    captured = chess.PAWN if board.is_en_passant(move) else board.piece_type_at(move.to_square)
+    san = board.san(move)
+    analysis.update({
+        "text": f"Move {chess.square_name(move.from_square)} → {chess.square_name(move.to_square)} "
+                f"({san}): [{analysis['eval']}]. Depth {depth}.",
+        "move": move.uci(),
+        "san": san,
+        "lan": move.uci(),
+        "color": "w" if piece.color else "b",
+        "piece": chess.piece_symbol(piece.piece_type),
+        "from": chess.square_name(move.from_square),
+        "to": chess.square_name(move.to_square),
+        "flags": move_flags(board, move),
+        "isCapture": board.is_capture(move),
+        "isCastling": board.is_castling(move),
+        "isPromotion": move.promotion is not None,
+    })
+    if captured:
+        analysis["captured"] = chess.piece_symbol(captured)
+    if move.promotion:
+        analysis["promotion"] = chess.piece_symbol(move.promotion)
+    return analysis
+
+
+class EvaluationBackend:
+    def analyse(self, fen: str) -> dict:
+        raise NotImplementedError
+
+    async def aanalyse(self, fen: str) -> dict:
+        return await asyncio.to_thread(self.analyse, fen)
+
+    def close(self):
+        pass
+
+    async def aclose(self):
+        self.close()
+
+
+class ChessApiBackend(EvaluationBackend):
+    """
+    Remote Stockfish evaluation through the chess-api.com HTTP API. Both the
+    sync session and the async client keep connections alive between calls.
+    Calls are limited in concurrency and rate, time out, and are retried with
+    jittered backoff on 429/5xx answers and network errors.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        max_connections: int = 100,
+        timeout: float = 10.0,
+        limiter: Limiter | None = None,
+        retries: int = 3,
+        retry_base_delay: float = 0.5,
+        retry_max_delay: float = 8.0,
+    ):
+        self.url = url
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.limiter = limiter or Limiter()
+        self.retry_options = {"attempts": retries, "base_delay": retry_base_delay, "max_delay": retry_max_delay}
+        self._session = requests.Session()
+        self._async_client: httpx.AsyncClient | None = None
+
+    def _analyse_once(self, fen: str) -> dict:
+        with self.limiter.limit():
+            response = self._session.post(self.url, {"fen": fen}, timeout=self.timeout)
+        raise_for_retry(response.status_code, response.headers)
+        return response.json()
+
+    def analyse(self, fen: str) -> dict:
+        return retry(
+            lambda: self._analyse_once(fen),
+            retry_on=(UpstreamError, requests.Timeout, requests.ConnectionError),
+            **self.retry_options,
+        )
+
+    async def _aanalyse_once(self, fen: str) -> dict:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+        async with self.limiter.alimit():
+            response = await self._async_client.post(self.url, data={"fen": fen})
+        raise_for_retry(response.status_code, response.headers)
+        return response.json()
+
+    async def aanalyse(self, fen: str) -> dict:
+        return await aretry(
+            lambda: self._aanalyse_once(fen),
+            retry_on=(UpstreamError, httpx.TimeoutException, httpx.TransportError),
+            **self.retry_options,
+        )
+
+    def close(self):
+        self._session.close()
+
+    async def aclose(self):
+        self.close()
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+
+class UciEnginePool(EvaluationBackend):
+    """
+    Pool of long-lived local UCI engine processes. Engines are checked out
+    through a thread-safe queue, so the pool can be shared by FastAPI's
+    threadpool; coroutines go through `aanalyse`, which runs the blocking
+    checkout in a worker thread instead of the event loop.
+    """
+
+    def __init__(
+        self,
+        engine_path: str,
+        size: int = 2,
+        depth: int | None = None,
+        time_limit: float | None = None,
+        hash_mb: int = 64,
+        threads: int = 1,
+        checkout_timeout: float | None = None,
+    ):
+        self.engine_path = engine_path
+        self.checkout_timeout = checkout_timeout
+        self.hash_mb = hash_mb
+        self.threads = threads
+        self.limit = chess.engine.Limit(depth=depth, time=time_limit)
+
+        self._engines: queue.Queue[chess.engine.SimpleEngine] = queue.Queue()
+        for _ in range(size):
+            self._engines.put(self._spawn())
+        # Engines that died and could not be replaced yet; the next checkout retries them.
+        self._missing = 0
+        self._missing_lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _spawn(self) -> chess.engine.SimpleEngine:
+        engine = chess.engine.SimpleEngine.popen_uci(self.engine_path)
+        options = {"Hash": self.hash_mb, "Threads": self.threads}
+        engine.configure({name: value for name, value in options.items() if name in engine.options})
+        return engine
+
+    def _replace(self) -> chess.engine.SimpleEngine | None:
+        try:
+            return self._spawn()
+        except Exception:
+            logger.exception("Failed to restart engine, pool is one engine short")
+            with self._missing_lock:
+                self._missing += 1
+            return None
+
+    def _replenish(self):
+        with self._missing_lock:
+            missing, self._missing = self._missing, 0
+        for i in range(missing):
+            engine = self._replace()
+            if engine is None:
+                # _replace counted the failed one again; the ones not tried wait for a later checkout too.
+                with self._missing_lock:
+                    self._missing += missing - i - 1
+                return
+            self._engines.put(engine)
+
+    @contextmanager
+    def checkout(self) -> Iterator[chess.engine.SimpleEngine]:
+        if self._missing:
+            self._replenish()
+        try:
+            engine = self._engines.get(timeout=self.checkout_timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No engine free after {self.checkout_timeout}s") from None
+        try:
+            yield engine
+        except chess.engine.EngineTerminatedError:
+            # Never return the dead engine; a failed restart leaves the pool short until a later checkout.
+            engine = self._replace()
+            raise
+        finally:
+            if engine is not None:
+                self._engines.put(engine)
+
+    def analyse(self, fen: str) -> dict:
+        board = chess.Board(fen)
+        with self.checkout() as engine:
+            info = engine.analyse(board, self.limit)
+
+        score = info["score"].white()
+        pv = info.get("pv", [])
+        return build_analysis(
+            board,
+            pv[0] if pv else None,
+            centipawns=score.score(mate_score=100_000),
+            mate=score.mate(),
+            depth=info.get("depth"),
+            continuation=pv,
+        )
+
+    def close(self):
+        while not self._engines.empty():
+            try:
+                self._engines.get_nowait().quit()
+            except (queue.Empty, chess.engine.EngineError, chess.engine.EngineTerminatedError):
+                pass
+
+
+@cache
+def get_evaluation_backend() -> EvaluationBackend:
+    settings = get_agent_settings()
+    if settings.evaluation_backend == "chess_api":
+        return ChessApiBackend(
+            settings.chess_api_url,
+            max_connections=settings.chess_api_max_connections,
+            timeout=settings.chess_api_timeout,
+            limiter=Limiter(settings.chess_api_max_concurrency, settings.chess_api_rate_limit, settings.chess_api_burst),
+            retries=settings.chess_api_retries,
+            retry_base_delay=settings.retry_base_delay,
+            retry_max_delay=settings.retry_max_delay,
+        )
+    if settings.evaluation_backend == "uci":
+        return UciEnginePool(
+            engine_path=settings.uci_engine_path,
+            size=settings.uci_pool_size,
+            depth=settings.uci_depth,
+            time_limit=settings.uci_time_limit,
+            hash_mb=settings.uci_hash_mb,
+            threads=settings.uci_threads,
+            checkout_timeout=settings.uci_checkout_timeout,
+        )
+    raise ValueError(f"Unknown evaluation backend: {settings.evaluation_backend}")
@@ -0,0 +1,220 @@
+"""
+Whole-game analysis in one pass over the moves.
+
+Every position of the game is evaluated once: the position after ply i is
+the position before ply i + 1, so adjacent plies share their evaluation.
+Per-ply results are cached under a hash of the game prefix that ends with
+that ply, so a client re-sending the growing history of a live game only
+pays for the plies it has not sent before.
+"""
+import asyncio
+import hashlib
+import io
+import math
+
+import chess
+import chess.pgn
+
+from src.board_analysis import PIECE_VALUES
+from src.cache import get_game_cache, position_key
+from src.tools import aget_stockfish_analyses, get_stockfish_analyses
+
+# Drops in the mover's win chance, in percentage points, as lichess grades moves.
+INACCURACY = 5
+MISTAKE = 10
+BLUNDER = 15
+MAX_CENTIPAWN_LOSS = 1000
+CACHE_VERSION = "1"
+
+
+def parse_game(pgn: str | None = None, moves: list[str] | None = None, fen: str | None = None) -> tuple[str, list[chess.Move]]:
+    """
+    Read a game from PGN text or from a list of SAN or UCI moves.
+    Returns:
+        - tuple[str, list[chess.Move]]: The starting FEN and the moves played from it.
+    """
+    if (pgn is None) == (moves is None):
+        raise ValueError("Send either a PGN or a move list")
+
+    if pgn is not None:
+        game = chess.pgn.read_game(io.StringIO(pgn))
+        if game is None:
+            raise ValueError("The PGN contains no game")
+        if game.errors:
+            raise ValueError(f"Invalid PGN: {game.errors[0]}")
+        return game.board().fen(), list(game.mainline_moves())
+
+    board = chess.Board(fen) if fen else chess.Board()
+    start_fen = board.fen()
+    parsed = []
+    for i, move in enumerate(moves, start=1):
+        try:
+            parsed.append(board.push_san(move))
+        except ValueError as e:
+            raise ValueError(f"Illegal move {move!r} at ply {i}") from e
+    return start_fen, parsed
+
+
+def replay(start_fen: str, moves: list[chess.Move]) -> tuple[list[chess.Board], list[str]]:
+    board = chess.Board(start_fen)
+    boards = [board.copy(stack=False)]
+    sans = []
+    for move in moves:
+        sans.append(board.san(move))
+        board.push(move)
+        boards.append(board.copy(stack=False))
+    return boards, sans
+
+
+def prefix_keys(start_fen: str, moves: list[chess.Move]) -> list[str]:
+    """Cache key of every game prefix, chained so each key costs one hash."""
+    key = hashlib.sha256(f"{CACHE_VERSION}|{position_key(start_fen)}".encode()).hexdigest()
+    keys = []
+    for move in moves:
+        key = hashlib.sha256(f"{key}|{move.uci()}".encode()).hexdigest()
+        keys.append(key)
+    return keys
+
+
+def material_balance(board: chess.Board) -> int:
+    return sum(
+        value * (chess.popcount(board.pieces_mask(piece_type, chess.WHITE))
+                 - chess.popcount(board.pieces_mask(piece_type, chess.BLACK)))
+        for piece_type, value in PIECE_VALUES.items()
+    )
+
+
+def terminal_eval(board: chess.Board) -> dict | None:
+    """Finished games are scored locally instead of asking the engine about a position without moves."""
+    if board.is_checkmate():
+        return {"centipawns": -100_000 if board.turn else 100_000, "winChance": 0.0 if board.turn else 100.0}
+    if board.is_game_over():
+        return {"centipawns": 0, "winChance": 50.0}
+    return None
+
+
+def accuracy(win_chance_before: float, win_chance_after: float) -> float:
+    """Move accuracy from the mover's win chance before and after, with lichess' curve."""
+    if win_chance_after >= win_chance_before:
+        return 100.0
+    value = 103.1668 * math.exp(-0.04354 * (win_chance_before - win_chance_after)) - 3.1669
+    return min(100.0, max(0.0, value))
+
+
+def classify(win_chance_loss: float, best: bool) -> str:
+    if best:
+        return "best"
+    if win_chance_loss >= BLUNDER:
+        return "blunder"
+    if win_chance_loss >= MISTAKE:
+        return "mistake"
+    if win_chance_loss >= INACCURACY:
+        return "inaccuracy"
+    return "good"
+
+
+def describe_ply(ply: int, boards: list[chess.Board], sans: list[str], move: chess.Move, before: dict, after: dict) -> dict:
+    board = boards[ply - 1]
+    mover = board.turn
+    sign = 1 if mover == chess.WHITE else -1
+
+    entry = {
+        "ply": ply,
+        "move_number": board.fullmove_number,
+        "color": "white" if mover else "black",
+        "san": sans[ply - 1],
+        "uci": move.uci(),
+        "fen": boards[ply].fen(),
+        "material_balance": material_balance(boards[ply]),
+        "material_swing": material_balance(boards[ply]) - material_balance(board),
+    }
+    if "centipawns" not in before or "centipawns" not in after:
+        return {**entry, "classification": None}
+
+    win_chance_before = before["winChance"] if mover else 100 - before["winChance"]
+    win_chance_after = after["winChance"] if mover else 100 - after["winChance"]
+    centipawn_loss = sign * (before["centipawns"] - after["centipawns"])
+    best_move = before.get("move")
+    return {
+        **entry,
+        "centipawns_before": before["centipawns"],
+        "centipawns_after": after["centipawns"],
+        "win_chance_before": win_chance_before,
+        "win_chance_after": win_chance_after,
+        "win_chance_loss": max(0.0, win_chance_before - win_chance_after),
+        "centipawn_loss": min(MAX_CENTIPAWN_LOSS, max(0, centipawn_loss)),
+        "accuracy": accuracy(win_chance_before, win_chance_after),
+        "best_move": board.san(chess.Move.from_uci(best_move)) if best_move else None,
+        "classification": classify(win_chance_before - win_chance_after, move.uci() == best_move),
+    }
+
+
+def summarize(plies: list[dict]) -> dict:
+    summary = {}
+    for color in ["white", "black"]:
+        graded = [ply for ply in plies if ply["color"] == color and ply["classification"] is not None]
+        summary[color] = {
+            "moves": len(graded),
+            "accuracy": sum(ply["accuracy"] for ply in graded) / len(graded) if graded else None,
+            "average_centipawn_loss": sum(ply["centipawn_loss"] for ply in graded) / len(graded) if graded else None,
+            **{
+                label: sum(ply["classification"] == label for ply in graded)
+                for label in ["inaccuracy", "mistake", "blunder"]
+            },
+        }
+    return summary
+
+
+class GamePlan:
+    """The part of a game that is not cached yet, and the positions it needs evaluated."""
+
+    def __init__(self, start_fen: str, moves: list[chess.Move]):
+        self.moves = moves
+        self.boards, self.sans = replay(start_fen, moves)
+        self.keys = prefix_keys(start_fen, moves)
+
+        game_cache = get_game_cache()
+        self.plies = []
+        for key in self.keys:
+            ply = game_cache.get(key)
+            if ply is None:
+                break
+            self.plies.append(ply)
+        self.first = len(self.plies)
+
+        self.evals = {}
+        self.fens = {}
+        if self.first < len(moves):
+            for i in range(self.first, len(self.boards)):
+                terminal = terminal_eval(self.boards[i])
+                if terminal is not None:
+                    self.evals[i] = terminal
+                else:
+                    self.fens[i] = self.boards[i].fen()
+
+    def finish(self, analyses: list[dict]) -> dict:
+        self.evals.update(zip(self.fens, analyses))
+        game_cache = get_game_cache()
+        for i in range(self.first, len(self.moves)):
+            ply = describe_ply(i + 1, self.boards, self.sans, self.moves[i], self.evals[i], self.evals[i + 1])
+            if ply["classification"] is not None:
+                game_cache.set(self.keys[i], ply)
+            self.plies.append(ply)
+
+        return {
+            "plies": self.plies,
+            "summary": summarize(self.plies),
+            "cached_plies": self.first,
+        }
+
+
+def analyze_game(start_fen: str, moves: list[chess.Move]) -> dict:
+    plan = GamePlan(start_fen, moves)
+    return plan.finish(list(get_stockfish_analyses(list(plan.fens.values()))))
+
+
+async def aanalyze_game(start_fen: str, moves: list[chess.Move]) -> dict:
+    # Planning and finishing read and write the game cache once per ply; keep that SQLite I/O off the event loop.
+    plan = await asyncio.to_thread(GamePlan, start_fen, moves)
+    analyses = await aget_stockfish_analyses(list(plan.fens.values()))
+    return await asyncio.to_thread(plan.finish, analyses)
@@ -0,0 +1,244 @@
+"""
+Incremental ingestion of the chess expert documents.
+
+Every source file is hashed and only new or changed files are parsed again.
+Chunks are keyed by the hash of the text they embed, so chunks that did not
+change keep their stored embedding even inside a changed file. Deleted files
+are dropped. Each store is written as a new version of the store directory
+(see `src.versions`) and swapped in atomically, so new readers always see a
+complete store while running workers keep serving the one they loaded.
+
+    python -m src.ingest [--docs docs] [--store chess_expert_store] [--batch-size 32] [--workers 0] [--mmap]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from llama_index.core import Settings, SimpleDirectoryReader, StorageContext
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.data_structs import IndexDict
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.vector_stores import SimpleVectorStore
+
+from src.config import get_agent_settings
+from src.logs import configure_logging
+from src.vector_store import MmapVectorStore
+from src.versions import current_version, new_version_path, swap_in
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "ingest_manifest.json"
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_hash(node: BaseNode) -> str:
+    return hashlib.sha256(node.get_content(metadata_mode=MetadataMode.EMBED).encode()).hexdigest()
+
+
+def list_files(docs_path: str) -> dict[str, str]:
+    """Relative path -> content hash for every non-hidden file under docs_path."""
+    files = {}
+    for root, dirs, names in os.walk(docs_path):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in names:
+            if not name.startswith("."):
+                path = os.path.join(root, name)
+                files[os.path.relpath(path, docs_path)] = file_hash(path)
+    return files
+
+
+def load_store(store_path: str) -> tuple[dict, SimpleDocumentStore | None, dict]:
+    if not os.path.exists(store_path):
+        return {}, None, {}
+    # Read one version even if a concurrent ingest swaps the symlink meanwhile.
+    store_path = current_version(store_path)
+
+    manifest_path = os.path.join(store_path, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    vector_path = os.path.join(store_path, "default__vector_store.json")
+    embeddings = (
+        SimpleVectorStore.from_persist_path(vector_path).data.embedding_dict
+        if os.path.exists(vector_path) else {}
+    )
+    return manifest, SimpleDocumentStore.from_persist_dir(store_path), embeddings
+
+
+_worker_model: BaseEmbedding | None = None
+
+
+def _init_worker(batch_size: int):
+    global _worker_model
+    from src.embeddings import create_embed_model
+
+    # Same backend as the query side, so documents and queries share one vector space.
+    _worker_model = create_embed_model(cache_size=0)
+    _worker_model.embed_batch_size = batch_size
+
+
+def _embed_in_worker(texts: list[str]) -> list[list[float]]:
+    return _worker_model.get_text_embedding_batch(texts)
+
+
+def embed_texts(
+    texts: list[str],
+    batch_size: int,
+    num_workers: int,
+    embed_model: BaseEmbedding | None = None,
+) -> list[list[float]]:
+    """Embed `texts` in batches, in worker processes or with `embed_model` if the caller already holds one."""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+
+    if num_workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=_init_worker,
+            initargs=(batch_size,),
+        ) as executor:
+            results = list(executor.map(_embed_in_worker, batches))
+    else:
+        if embed_model is None:
+            _init_worker(batch_size)
+            embed_model = _worker_model
+        results = []
+        for i, batch in enumerate(batches, start=1):
+            results.append(embed_model.get_text_embedding_batch(batch))
+            logger.info("Embedded batch %d/%d", i, len(batches))
+
+    return [embedding for batch in results for embedding in batch]
+
+
+def ingest(
+    docs_path: str,
+    store_path: str,
+    batch_size: int = 32,
+    num_workers: int = 0,
+    mmap_store_path: str | None = None,
+    quantize: bool = False,
+    embed_model: BaseEmbedding | None = None,
+) -> dict:
+    """
+    Bring the persisted index at `store_path` up to date with `docs_path`.
+    Returns:
+        - dict: How many files were added, changed, removed or kept, and how many chunks were embedded.
+    """
+    manifest, docstore, embeddings = load_store(store_path)
+    files = list_files(docs_path)
+
+    # A store written before the manifest existed has no file mapping, so every file is treated as new.
+    kept = [path for path, digest in files.items() if manifest.get(path, {}).get("hash") == digest]
+    changed = [path for path in files if path not in kept]
+    removed = [path for path in manifest if path not in files]
+
+    nodes = []
+    new_manifest = {}
+    for path in kept:
+        node_ids = manifest[path]["node_ids"]
+        nodes.extend(docstore.get_nodes(node_ids))
+        new_manifest[path] = manifest[path]
+
+    known_chunks = {}
+    if docstore is not None:
+        for node in docstore.docs.values():
+            if node.node_id in embeddings:
+                known_chunks[chunk_hash(node)] = embeddings[node.node_id]
+
+    if changed:
+        documents = SimpleDirectoryReader(
+            input_files=[os.path.join(docs_path, path) for path in changed],
+            filename_as_id=True,
+        ).load_data()
+        for path in changed:
+            new_manifest[path] = {"hash": files[path], "node_ids": []}
+
+        abs_paths = {os.path.abspath(os.path.join(docs_path, path)): path for path in changed}
+        for node in Settings.node_parser.get_nodes_from_documents(documents):
+            path = abs_paths.get(os.path.abspath(node.metadata.get("file_path", "")))
+            if path is not None:
+                new_manifest[path]["node_ids"].append(node.node_id)
+            node.embedding = known_chunks.get(chunk_hash(node))
+            nodes.append(node)
+
+    for node in nodes:
+        if node.embedding is None:
+            node.embedding = embeddings.get(node.node_id)
+    to_embed = [node for node in nodes if node.embedding is None]
+
+    report = {
+        "added": len([path for path in changed if path not in manifest]),
+        "changed": len([path for path in changed if path in manifest]),
+        "removed": len(removed),
+        "kept": len(kept),
+        "embedded_chunks": len(to_embed),
+        "total_chunks": len(nodes),
+    }
+    if not changed and not removed and not to_embed and os.path.exists(store_path):
+        return report
+
+    if to_embed:
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in to_embed]
+        for node, embedding in zip(to_embed, embed_texts(texts, batch_size, num_workers, embed_model)):
+            node.embedding = embedding
+
+    storage_context = StorageContext.from_defaults()
+    storage_context.docstore.add_documents(nodes)
+    storage_context.vector_store.add(nodes)
+    index_struct = IndexDict()
+    for node in nodes:
+        index_struct.add_node(node, text_id=node.node_id)
+    storage_context.index_store.add_index_struct(index_struct)
+
+    new_store_path = new_version_path(store_path)
+    storage_context.persist(persist_dir=new_store_path)
+    with open(os.path.join(new_store_path, MANIFEST_FILE), "w") as f:
+        json.dump(new_manifest, f)
+    swap_in(new_store_path, store_path)
+
+    if mmap_store_path is not None:
+        new_mmap_path = new_version_path(mmap_store_path)
+        MmapVectorStore.write(new_mmap_path, nodes, [node.embedding for node in nodes], quantize)
+        swap_in(new_mmap_path, mmap_store_path)
+
+    return report
+
+
+def main():
+    settings = get_agent_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", default=settings.docs_path)
+    parser.add_argument("--store", default=settings.store_path)
+    parser.add_argument("--batch-size", type=int, default=settings.ingest_batch_size)
+    parser.add_argument("--workers", type=int, default=settings.ingest_workers,
+                        help="Embedding processes; 0 or 1 embeds in this process")
+    parser.add_argument("--mmap", action="store_true", help=f"Also write the memory-mapped store to {settings.mmap_store_path}")
+    parser.add_argument("--quantize", action="store_true", help="Store int8 embeddings in the memory-mapped store")
+    args = parser.parse_args()
+    configure_logging()
+
+    report = ingest(
+        args.docs,
+        args.store,
+        batch_size=args.batch_size,
+        num_workers=args.workers,
+        mmap_store_path=settings.mmap_store_path if args.mmap else None,
+        quantize=args.quantize,
+    )
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Level-controlled logging for the API and the CLIs.
+
+`LOG_LEVEL` sets the level and `LOG_FORMAT` picks `json` (one object per
+line, with any `extra=` fields and the current endpoint) or `text`.
+"""
+import json
+import logging
+import sys
+
+from src.config import get_agent_settings
+from src.metrics import NO_ENDPOINT, current_endpoint
+
+# Attributes every LogRecord has; anything else was passed through `extra=`.
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        endpoint = current_endpoint.get()
+        if endpoint != NO_ENDPOINT:
+            entry["endpoint"] = endpoint
+        entry.update({key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str | None = None, fmt: str | None = None):
+    settings = get_agent_settings()
+    fmt = fmt or settings.log_format
+    if fmt not in ("json", "text"):
+        raise ValueError(f"Unknown log format: {fmt}")
+
+    handler = logging.StreamHandler(sys.stderr)
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    logger = logging.getLogger("src")
+    logger.handlers[:] = [handler]
+    logger.setLevel((level or settings.log_level).upper())
+    # Records stop here instead of being printed again by whatever the server put on the root logger.
+    logger.propagate = False
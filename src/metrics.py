@@ -0,0 +1,245 @@
+"""
+Prometheus metrics for the hot path, served on `/metrics`.
+
+Every metric is labelled with the endpoint that caused it, taken from a
+context variable that MetricsMiddleware sets per request, so time spent in
+the engine, board analysis, embeddings, retrieval and each LLM call of the
+agent loop can be split by endpoint. llama-index components report through
+MetricsCallbackHandler; the rest of the code uses `timed`.
+
+With several worker processes, set PROMETHEUS_MULTIPROC_DIR to a shared
+empty directory so `/metrics` aggregates all of them.
+"""
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import cache
+from typing import Iterator
+
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+from llama_index.core.callbacks.schema import CBEventType, EventPayload
+from llama_index.core.callbacks.token_counting import get_llm_token_counts
+from llama_index.core.utilities.token_counting import TokenCounter
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+NO_ENDPOINT = "none"
+OTHER_ENDPOINT = "other"
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+ITERATION_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 15)
+
+REQUEST_SECONDS = Histogram(
+    "chess_mentor_request_seconds", "HTTP request latency, including streamed bodies",
+    ["endpoint", "method", "status"], buckets=SECONDS_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "chess_mentor_stage_seconds", "Latency of one stage of a request (engine, board_analysis, embedding, retrieval, llm, ...)",
+    ["stage", "endpoint"], buckets=SECONDS_BUCKETS,
+)
+STAGE_ERRORS = Counter("chess_mentor_stage_errors_total", "Stages that raised", ["stage", "endpoint"])
+TOOL_SECONDS = Histogram(
+    "chess_mentor_tool_seconds", "Latency of agent tool calls", ["tool", "endpoint"], buckets=SECONDS_BUCKETS,
+)
+TOOL_OUTPUT_TOKENS = Histogram(
+    "chess_mentor_tool_output_tokens", "Prompt tokens a tool call adds to the agent scratchpad",
+    ["tool", "verbosity"], buckets=TOKEN_BUCKETS,
+)
+LLM_TOKENS = Counter("chess_mentor_llm_tokens_total", "LLM tokens by endpoint", ["endpoint", "kind"])
+AGENT_ITERATIONS = Histogram(
+    "chess_mentor_agent_iterations", "LLM turns of the agent loop per request", ["endpoint"], buckets=ITERATION_BUCKETS,
+)
+AGENT_BUDGET_EXHAUSTED = Counter(
+    "chess_mentor_agent_budget_exhausted_total", "Agent runs cut short by their iteration or token budget",
+    ["endpoint", "budget"],
+)
+EVALUATIONS = Counter(
+    "chess_mentor_evaluations_total", "Position evaluations by where they were answered from",
+    ["source", "endpoint"],
+)
+EMBEDDING_CACHE = Counter("chess_mentor_query_embedding_cache_total", "Query embedding cache lookups", ["result"])
+RETRIEVAL_CACHE = Counter("chess_mentor_retrieval_cache_total", "chess_expert passage cache lookups", ["result"])
+PREFETCHES = Counter(
+    "chess_mentor_prefetch_total", "Prefetch jobs by outcome (queued, dropped, stale, cancelled, over_budget, evaluated, ...)",
+    ["result"],
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "chess_mentor_admission_queue_depth", "Requests waiting for admission", ["endpoint"], multiprocess_mode="livesum",
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "chess_mentor_admission_in_flight", "Admitted requests being served", ["endpoint"], multiprocess_mode="livesum",
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "chess_mentor_admission_wait_seconds", "Time spent waiting for admission, by outcome (admitted, expired, evicted)",
+    ["endpoint", "outcome"], buckets=SECONDS_BUCKETS,
+)
+ADMISSION_REJECTED = Counter(
+    "chess_mentor_admission_rejected_total", "Requests rejected by admission control (queue_full, evicted, deadline)",
+    ["endpoint", "reason"],
+)
+
+
+@dataclass
+class RequestStats:
+    agent_iterations: int = 0
+
+
+current_endpoint: ContextVar[str] = ContextVar("current_endpoint", default=NO_ENDPOINT)
+current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+_open_llm_event: ContextVar[str | None] = ContextVar("open_llm_event", default=None)
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage, current_endpoint.get()).observe(seconds)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.labels(stage, current_endpoint.get()).inc()
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def count_evaluation(source: str):
+    EVALUATIONS.labels(source, current_endpoint.get()).inc()
+
+
+def render() -> tuple[bytes, str]:
+    """The exposition text and its content type."""
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that labels everything a request does with its endpoint
+    and records the request latency. Being plain ASGI rather than
+    BaseHTTPMiddleware, it only finishes after a streamed body is sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._paths: set[str] | None = None
+
+    def endpoint(self, scope) -> str:
+        if self._paths is None:
+            self._paths = {getattr(route, "path", None) for route in scope["app"].routes}
+        # Unknown paths share a label, so scanners cannot blow up the label cardinality.
+        return scope["path"] if scope["path"] in self._paths else OTHER_ENDPOINT
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self.endpoint(scope)
+        stats = RequestStats()
+        endpoint_token = current_endpoint.set(endpoint)
+        request_token = current_request.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_SECONDS.labels(endpoint, scope["method"], str(status)).observe(time.perf_counter() - start)
+            if stats.agent_iterations:
+                AGENT_ITERATIONS.labels(endpoint).observe(stats.agent_iterations)
+            current_request.reset(request_token)
+            current_endpoint.reset(endpoint_token)
+
+
+STAGES = {
+    CBEventType.LLM: "llm",
+    CBEventType.EMBEDDING: "embedding",
+    CBEventType.RETRIEVE: "retrieval",
+    CBEventType.SYNTHESIZE: "synthesis",
+    CBEventType.QUERY: "query",
+}
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Times llama-index events and counts LLM tokens. An LLM call whose
+    nearest agent-related ancestor is the agent step itself (not a tool
+    call) is one iteration of the agent loop. LLM events raised inside
+    another one (e.g. chat implemented on top of complete) are not counted.
+    """
+
+    def __init__(self):
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self.token_counter = TokenCounter()
+        self._events: dict[str, tuple[CBEventType, str, float, str | None]] = {}
+
+    def on_event_start(self, event_type, payload=None, event_id="", parent_id="", **kwargs) -> str:
+        if event_type == CBEventType.LLM:
+            # An open LLM event that ended in another context (e.g. a stream) is no longer in _events.
+            if _open_llm_event.get() in self._events:
+                return event_id
+            _open_llm_event.set(event_id)
+        tool = (payload or {}).get(EventPayload.TOOL) if event_type == CBEventType.FUNCTION_CALL else None
+        self._events[event_id] = (event_type, parent_id, time.perf_counter(), getattr(tool, "name", None))
+        return event_id
+
+    def on_event_end(self, event_type, payload=None, event_id="", **kwargs):
+        event = self._events.get(event_id)
+        if event is None:
+            return
+        _, parent_id, start, tool = event
+        seconds = time.perf_counter() - start
+        endpoint = current_endpoint.get()
+
+        try:
+            if event_type == CBEventType.FUNCTION_CALL:
+                TOOL_SECONDS.labels(tool or "unknown", endpoint).observe(seconds)
+                return
+            if event_type in STAGES:
+                STAGE_SECONDS.labels(STAGES[event_type], endpoint).observe(seconds)
+            if event_type != CBEventType.LLM or not payload:
+                return
+
+            counts = get_llm_token_counts(self.token_counter, payload, event_id)
+            LLM_TOKENS.labels(endpoint, "prompt").inc(counts.prompt_token_count)
+            LLM_TOKENS.labels(endpoint, "completion").inc(counts.completion_token_count)
+            stats = current_request.get()
+            if stats is not None and self._agent_ancestor(parent_id) == CBEventType.AGENT_STEP:
+                stats.agent_iterations += 1
+        finally:
+            self._events.pop(event_id, None)
+
+    def _agent_ancestor(self, event_id: str) -> CBEventType | None:
+        while event_id in self._events:
+            event_type, parent_id, _, _ = self._events[event_id]
+            if event_type in (CBEventType.AGENT_STEP, CBEventType.FUNCTION_CALL):
+                return event_type
+            event_id = parent_id
+        return None
+
+    def start_trace(self, trace_id=None):
+        pass
+
+    def end_trace(self, trace_id=None, trace_map=None):
+        pass
+
+
+@cache
+def get_callback_manager() -> CallbackManager:
+    return CallbackManager([MetricsCallbackHandler()])
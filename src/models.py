@@ -18,6 +18,12 @@ class ApiRequest(BaseModel):
     history: list[Move] | None = None
 
 
+class GameRequest(BaseModel):
+    pgn: str | None = None
+    moves: list[str] | None = None
+    fen: str | None = None
+
+
 class BoardAnalysis(BaseModel):
     winning: int
     centipawn_score: int
@@ -0,0 +1,268 @@
+"""
+Speculative prefetch of the positions a live game is likely to reach next.
+
+After a position endpoint answers, the prefetcher walks the engine's line
+from that position: the position after the best move, then after the best
+reply to it, and so on for `PREFETCH_DEPTH` plies. If the client already
+sent the move it is about to play (`next_move`), that line goes first. Each
+position is evaluated into the evaluation cache and, with
+PREFETCH_EXPLANATIONS, positions where the player is to move also get their
+fast path best-move explanation generated into the response cache. The next
+request of the game then usually starts from a cache hit.
+
+Prefetching is off unless PREFETCH_ENABLED is set: with the default
+chess-api.com backend, every prefetched position is an extra call to that
+third-party service.
+
+Prefetching never competes with real requests:
+
+- jobs wait in a bounded queue and are dropped when it is full;
+- a few background workers run them, and only while at most
+  PREFETCH_MAX_FOREGROUND position requests are being served;
+- every engine or LLM call a user's prefetch makes takes a token from the
+  bucket of that user's client address, PREFETCH_USER_BUDGET calls per
+  PREFETCH_BUDGET_WINDOW seconds; without a token the line is abandoned.
+  Users are told apart as in `src.app.get_user_id`, and sessions sharing
+  an address share its budget;
+- a new request from the same user (address and session) cancels whatever
+  is left of the previous prefetch, since the real move has arrived. Engine calls already in flight
+  still finish and are cached, because evaluations are shared through
+  AsyncSingleFlight.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import cache
+from typing import Awaitable, Callable, Iterator
+
+import chess
+
+from src.cache import position_key
+from src.concurrency import TokenBucket
+from src.config import get_agent_settings
+from src.metrics import PREFETCHES, current_endpoint
+from src.tools import aget_stockfish_analysis, alookup_analysis
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_ENDPOINT = "prefetch"
+
+
+@dataclass(frozen=True)
+class PrefetchUser:
+    client: str
+    session: str | None = None
+
+
+@dataclass
+class PrefetchJob:
+    user: PrefetchUser
+    generation: int
+    fen: str
+    depth: int
+    language: str
+    player: int
+
+
+@dataclass
+class UserState:
+    bucket: TokenBucket
+    generation: int = 0
+    seen: set[str] = field(default_factory=set)
+    tasks: set[asyncio.Task] = field(default_factory=set)
+
+
+class Prefetcher:
+    def __init__(
+        self,
+        depth: int = 2,
+        queue_size: int = 256,
+        workers: int = 2,
+        user_budget: int = 20,
+        budget_window: float = 60.0,
+        max_foreground: int = 4,
+        max_users: int = 10_000,
+    ):
+        self.depth = depth
+        self.queue_size = queue_size
+        self.workers = workers
+        self.user_budget = user_budget
+        self.budget_window = budget_window
+        self.max_foreground = max_foreground
+        self.max_users = max_users
+
+        self.explain: Callable[[str, str], Awaitable[None]] | None = None
+        self.foreground_requests = 0
+        self._users: OrderedDict[PrefetchUser, UserState] = OrderedDict()
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._queue: asyncio.Queue[PrefetchJob] | None = None
+        self._idle: asyncio.Event | None = None
+        self._workers: list[asyncio.Task] = []
+
+    def start(self, explain: Callable[[str, str], Awaitable[None]] | None = None):
+        """
+        Start the workers on the running event loop. `explain(fen, language)`,
+        if given, pre-generates the explanation of a position.
+        """
+        self.explain = explain
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._idle = asyncio.Event()
+        self._update_idle()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        for user in self._users.values():
+            for task in user.tasks:
+                task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    def _bucket(self, client: str) -> TokenBucket:
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.user_budget / self.budget_window, self.user_budget)
+            while len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(client)
+        return bucket
+
+    def _user(self, user: PrefetchUser) -> UserState:
+        state = self._users.get(user)
+        if state is None:
+            state = self._users[user] = UserState(self._bucket(user.client))
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        self._users.move_to_end(user)
+        return state
+
+    def _update_idle(self):
+        if self._idle is None:
+            return
+        if self.foreground_requests <= self.max_foreground:
+            self._idle.set()
+        else:
+            self._idle.clear()
+
+    @contextmanager
+    def foreground(self, user: PrefetchUser) -> Iterator[None]:
+        """
+        Wrap a position request of `user`: it supersedes that user's earlier
+        prefetch and holds the workers back while too many requests are in flight.
+        """
+        state = self._user(user)
+        state.generation += 1
+        state.seen.clear()
+        for task in state.tasks:
+            task.cancel()
+            PREFETCHES.labels("cancelled").inc()
+
+        self.foreground_requests += 1
+        self._update_idle()
+        try:
+            yield
+        finally:
+            self.foreground_requests -= 1
+            self._update_idle()
+
+    def submit(self, user: PrefetchUser, fen: str, language: str = "en", player: int = 1, next_move: str | None = None):
+        """Queue the likely continuations of a position `user` was just served; never blocks."""
+        if not self.running or self.depth <= 0:
+            return
+        state = self._user(user)
+        roots = []
+        if next_move is not None:
+            board = chess.Board(fen)
+            try:
+                board.push_san(next_move)
+            except ValueError:
+                logger.debug("Ignoring illegal next move", extra={"fen": fen, "move": next_move})
+            else:
+                roots.append((board.fen(), self.depth - 1))
+        roots.append((fen, self.depth))
+
+        for root_fen, depth in roots:
+            self._enqueue(PrefetchJob(user, state.generation, root_fen, depth, language, player))
+
+    def _enqueue(self, job: PrefetchJob):
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            PREFETCHES.labels("dropped").inc()
+            return
+        PREFETCHES.labels("queued").inc()
+
+    def _current(self, job: PrefetchJob) -> UserState | None:
+        state = self._users.get(job.user)
+        if state is None or state.generation != job.generation:
+            return None
+        return state
+
+    async def _work(self):
+        current_endpoint.set(PREFETCH_ENDPOINT)
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._idle.wait()
+                state = self._current(job)
+                if state is None:
+                    PREFETCHES.labels("stale").inc()
+                    continue
+                task = asyncio.create_task(self._prefetch(job, state))
+                state.tasks.add(task)
+                # wait() rather than await, so cancelling the job does not cancel the worker.
+                await asyncio.wait({task})
+                state.tasks.discard(task)
+                if not task.cancelled() and task.exception() is not None:
+                    PREFETCHES.labels("failed").inc()
+                    logger.warning("Prefetch failed", exc_info=task.exception(), extra={"fen": job.fen})
+            finally:
+                self._queue.task_done()
+
+    async def _prefetch(self, job: PrefetchJob, state: UserState):
+        key = position_key(job.fen)
+        if key in state.seen:
+            return
+        state.seen.add(key)
+
+        analysis = await alookup_analysis(job.fen)
+        if analysis is None:
+            if not state.bucket.try_acquire():
+                PREFETCHES.labels("over_budget").inc()
+                return
+            analysis = await aget_stockfish_analysis(job.fen)
+            PREFETCHES.labels("evaluated").inc()
+
+        board = chess.Board(job.fen)
+        if self.explain is not None and board.turn == bool(job.player) and job.depth < self.depth:
+            if not state.bucket.try_acquire():
+                PREFETCHES.labels("over_budget").inc()
+                return
+            await self.explain(job.fen, job.language)
+            PREFETCHES.labels("explained").inc()
+
+        if job.depth > 0 and analysis.get("move"):
+            board.push_uci(analysis["move"])
+            if not board.is_game_over():
+                self._enqueue(PrefetchJob(job.user, job.generation, board.fen(), job.depth - 1, job.language, job.player))
+
+
+@cache
+def get_prefetcher() -> Prefetcher:
+    settings = get_agent_settings()
+    return Prefetcher(
+        depth=settings.prefetch_depth,
+        queue_size=settings.prefetch_queue_size,
+        workers=settings.prefetch_workers,
+        user_budget=settings.prefetch_user_budget,
+        budget_window=settings.prefetch_budget_window,
+        max_foreground=settings.prefetch_max_foreground,
+        max_users=settings.prefetch_max_users,
+    )
@@ -1,17 +1,26 @@
+import logging
 import os
 
 from llama_index.core import (
     VectorStoreIndex,
     StorageContext,
     load_index_from_storage,
-    SimpleDirectoryReader,
     PromptTemplate,
 )
 
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.llms import LLM
 from llama_index.core.query_engine import RetrieverQueryEngine
-from llama_index.llms.openai import OpenAI
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import TextNode
 
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from src.config import get_agent_settings
+from src.ingest import ingest
+from src.versions import current_version
+from src.vector_store import MmapRetriever, MmapVectorStore
+
+logger = logging.getLogger(__name__)
 
 
 class ChessExpertRAG:
@@ -20,26 +29,46 @@ class ChessExpertRAG:
         store_path: str,
         data_dir: str | None = None,
         qa_prompt_tpl: PromptTemplate | None = None,
+        mmap_store_path: str | None = None,
+        similarity_top_k: int = 2,
+        embed_model: BaseEmbedding | None = None,
     ):
         self.store_path = store_path
+        self.similarity_top_k = similarity_top_k
+        self.qa_prompt_tpl = qa_prompt_tpl
+        self.retriever = None
 
-        if not os.path.exists(store_path) and data_dir is not None:
-            self.index = self.ingest_data(store_path, data_dir)
+        # Store paths are symlinks to the current version (see src.ingest); resolve them once so
+        # a load never mixes the files of two versions.
+        if mmap_store_path is not None and os.path.exists(mmap_store_path):
+            self.index = None
+            self.retriever = MmapRetriever(
+                MmapVectorStore(current_version(mmap_store_path)),
+                embed_model=embed_model,
+                similarity_top_k=similarity_top_k,
+            )
+        elif not os.path.exists(store_path) and data_dir is not None:
+            self.index = self.ingest_data(store_path, data_dir, embed_model)
         else:
             self.index = load_index_from_storage(
-                StorageContext.from_defaults(persist_dir=store_path)
+                StorageContext.from_defaults(persist_dir=current_version(store_path)), embed_model=embed_model
             )
 
-        self.qa_prompt_tpl = qa_prompt_tpl
-
-    def ingest_data(self, store_path: str, data_dir: str) -> VectorStoreIndex:
-        documents = SimpleDirectoryReader(data_dir).load_data()
-        index = VectorStoreIndex.from_documents(documents, show_progress=True)
-        index.storage_context.persist(persist_dir=store_path)
-        return index
+    def ingest_data(self, store_path: str, data_dir: str, embed_model: BaseEmbedding | None = None) -> VectorStoreIndex:
+        settings = get_agent_settings()
+        report = ingest(
+            data_dir, store_path, settings.ingest_batch_size, settings.ingest_workers, embed_model=embed_model
+        )
+        logger.info("Ingested %s", data_dir, extra=report)
+        return load_index_from_storage(
+            StorageContext.from_defaults(persist_dir=current_version(store_path)), embed_model=embed_model
+        )
 
-    def get_query_engine(self) -> RetrieverQueryEngine:
-        query_engine = self.index.as_query_engine()
+    def get_query_engine(self, llm: LLM | None = None) -> RetrieverQueryEngine:
+        if self.retriever is not None:
+            query_engine = RetrieverQueryEngine.from_args(self.retriever, llm=llm)
+        else:
+            query_engine = self.index.as_query_engine(llm=llm, similarity_top_k=self.similarity_top_k)
 
         if self.qa_prompt_tpl is not None:
             query_engine.update_prompts(
@@ -48,4 +77,25 @@ class ChessExpertRAG:
 
         return query_engine
 
+    def get_retriever(self, similarity_top_k: int | None = None, callback_manager: CallbackManager | None = None) -> BaseRetriever:
+        similarity_top_k = similarity_top_k or self.similarity_top_k
+        if self.retriever is not None:
+            return MmapRetriever(
+                self.retriever.vector_store,
+                embed_model=self.retriever.embed_model,
+                similarity_top_k=similarity_top_k,
+                callback_manager=callback_manager,
+            )
+
+        retriever = self.index.as_retriever(similarity_top_k=similarity_top_k)
+        if callback_manager is not None:
+            retriever.callback_manager = callback_manager
+        return retriever
 
+    def get_nodes(self) -> list[TextNode]:
+        """Every node of the index, e.g. to build a keyword index over the same passages."""
+        if self.retriever is not None:
+            store = self.retriever.vector_store
+            return [store.get_node(i) for i in range(len(store))]
+        node_ids = list(self.index.index_struct.nodes_dict.values())
+        return [node for node in self.index.docstore.get_nodes(node_ids) if isinstance(node, TextNode)]
@@ -0,0 +1,186 @@
+"""
+Lifespan-managed registry of the heavy components behind the API.
+
+Nothing is built at import time. Each component is loaded once, on first use
+or by `start()`, which loads every registered component concurrently in the
+background while the server already answers liveness checks. Components
+declare what they require and receive it already loaded, so load times are
+measured per component without the time spent waiting on dependencies.
+"""
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import cache
+from typing import Any, Callable
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Component:
+    name: str
+    loader: Callable[..., Any]
+    requires: tuple[str, ...] = ()
+    state: str = PENDING
+    value: Any = None
+    error: str | None = None
+    seconds: float | None = None
+    ready_after: float | None = None
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class ComponentRegistry:
+    def __init__(self):
+        self.components: dict[str, Component] = {}
+        self.started_at: float | None = None
+        self.ready_after: float | None = None
+        self._tasks: list[asyncio.Task] = []
+
+    def register(self, name: str, loader: Callable[..., Any], requires: tuple[str, ...] = ()):
+        """`loader` is called with the loaded value of each component in `requires`, in order."""
+        self.components[name] = Component(name, loader, requires)
+
+    def get(self, name: str) -> Any:
+        component = self.components[name]
+        if component.state == READY:
+            return component.value
+
+        dependencies = [self.get(requirement) for requirement in component.requires]
+        with component.lock:
+            if component.state == READY:
+                return component.value
+
+            component.state = LOADING
+            start = time.perf_counter()
+            try:
+                component.value = component.loader(*dependencies)
+            except Exception as e:
+                component.state = FAILED
+                component.error = repr(e)
+                logger.exception("Failed to load %s", name, extra={"component": name})
+                raise
+
+            component.seconds = time.perf_counter() - start
+            component.error = None
+            component.state = READY
+            if self.started_at is not None:
+                component.ready_after = time.perf_counter() - self.started_at
+            logger.info("Loaded %s in %.2fs", name, component.seconds, extra={"component": name, "seconds": component.seconds})
+
+        if self.ready and self.started_at is not None and self.ready_after is None:
+            self.ready_after = time.perf_counter() - self.started_at
+            logger.info("All components ready %.2fs after startup", self.ready_after, extra={"seconds": self.ready_after})
+        return component.value
+
+    async def aget(self, name: str) -> Any:
+        component = self.components[name]
+        if component.state == READY:
+            return component.value
+        return await asyncio.to_thread(self.get, name)
+
+    def start(self):
+        """Load every component concurrently in the background."""
+        self.started_at = time.perf_counter()
+        self._tasks = [asyncio.create_task(self._load(name)) for name in self.components]
+
+    async def _load(self, name: str):
+        try:
+            await self.aget(name)
+        except Exception:
+            # Already recorded on the component; a later get() retries the load.
+            pass
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    @property
+    def ready(self) -> bool:
+        return all(component.state == READY for component in self.components.values())
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "ready_after": self.ready_after,
+            "components": {
+                name: {
+                    "state": component.state,
+                    "seconds": component.seconds,
+                    "ready_after": component.ready_after,
+                    "error": component.error,
+                }
+                for name, component in self.components.items()
+            },
+        }
+
+
+def load_llm():
+    import httpx
+    from llama_index.core import Settings
+    from llama_index.llms.openai import OpenAI
+
+    from src.concurrency import AsyncLimitedTransport, Limiter, LimitedTransport
+    from src.config import get_agent_settings
+    from src.metrics import get_callback_manager
+
+    settings = get_agent_settings()
+    # Indexes, retrievers and query engines built later pick the instrumented callback manager up from here.
+    Settings.callback_manager = get_callback_manager()
+    # Every OpenAI request, including the SDK's own jittered retries on 429/5xx, takes a limiter slot.
+    limiter = Limiter(settings.openai_max_concurrency, settings.openai_rate_limit, settings.openai_burst)
+    Settings.llm = OpenAI(
+        model=settings.openai_model,
+        api_key=settings.openai_api_key,
+        timeout=settings.openai_timeout,
+        max_retries=settings.openai_max_retries,
+        callback_manager=Settings.callback_manager,
+        http_client=httpx.Client(transport=LimitedTransport(limiter), timeout=settings.openai_timeout),
+        async_http_client=httpx.AsyncClient(transport=AsyncLimitedTransport(limiter), timeout=settings.openai_timeout),
+    )
+    return Settings.llm
+
+
+def load_embed_model():
+    from llama_index.core import Settings
+
+    from src.embeddings import create_embed_model
+
+    Settings.embed_model = create_embed_model()
+    return Settings.embed_model
+
+
+def load_chess_expert_tool(llm, embed_model):
+    from src.tools import create_chess_expert_tool
+
+    return create_chess_expert_tool(llm, embed_model)
+
+
+def load_chess_agent(llm, chess_expert_tool):
+    from src.agent import ChessAgent
+
+    return ChessAgent(llm, chess_expert_tool)
+
+
+def load_explainer(llm):
+    from src.agent import BestMoveExplainer
+
+    return BestMoveExplainer(llm)
+
+
+@cache
+def get_registry() -> ComponentRegistry:
+    registry = ComponentRegistry()
+    registry.register("llm", load_llm)
+    registry.register("embed_model", load_embed_model)
+    registry.register("chess_expert_tool", load_chess_expert_tool, requires=("llm", "embed_model"))
+    registry.register("chess_agent", load_chess_agent, requires=("llm", "chess_expert_tool"))
+    registry.register("explainer", load_explainer, requires=("llm",))
+    return registry
@@ -0,0 +1,224 @@
+"""
+Retrieval-only mode of the chess_expert tool.
+
+Instead of a query engine that runs its own LLM completion to synthesize an
+answer, the tool hands the agent the top passages of the chess expert index
+directly, with their source, so a knowledge lookup costs one retrieval and
+no extra LLM round trip. Passages are deduplicated (overlapping chunks of
+the same page often repeat each other) and capped in length. Operators opt
+in with `CHESS_EXPERT_MODE=retrieve`; the default, `synthesize`, keeps the
+query engine.
+
+With `CHESS_EXPERT_HYBRID=true` candidates are scored by a weighted mix of
+vector similarity and BM25 over the same nodes, which helps with exact
+terms the embedding blurs (opening names, "Lucena", "zwischenzug"). The
+BM25 index is built in memory from the node texts when the tool loads.
+"""
+import math
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+
+import numpy as np
+from llama_index.core import QueryBundle
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import MetadataMode, NodeWithScore, TextNode
+
+from src.metrics import RETRIEVAL_CACHE
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+SOURCE_METADATA = ("file_name", "page_label")
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of texts."""
+
+    def __init__(self, texts: list[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.lengths = np.zeros(len(texts), dtype=np.float32)
+        # term -> (document indices, term frequencies)
+        postings: dict[str, list[tuple[int, int]]] = defaultdict(list)
+        for i, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            self.lengths[i] = sum(counts.values())
+            for term, count in counts.items():
+                postings[term].append((i, count))
+
+        self.average_length = float(self.lengths.mean()) if len(texts) else 0.0
+        self.postings = {
+            term: (np.array([i for i, _ in docs]), np.array([count for _, count in docs], dtype=np.float32))
+            for term, docs in postings.items()
+        }
+        self.idf = {
+            term: math.log(1 + (len(texts) - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self), dtype=np.float32)
+        norms = self.k1 * (1 - self.b + self.b * self.lengths / (self.average_length or 1.0))
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            docs, counts = self.postings[term]
+            scores[docs] += self.idf[term] * counts * (self.k1 + 1) / (counts + norms[docs])
+        return scores
+
+    def top(self, query: str, top_k: int) -> list[tuple[int, float]]:
+        scores = self.scores(query)
+        top_k = min(top_k, int(np.count_nonzero(scores)))
+        if top_k == 0:
+            return []
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(i), float(scores[i])) for i in best]
+
+
+def _normalized(scores: dict[str, float]) -> dict[str, float]:
+    """Scale scores to [0, 1] so vector and BM25 scores can be mixed."""
+    if not scores:
+        return {}
+    low, high = min(scores.values()), max(scores.values())
+    if high == low:
+        return {key: 1.0 for key in scores}
+    return {key: (score - low) / (high - low) for key, score in scores.items()}
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Mixes the candidates of a vector retriever with the BM25 top hits over
+    `nodes`: score = (1 - bm25_weight) * vector + bm25_weight * bm25, each
+    min-max normalized over the candidates. The vector retriever should return
+    more candidates than `similarity_top_k`.
+    """
+
+    def __init__(
+        self,
+        vector_retriever: BaseRetriever,
+        nodes: list[TextNode],
+        similarity_top_k: int = 2,
+        bm25_weight: float = 0.3,
+        callback_manager: CallbackManager | None = None,
+    ):
+        self.vector_retriever = vector_retriever
+        self.nodes = nodes
+        self.similarity_top_k = similarity_top_k
+        self.bm25_weight = bm25_weight
+        self.bm25 = BM25Index([node.get_content(metadata_mode=MetadataMode.NONE) for node in nodes])
+        super().__init__(callback_manager=callback_manager)
+
+    def _combine(self, query: str, vector_hits: list[NodeWithScore]) -> list[NodeWithScore]:
+        candidates = {hit.node.node_id: hit.node for hit in vector_hits}
+        vector_scores = _normalized({hit.node.node_id: hit.score or 0.0 for hit in vector_hits})
+
+        bm25_hits = self.bm25.top(query, max(len(vector_hits), self.similarity_top_k))
+        for i, _ in bm25_hits:
+            candidates.setdefault(self.nodes[i].node_id, self.nodes[i])
+        bm25_scores = _normalized({self.nodes[i].node_id: score for i, score in bm25_hits})
+
+        scored = [
+            NodeWithScore(
+                node=node,
+                score=(1 - self.bm25_weight) * vector_scores.get(node_id, 0.0) + self.bm25_weight * bm25_scores.get(node_id, 0.0),
+            )
+            for node_id, node in candidates.items()
+        ]
+        scored.sort(key=lambda hit: hit.score, reverse=True)
+        return scored[:self.similarity_top_k]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        return self._combine(query_bundle.query_str, self.vector_retriever.retrieve(query_bundle))
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        return self._combine(query_bundle.query_str, await self.vector_retriever.aretrieve(query_bundle))
+
+
+def _clip(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    clipped = text[:max_chars].rsplit(" ", 1)[0]
+    return clipped.rstrip(" ,;:") + "..."
+
+
+class PassageSearch:
+    """
+    Retrieves the top `top_k` distinct passages for a question, as dicts with
+    the text (at most `max_chars`), the score and the source metadata.
+    Results are kept in an LRU cache of `cache_size` questions, keyed by the
+    whitespace-normalized, lowercased question.
+    """
+
+    def __init__(self, retriever: BaseRetriever, top_k: int = 2, max_chars: int = 800, cache_size: int = 256):
+        self.retriever = retriever
+        self.top_k = top_k
+        self.max_chars = max_chars
+        self.cache_size = cache_size
+        self._cache: OrderedDict[str, list[dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def _lookup(self, key: str) -> list[dict] | None:
+        with self._lock:
+            passages = self._cache.get(key)
+            if passages is None:
+                RETRIEVAL_CACHE.labels("miss").inc()
+                return None
+            self._cache.move_to_end(key)
+            RETRIEVAL_CACHE.labels("hit").inc()
+            return passages
+
+    def _store(self, key: str, passages: list[dict]):
+        if not self.cache_size:
+            return
+        with self._lock:
+            self._cache[key] = passages
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def passages(self, hits: list[NodeWithScore]) -> list[dict]:
+        """The best `top_k` hits, skipping any whose text repeats or is contained in a better one."""
+        passages = []
+        seen: list[str] = []
+        for hit in hits:
+            text = " ".join(hit.node.get_content(metadata_mode=MetadataMode.NONE).split())
+            normalized = text.lower()
+            if not normalized or any(normalized in other or other in normalized for other in seen):
+                continue
+            seen.append(normalized)
+            passages.append({
+                "text": _clip(text, self.max_chars),
+                "score": round(hit.score, 3) if hit.score is not None else None,
+                "source": {key: hit.node.metadata[key] for key in SOURCE_METADATA if key in hit.node.metadata},
+            })
+            if len(passages) == self.top_k:
+                break
+        return passages
+
+    def search(self, query: str) -> list[dict]:
+        key = self._key(query)
+        passages = self._lookup(key)
+        if passages is None:
+            passages = self.passages(self.retriever.retrieve(query))
+            self._store(key, passages)
+        return passages
+
+    async def asearch(self, query: str) -> list[dict]:
+        key = self._key(query)
+        passages = self._lookup(key)
+        if passages is None:
+            passages = self.passages(await self.retriever.aretrieve(query))
+            self._store(key, passages)
+        return passages
@@ -0,0 +1,144 @@
+"""
+Pre-forking server whose workers share the heavy read-only state.
+
+`uvicorn --workers N` spawns fresh interpreters, so every worker imports the
+app and loads its own copy of the embedding model, the chess expert index and
+the agent. Here the parent process imports the app, loads every registry
+component and the position table once, freezes the garbage collector and
+only then forks the workers, which keep serving from the parent's pages
+copy-on-write. gc.freeze() moves everything loaded so far out of the
+collector's reach, so collections in the workers do not touch, and copy,
+those pages.
+
+Workers start with every component ready, so `/ready` is 200 from their first
+request; the parent replaces workers that die. With `--no-preload` the
+workers are still forked but load their components themselves, as under
+uvicorn, which gives the baseline for the memory comparison in
+benchmarks/bench_memory.py. POSIX only. With more than one worker, set
+PROMETHEUS_MULTIPROC_DIR as for uvicorn.
+
+    python -m src.serve [--host 0.0.0.0] [--port 8000] [--workers 4] [--no-preload]
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+
+from src.config import get_agent_settings
+from src.logs import configure_logging
+
+logger = logging.getLogger(__name__)
+
+RESPAWN_DELAY = 1.0
+
+
+def preload():
+    """Load every registry component and the position table in this process."""
+    from src.book import get_position_table
+    from src.registry import get_registry
+
+    registry = get_registry()
+    for name in registry.components:
+        try:
+            registry.get(name)
+        except Exception:
+            # Already logged and recorded; each worker retries it on first use.
+            pass
+    get_position_table()
+
+
+def bind(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class PreforkServer:
+    def __init__(self, app, sock: socket.socket, workers: int, log_level: str = "info"):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.log_level = log_level
+        self.children: set[int] = set()
+        self.should_exit = False
+
+    def serve(self):
+        config = uvicorn.Config(self.app, log_level=self.log_level, lifespan="on")
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                self.serve()
+            except BaseException:
+                logger.exception("Worker crashed")
+                code = 1
+            finally:
+                os._exit(code)
+        self.children.add(pid)
+        logger.info("Started worker %d", pid, extra={"pid": pid})
+
+    def shutdown(self, signum, frame):
+        self.should_exit = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.shutdown)
+        signal.signal(signal.SIGTERM, self.shutdown)
+        for _ in range(self.workers):
+            self.spawn()
+
+        while self.children:
+            pid, status = os.wait()
+            self.children.discard(pid)
+            if self.should_exit:
+                continue
+            logger.warning("Worker %d exited with status %d, replacing it", pid, status, extra={"pid": pid})
+            time.sleep(RESPAWN_DELAY)
+            self.spawn()
+
+
+def main():
+    settings = get_agent_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.serve_workers)
+    parser.add_argument("--no-preload", dest="preload", action="store_false", default=settings.serve_preload,
+                        help="Fork the workers before loading the components")
+    args = parser.parse_args()
+    configure_logging()
+
+    from src.app import app
+
+    if args.preload:
+        start = time.perf_counter()
+        preload()
+        logger.info("Preloaded components in %.2fs", time.perf_counter() - start)
+    # Objects created so far are shared with the workers; keep the collector off their pages.
+    gc.collect()
+    gc.freeze()
+
+    sock = bind(args.host, args.port)
+    logger.info("Serving on %s:%d with %d workers", args.host, args.port, args.workers)
+    PreforkServer(app, sock, args.workers, log_level=settings.log_level.lower()).run()
+
+
+if __name__ == "__main__":
+    main()
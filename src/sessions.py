@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from functools import cache
+
+from llama_index.core.llms import ChatMessage
+from llama_index.core.memory import ChatMemoryBuffer
+
+from src.cache import SqliteCache
+from src.config import get_agent_settings
+
+
+def new_memory(chat_history: list[ChatMessage] | None = None) -> ChatMemoryBuffer:
+    return ChatMemoryBuffer.from_defaults(
+        chat_history=chat_history,
+        token_limit=get_agent_settings().session_token_limit,
+    )
+
+
+class SessionStore:
+    """
+    Chat memories keyed by session id. Memories are trimmed to their token
+    limit when saved, so a long conversation never grows past that window.
+    """
+
+    def load(self, session_id: str) -> ChatMemoryBuffer:
+        raise NotImplementedError
+
+    def save(self, session_id: str, memory: ChatMemoryBuffer):
+        raise NotImplementedError
+
+    async def aload(self, session_id: str) -> ChatMemoryBuffer:
+        # Persistent stores may block on I/O; keep it off the event loop.
+        return await asyncio.to_thread(self.load, session_id)
+
+    async def asave(self, session_id: str, memory: ChatMemoryBuffer):
+        await asyncio.to_thread(self.save, session_id, memory)
+
+    @staticmethod
+    def trim(memory: ChatMemoryBuffer) -> list[ChatMessage]:
+        messages = memory.get()
+        memory.set(messages)
+        return messages
+
+
+class InMemorySessionStore(SessionStore):
+    def __init__(self, max_sessions: int, ttl: int):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: OrderedDict[str, tuple[float, ChatMemoryBuffer]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float):
+        while self._sessions:
+            last_used, _ = next(iter(self._sessions.values()))
+            if len(self._sessions) <= self.max_sessions and now - last_used <= self.ttl:
+                break
+            self._sessions.popitem(last=False)
+
+    def load(self, session_id: str) -> ChatMemoryBuffer:
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is None or now - entry[0] > self.ttl:
+                memory = new_memory()
+            else:
+                memory = entry[1]
+            self._sessions[session_id] = (now, memory)
+            self._evict(now)
+            return memory
+
+    def save(self, session_id: str, memory: ChatMemoryBuffer):
+        self.trim(memory)
+        with self._lock:
+            self._sessions[session_id] = (time.time(), memory)
+            self._sessions.move_to_end(session_id)
+
+    async def aload(self, session_id: str) -> ChatMemoryBuffer:
+        return self.load(session_id)
+
+    async def asave(self, session_id: str, memory: ChatMemoryBuffer):
+        self.save(session_id, memory)
+
+
+class SessionCache(SqliteCache):
+    table = "sessions"
+
+
+class SqliteSessionStore(SessionStore):
+    """Sessions persisted to a SQLite file, so any worker can continue a conversation."""
+
+    def __init__(self, path: str, max_sessions: int, ttl: int):
+        # No in-process layer: another worker may have moved the session forward.
+        self._cache = SessionCache(path=path, max_entries=max_sessions, ttl=ttl, memory_mb=0)
+
+    def load(self, session_id: str) -> ChatMemoryBuffer:
+        data = self._cache.get(session_id)
+        if data is None:
+            return new_memory()
+        return new_memory([ChatMessage.model_validate(message) for message in data["messages"]])
+
+    def save(self, session_id: str, memory: ChatMemoryBuffer):
+        messages = self.trim(memory)
+        self._cache.set(session_id, {"messages": [message.model_dump(mode="json") for message in messages]})
+
+
+@cache
+def get_session_store() -> SessionStore:
+    settings = get_agent_settings()
+    if settings.session_backend == "memory":
+        return InMemorySessionStore(settings.session_max, settings.session_ttl)
+    if settings.session_backend == "sqlite":
+        return SqliteSessionStore(settings.session_store_path, settings.session_max, settings.session_ttl)
+    raise ValueError(f"Unknown session backend: {settings.session_backend}")
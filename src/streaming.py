@@ -0,0 +1,57 @@
+import json
+from typing import AsyncIterator, Awaitable, Callable
+
+from fastapi.responses import StreamingResponse
+from llama_index.core.chat_engine.types import StreamingAgentChatResponse
+
+from src.models import ApiResponse
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def agent_tokens(
+    start_stream: Callable[[], Awaitable[StreamingAgentChatResponse]],
+) -> AsyncIterator[str]:
+    response = await start_stream()
+    async for token in response.async_response_gen():
+        yield token
+    # The agent finishes writing the answer into its memory in a background task.
+    history_task = getattr(response, "awrite_response_to_history_task", None)
+    if history_task is not None:
+        await history_task
+
+
+async def stream_agent_events(
+    tokens: AsyncIterator[str],
+    message: str,
+    data: dict | None = None,
+) -> AsyncIterator[str]:
+    """
+    Server-Sent Events for an agent call: the structured `data` goes out first,
+    then every token of the answer as it is generated, and finally the full
+    ApiResponse as the `done` event.
+    """
+    if data is not None:
+        yield sse_event("data", data)
+
+    answer = []
+    try:
+        async for token in tokens:
+            answer.append(token)
+            yield sse_event("token", token)
+    except Exception as e:
+        yield sse_event("error", {"detail": str(e)})
+        return
+
+    final = ApiResponse(message=message, agent_response="".join(answer), data=data)
+    yield sse_event("done", final.model_dump())
+
+
+def event_stream_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,162 @@
+"""
+How much of an analysis the tools hand the agent, set by TOOL_VERBOSITY:
+
+- full (default): the analyses exactly as the tools have always returned them;
+- compact: pieces referenced by square, and only what a move changed;
+- minimal: compact without the piece placement, attacks and pawn structure.
+
+compact and minimal change every agent prompt, and the cached responses
+built from them, so they are opt-in.
+"""
+import functools
+import inspect
+import logging
+from typing import Callable
+
+from llama_index.core.tools import FunctionTool
+from llama_index.core.utils import get_tokenizer
+
+from src.config import get_agent_settings
+from src.metrics import TOOL_OUTPUT_TOKENS
+
+logger = logging.getLogger(__name__)
+
+VERBOSITY_LEVELS = ("full", "compact", "minimal")
+
+
+def get_verbosity() -> str:
+    verbosity = get_agent_settings().tool_verbosity
+    if verbosity not in VERBOSITY_LEVELS:
+        raise ValueError(f"Unknown tool verbosity: {verbosity}")
+    return verbosity
+
+
+def compact_board(analysis: dict) -> dict:
+    """
+    The board analysis with pieces referenced by square: one square -> piece
+    table plus the squares each piece attacks. `attacked_by` is dropped since
+    it is the inverse of `attacks`.
+    """
+    return {
+        "turn": analysis["turn"],
+        "centipawn_score": analysis["centipawn_score"],
+        "win_chance": analysis["win_chance"],
+        "pieces": {piece["position"]: piece["piece"] for piece in analysis["pieces_info"]},
+        "attacks": {
+            piece["position"]: [target["position"] for target in piece["attacking"]]
+            for piece in analysis["pieces_info"]
+            if piece["attacking"]
+        },
+        "checkers": [piece["position"] for piece in analysis["checkers"]],
+        "material": {
+            color: {**{symbol: piece["count"] for symbol, piece in material["pieces"].items()}, "total": material["total"]}
+            for color, material in analysis["material"].items()
+        },
+        "pawn_structure": analysis["pawn_structure"],
+        "hanging": [piece["position"] for piece in analysis["hanging"]],
+        "pinned": [piece["position"] for piece in analysis["pinned"]],
+        "mobility": analysis["mobility"],
+        "pawn_features": analysis["pawn_features"],
+    }
+
+
+def minimal_board(analysis: dict) -> dict:
+    board = compact_board(analysis)
+    for field in ("pieces", "attacks", "pawn_structure"):
+        board.pop(field)
+    return board
+
+
+def format_board(analysis: dict, verbosity: str | None = None) -> dict:
+    verbosity = verbosity or get_verbosity()
+    if verbosity == "compact":
+        return compact_board(analysis)
+    if verbosity == "minimal":
+        return minimal_board(analysis)
+    return analysis
+
+
+def _dict_diff(before: dict, after: dict) -> dict:
+    return {
+        "removed": {key: value for key, value in before.items() if after.get(key) != value},
+        "added": {key: value for key, value in after.items() if before.get(key) != value},
+    }
+
+
+def _list_diff(before: list, after: list) -> dict:
+    return {
+        "removed": [item for item in before if item not in after],
+        "added": [item for item in after if item not in before],
+    }
+
+
+def compact_move(comparison: dict, verbosity: str = "compact") -> dict:
+    """Only what the move changed, instead of both full board analyses."""
+    before = compact_board(comparison["prev_analysis"])
+    after = compact_board(comparison["new_analysis"])
+    diff = {
+        "centipawn_score_diff": comparison["centipawn_score_diff"],
+        "win_chance_diff": comparison["win_chance_diff"],
+        "material_diff": comparison["material_diff"],
+        "centipawn_score": after["centipawn_score"],
+        "win_chance": after["win_chance"],
+        "checkers": after["checkers"],
+        "hanging": _list_diff(before["hanging"], after["hanging"]),
+        "pinned": _list_diff(before["pinned"], after["pinned"]),
+        "mobility_diff": {
+            color: after["mobility"][color] - before["mobility"][color] for color in after["mobility"]
+        },
+    }
+    if verbosity == "compact":
+        diff["pieces"] = _dict_diff(before["pieces"], after["pieces"])
+        diff["attacks"] = _dict_diff(before["attacks"], after["attacks"])
+    return diff
+
+
+def format_move(comparison: dict, verbosity: str | None = None) -> dict:
+    verbosity = verbosity or get_verbosity()
+    if verbosity == "full":
+        return comparison
+    return compact_move(comparison, verbosity)
+
+
+def count_tokens(output) -> int:
+    # FunctionTool hands str(output) to the agent, so that is what gets counted.
+    return len(get_tokenizer()(str(output)))
+
+
+def report_tokens(fn: Callable, tool: str) -> Callable:
+    """Log and record how many prompt tokens each call of `tool` adds to the agent scratchpad."""
+
+    def report(output):
+        tokens = count_tokens(output)
+        verbosity = get_verbosity()
+        TOOL_OUTPUT_TOKENS.labels(tool, verbosity).observe(tokens)
+        logger.debug("Tool output", extra={"tool": tool, "tokens": tokens, "verbosity": verbosity})
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            output = await fn(*args, **kwargs)
+            report(output)
+            return output
+
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        output = fn(*args, **kwargs)
+        report(output)
+        return output
+
+    return wrapper
+
+
+def reporting_tool(fn: Callable, async_fn: Callable, **kwargs) -> FunctionTool:
+    """FunctionTool.from_defaults, with both variants reporting their output tokens under the tool name."""
+    metadata = FunctionTool.from_defaults(fn=fn, async_fn=async_fn, **kwargs).metadata
+    return FunctionTool(
+        fn=report_tokens(fn, metadata.name),
+        metadata=metadata,
+        async_fn=report_tokens(async_fn, metadata.name),
+    )
@@ -1,34 +1,228 @@
-import requests
+import asyncio
+import contextvars
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.llms import LLM
 from llama_index.core.tools import FunctionTool
-from functools import cache
 import chess
 
+from src.board_analysis import board_features
+from src.book import lookup_position
+from src.cache import get_evaluation_cache, position_key
+from src.concurrency import AsyncSingleFlight, SingleFlight
+from src.config import get_agent_settings
+from src.engines import get_evaluation_backend
+from src.metrics import count_evaluation, get_callback_manager, timed
+from src.tool_output import format_board, format_move, reporting_tool
 from src.rags import ChessExpertRAG
-from src.prompts import chess_guide_qa_tpl, chess_expert_description
-from llama_index.core.tools import QueryEngineTool, FunctionTool, ToolMetadata
+from src.retrieval import HybridRetriever, PassageSearch
+from src.prompts import chess_guide_qa_tpl, chess_expert_description, chess_expert_passages_description
+from llama_index.core.tools import BaseTool, QueryEngineTool, FunctionTool, ToolMetadata
+
+logger = logging.getLogger(__name__)
+
+evaluation_flight = SingleFlight()
+async_evaluation_flight = AsyncSingleFlight()
+
+
+def lookup_analysis(fen: str) -> dict | None:
+    """The position table, then the evaluation cache; None when the engine has to be asked."""
+    analysis = lookup_position(fen)
+    if analysis is not None:
+        count_evaluation("position_table")
+        return analysis
+
+    analysis = get_evaluation_cache().get(fen)
+    if analysis is not None:
+        count_evaluation("cache")
+    return analysis
+
+
+async def alookup_analysis(fen: str) -> dict | None:
+    """lookup_analysis in a worker thread: both the memory-mapped table and SQLite can block."""
+    return await asyncio.to_thread(lookup_analysis, fen)
+
 
-@cache
 def get_stockfish_analysis(fen: str) -> dict:
-    print(f"Getting Stockfish analysis for FEN: {fen}")
-    response = requests.post("https://chess-api.com/v1", {"fen": fen})
-    return response.json()
+    analysis = lookup_analysis(fen)
+    if analysis is not None:
+        return analysis
+    return evaluate_analysis(fen)
 
 
-from src.config import get_agent_settings
+def evaluate_analysis(fen: str) -> dict:
+    """Ask the engine for a position lookup_analysis missed, and cache the result."""
+    evaluation_cache = get_evaluation_cache()
+
+    def evaluate() -> dict:
+        logger.debug("Getting Stockfish analysis", extra={"fen": fen})
+        count_evaluation("engine")
+        with timed("engine"):
+            analysis = get_evaluation_backend().analyse(fen)
+        if "move" in analysis:
+            evaluation_cache.set(fen, analysis)
+        return analysis
+
+    # Threads asking for the same position at once share one engine call.
+    return evaluation_flight.do(position_key(fen), evaluate)
+
+
+def get_stockfish_analyses(fens: list[str], max_concurrency: int | None = None) -> Iterator[dict]:
+    """
+    Evaluate a batch of positions concurrently and yield the results in input order.
+    Cached positions and positions repeated within the batch are evaluated only once.
+    """
+    if max_concurrency is None:
+        max_concurrency = get_agent_settings().evaluation_max_concurrency
+
+    keys = [position_key(fen) for fen in fens]
+    results: dict[str, dict | Future] = {}
+    missing = {}
+    for key, fen in zip(keys, fens):
+        if key in results or key in missing:
+            continue
+        analysis = lookup_analysis(fen)
+        if analysis is not None:
+            results[key] = analysis
+        else:
+            missing[key] = fen
+
+    if not missing:
+        for key in keys:
+            yield results[key]
+        return
+
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(missing))) as executor:
+        for key, fen in missing.items():
+            # Each worker runs in a copy of the caller's context, so its metrics keep the endpoint label.
+            # Already looked up above; going through get_stockfish_analysis would count each miss twice.
+            results[key] = executor.submit(contextvars.copy_context().run, evaluate_analysis, fen)
+        for key in keys:
+            result = results[key]
+            yield result.result() if isinstance(result, Future) else result
+
+
+async def aget_stockfish_analysis(fen: str) -> dict:
+    analysis = await alookup_analysis(fen)
+    if analysis is not None:
+        return analysis
+
+    evaluation_cache = get_evaluation_cache()
+
+    async def evaluate() -> dict:
+        logger.debug("Getting Stockfish analysis", extra={"fen": fen})
+        count_evaluation("engine")
+        with timed("engine"):
+            analysis = await get_evaluation_backend().aanalyse(fen)
+        if "move" in analysis:
+            await evaluation_cache.aset(fen, analysis)
+        return analysis
+
+    return await async_evaluation_flight.do(position_key(fen), evaluate)
+
+
+async def aget_stockfish_analyses(fens: list[str], max_concurrency: int | None = None) -> list[dict]:
+    """Async counterpart of get_stockfish_analyses, returning the results in input order."""
+    if max_concurrency is None:
+        max_concurrency = get_agent_settings().evaluation_max_concurrency
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    keys = [position_key(fen) for fen in fens]
+    unique = dict(zip(keys, fens))
+
+    async def evaluate(fen: str) -> dict:
+        async with semaphore:
+            return await aget_stockfish_analysis(fen)
+
+    results = await asyncio.gather(*(evaluate(fen) for fen in unique.values()))
+    by_key = dict(zip(unique, results))
+    return [by_key[key] for key in keys]
+
 
 SETTINGS = get_agent_settings()
 
 
-chess_expert_tool = QueryEngineTool(
-    query_engine=ChessExpertRAG(
+def create_chess_expert_tool(llm: LLM, embed_model: BaseEmbedding) -> BaseTool:
+    """Loads (or ingests) the RAG index, so it is built by the component registry rather than at import."""
+    rag = ChessExpertRAG(
         store_path=SETTINGS.store_path,
         data_dir=SETTINGS.docs_path,
         qa_prompt_tpl=chess_guide_qa_tpl,
-    ).get_query_engine(),
-    metadata=ToolMetadata(
-        name="chess_expert", description=chess_expert_description, return_direct=False
-    ),
-)
+        mmap_store_path=SETTINGS.mmap_store_path if SETTINGS.vector_store_format == "mmap" else None,
+        similarity_top_k=SETTINGS.similarity_top_k,
+        embed_model=embed_model,
+    )
+    if SETTINGS.chess_expert_mode == "retrieve":
+        return create_passage_tool(rag)
+    if SETTINGS.chess_expert_mode != "synthesize":
+        raise ValueError(f"Unknown chess_expert mode: {SETTINGS.chess_expert_mode}")
+
+    return QueryEngineTool(
+        query_engine=rag.get_query_engine(llm),
+        metadata=ToolMetadata(
+            name="chess_expert", description=chess_expert_description, return_direct=False
+        ),
+    )
+
+
+def create_passage_tool(rag: ChessExpertRAG) -> FunctionTool:
+    """
+    chess_expert as a plain retrieval: the agent gets the passages themselves
+    instead of an answer synthesized by a second LLM call.
+    """
+    # Extra candidates leave room for the passages deduplication drops; only
+    # the outermost retriever reports to the metrics callbacks.
+    if SETTINGS.chess_expert_hybrid:
+        retriever = HybridRetriever(
+            rag.get_retriever(SETTINGS.chess_expert_candidates, callback_manager=CallbackManager()),
+            rag.get_nodes(),
+            similarity_top_k=SETTINGS.chess_expert_candidates,
+            bm25_weight=SETTINGS.chess_expert_bm25_weight,
+            callback_manager=get_callback_manager(),
+        )
+    else:
+        retriever = rag.get_retriever(SETTINGS.chess_expert_candidates, callback_manager=get_callback_manager())
+
+    search = PassageSearch(
+        retriever,
+        top_k=SETTINGS.similarity_top_k,
+        max_chars=SETTINGS.chess_expert_passage_chars,
+        cache_size=SETTINGS.chess_expert_cache_size,
+    )
+
+    def chess_expert(query: str) -> list[dict]:
+        """
+        Search the chess books for the passages that answer a question.
+        Args:
+            - query (str): The question, in plain text.
+        Returns:
+            - list[dict]: The passages, with their text, score and source.
+        """
+        logger.info("Searching chess books", extra={"query": query})
+        return search.search(query)
+
+    async def achess_expert(query: str) -> list[dict]:
+        """
+        Search the chess books for the passages that answer a question.
+        Args:
+            - query (str): The question, in plain text.
+        Returns:
+            - list[dict]: The passages, with their text, score and source.
+        """
+        logger.info("Searching chess books", extra={"query": query})
+        return await search.asearch(query)
+
+    return reporting_tool(
+        fn=chess_expert,
+        async_fn=achess_expert,
+        name="chess_expert",
+        description=chess_expert_passages_description,
+        return_direct=False,
+    )
 
 
 def get_best_move(fen: str) -> dict:
@@ -39,8 +233,23 @@ def get_best_move(fen: str) -> dict:
     Returns:
         - dict: The best move to make and addtional information.
     """
-    print(f"Getting best move for FEN: {fen}")
+    logger.info("Getting best move", extra={"fen": fen})
+    return describe_best_move(get_stockfish_analysis(fen))
 
+
+async def aget_best_move(fen: str) -> dict:
+    """
+    Get the best move based on the current board state.
+    Args:
+        - fen (str): FEN notation of the current board state.
+    Returns:
+        - dict: The best move to make and addtional information.
+    """
+    logger.info("Getting best move", extra={"fen": fen})
+    return describe_best_move(await aget_stockfish_analysis(fen))
+
+
+def describe_best_move(analysis: dict) -> dict:
     piece_types = {
         "p": "pawn",
         "n": "knight",
@@ -60,8 +269,6 @@ def get_best_move(fen: str) -> dict:
         "q": "queenside castling"
     }
 
-    analysis = get_stockfish_analysis(fen)
-
     text = analysis.get("text")
     move = analysis.get("move")
 
@@ -87,16 +294,6 @@ def get_best_move(fen: str) -> dict:
     }
 
 
-def get_piece_info(board: chess.Board, square: chess.Square) -> dict:
-    piece = board.piece_at(square)
-    return {
-        "square": square,
-        "position": chess.square_name(square),
-        "piece": piece.symbol(),
-        "color": "white" if piece.color else "black",
-    }
-
-
 def analize_board(fen: str) -> dict:
     """
     Analize the current board state to provide valuable insights.
@@ -112,77 +309,48 @@ def analize_board(fen: str) -> dict:
         - material (dict): The material count for both sides.
         - pieces_info (list[dict]): The information of each piece on the board.
         - pawn_structure (dict): The pawn structure for both sides.
+        - hanging (list[dict]): The attacked pieces that nothing defends.
+        - pinned (list[dict]): The pieces pinned to their king.
+        - mobility (dict): The squares reachable by the pieces of each side.
+        - pawn_features (dict): The passed, isolated and doubled pawns for both sides.
     """
-    print(f"Analizing position for FEN: {fen}")
-
-    analysis = get_stockfish_analysis(fen)
-    centipawn_score = analysis["centipawns"]
-    win_chance = analysis["winChance"]
-
-    board = chess.Board(fen)
-    pieces = board.piece_map()
-
-    piece_values = {
-        "p": 1,
-        "n": 3,
-        "b": 3,
-        "r": 5,
-        "q": 9,
-    }
-
-    material = {
-        "white": {"pieces":{}},
-        "black": {"pieces":{}}
-    }
-
-    for square, piece in pieces.items():
-        color = "white" if piece.color else "black"
-        symbol = piece.symbol()
-        if symbol in ["K", "k"]:
-            continue
-        if symbol in material[color]["pieces"]:
-            material[color]["pieces"][symbol]["count"] += 1
-        else:
-            piece_info = {
-                "value": piece_values[symbol.lower()],
-                "count": 1,
-            }
-
-            material[color]["pieces"][symbol] = piece_info
-
-    for color in material:
-        material[color]["total"] = sum(
-            [piece["value"] * piece["count"] for piece in material[color]["pieces"].values()])
-
-    checkers = board.checkers()
+    logger.info("Analizing position", extra={"fen": fen})
+    return format_board(describe_board(fen, get_stockfish_analysis(fen)))
 
-    attackers = {square: [] for square in chess.SQUARES}
-    attacked = {square: [] for square in chess.SQUARES}
 
-    for square in pieces:
-        attacks = board.attackers(not pieces[square].color, square)
-        for attacker in attacks:
-            attacked[attacker].append(square)
-            attackers[square].append(attacker)
-
-    pawn_structure = {
-        "white": [chess.square_file(pawn) for pawn in board.pieces(chess.PAWN, chess.WHITE)],
-        "black": [chess.square_file(pawn) for pawn in board.pieces(chess.PAWN, chess.BLACK)],
-    }
+async def aanalize_board(fen: str) -> dict:
+    """
+    Analize the current board state to provide valuable insights.
+    Args:
+        - fen (str): FEN notation of the current board state.
+    Returns:
+        - dict: The analysis of the board state.
+    Fields:
+        - turn (str): The color of the player to move.
+        - centipawn_score (int): The centipawn score of the position.
+        - win_chance (float): The win chance of the position (<50 black & >50 white).
+        - checkers (list[dict]): The pieces that are delivering check.
+        - material (dict): The material count for both sides.
+        - pieces_info (list[dict]): The information of each piece on the board.
+        - pawn_structure (dict): The pawn structure for both sides.
+        - hanging (list[dict]): The attacked pieces that nothing defends.
+        - pinned (list[dict]): The pieces pinned to their king.
+        - mobility (dict): The squares reachable by the pieces of each side.
+        - pawn_features (dict): The passed, isolated and doubled pawns for both sides.
+    """
+    logger.info("Analizing position", extra={"fen": fen})
+    return format_board(describe_board(fen, await aget_stockfish_analysis(fen)))
 
-    pieces_info = [get_piece_info(board, square) for square in pieces.keys()]
-    for pi in pieces_info:
-        pi["attacked_by"] = [get_piece_info(board, square) for square in attackers[pi["square"]]]
-        pi["attacking"] = [get_piece_info(board, square) for square in attacked[pi["square"]]]
 
+def describe_board(fen: str, analysis: dict) -> dict:
+    board = chess.Board(fen)
+    with timed("board_analysis"):
+        features = board_features(board)
     return {
         "turn": "white" if board.turn else "black",
-        "centipawn_score": centipawn_score,
-        "win_chance": win_chance,
-        "checkers": [get_piece_info(board, square) for square in checkers],
-        "material": material,
-        "pieces_info": pieces_info,
-        "pawn_structure": pawn_structure,
+        "centipawn_score": analysis["centipawns"],
+        "win_chance": analysis["winChance"],
+        **features,
     }
 
 
@@ -195,14 +363,35 @@ def analize_move(fen: str, move: str) -> dict:
     Returns:
         - dict: The analysis of the move made.
     """
-    print(f"Analizing move {move} from FEN: {fen}")
+    logger.info("Analizing move", extra={"fen": fen, "move": move})
+    new_fen = play_move(fen, move)
+    prev_analysis = describe_board(fen, get_stockfish_analysis(fen))
+    new_analysis = describe_board(new_fen, get_stockfish_analysis(new_fen))
+    return format_move(compare_boards(prev_analysis, new_analysis))
+
+
+async def aanalize_move(fen: str, move: str) -> dict:
+    """
+    Analize the move made in the current board state.
+    Args:
+        - fen (str): FEN notation of the current board state.
+        - move (str): The move made.
+    Returns:
+        - dict: The analysis of the move made.
+    """
+    logger.info("Analizing move", extra={"fen": fen, "move": move})
+    new_fen = play_move(fen, move)
+    prev_eval, new_eval = await aget_stockfish_analyses([fen, new_fen])
+    return format_move(compare_boards(describe_board(fen, prev_eval), describe_board(new_fen, new_eval)))
+
 
-    prev_analysis = analize_board(fen)
+def play_move(fen: str, move: str) -> str:
     board = chess.Board(fen)
     board.push_san(move)
-    new_fen = board.fen()
-    new_analysis = analize_board(new_fen)
+    return board.fen()
 
+
+def compare_boards(prev_analysis: dict, new_analysis: dict) -> dict:
     centipawn_score_diff = new_analysis["centipawn_score"] - prev_analysis["centipawn_score"]
     win_chance_diff = new_analysis["win_chance"] - prev_analysis["win_chance"]
 
@@ -228,14 +417,42 @@ def analyze_player(player: int, moves: list[str]) -> list[dict]:
     Returns:
         - list[dict]: The winning state for each movement.
     """
-    print(f"Analizing player movements: {moves}")
+    logger.info("Analizing player movements", extra={"player": player, "moves": moves})
+    player_moves, fens = player_positions(player, moves)
+    return describe_player_moves(player, player_moves, get_stockfish_analyses(fens))
+
+
+async def aanalyze_player(player: int, moves: list[str]) -> list[dict]:
+    """
+    Simulate the game to provide insights on the game state for each movement.
+    Args:
+        - player (int): The player to analyze (0: black, 1: white).
+        - moves (list[str]): The list of moves made in algebraic notation.
+    Returns:
+        - list[dict]: The winning state for each movement.
+    """
+    logger.info("Analizing player movements", extra={"player": player, "moves": moves})
+    player_moves, fens = player_positions(player, moves)
+    return describe_player_moves(player, player_moves, await aget_stockfish_analyses(fens))
+
+
+def player_positions(player: int, moves: list[str]) -> tuple[list[str], list[str]]:
+    """Replay the game and collect the positions reached after each move of the player."""
     game = chess.Board()
-    analysis_res = []
+    player_moves = []
+    fens = []
     for move in moves:
         game.push_san(move)
         if game.turn == player:
             continue
-        analysis = get_stockfish_analysis(game.fen())
+        player_moves.append(move)
+        fens.append(game.fen())
+    return player_moves, fens
+
+
+def describe_player_moves(player: int, moves: list[str], analyses) -> list[dict]:
+    analysis_res = []
+    for move, analysis in zip(moves, analyses):
         centipawn_score = analysis["centipawns"]
         win_chance = analysis["winChance"]
         if player == 0:
@@ -247,13 +464,9 @@ def analyze_player(player: int, moves: list[str]) -> list[dict]:
             "state": "winning" if win_chance > 75 else "lossing" if win_chance < 25 else "even",
         })
 
-    return analysis
+    return analysis_res
 
-best_move_tool = FunctionTool.from_defaults(
-    fn=get_best_move, return_direct=False)
-analize_board_tool = FunctionTool.from_defaults(
-    fn=analize_board, return_direct=False)
-analize_move_tool = FunctionTool.from_defaults(
-    fn=analize_move, return_direct=False)
-analize_player_tool = FunctionTool.from_defaults(
-    fn=analyze_player, return_direct=False)
\ No newline at end of file
+best_move_tool = reporting_tool(fn=get_best_move, async_fn=aget_best_move, return_direct=False)
+analize_board_tool = reporting_tool(fn=analize_board, async_fn=aanalize_board, return_direct=False)
+analize_move_tool = reporting_tool(fn=analize_move, async_fn=aanalize_move, return_direct=False)
+analize_player_tool = reporting_tool(fn=analyze_player, async_fn=aanalyze_player, return_direct=False)
\ No newline at end of file
@@ -0,0 +1,192 @@
+"""
+Binary, memory-mapped storage for the chess expert index.
+
+Embeddings live in one contiguous float32 (or int8 with a per-row scale)
+matrix loaded with np.load(mmap_mode="r"), so every worker process shares
+the same page-cache copy. Node text and metadata live in a JSON Lines
+sidecar that is read on demand through an offsets table.
+
+Convert the persisted SimpleVectorStore with:
+
+    python -m src.vector_store chess_expert_store chess_expert_mmap [--quantize]
+"""
+import argparse
+import json
+import mmap
+import os
+from typing import Callable
+
+import numpy as np
+from llama_index.core import QueryBundle, Settings
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import MetadataMode, NodeWithScore, TextNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.vector_stores import SimpleVectorStore
+
+EMBEDDINGS_FILE = "embeddings.npy"
+SCALES_FILE = "scales.npy"
+OFFSETS_FILE = "offsets.npy"
+NODES_FILE = "nodes.jsonl"
+META_FILE = "meta.json"
+
+
+class MmapVectorStore:
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+
+        self.embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+        self.scales = (
+            np.load(os.path.join(path, SCALES_FILE), mmap_mode="r")
+            if self.meta["quantized"] else None
+        )
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+
+        with open(os.path.join(path, NODES_FILE), "rb") as f:
+            self._nodes = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return self.embeddings.shape[0]
+
+    def get_node(self, i: int) -> TextNode:
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return TextNode(**json.loads(self._nodes[start:end]))
+
+    def query(self, embedding: list[float], top_k: int) -> list[tuple[int, float]]:
+        """Cosine top-k: rows are stored normalized, so one matrix-vector product scores every node."""
+        query = np.array(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+
+        scores = self.embeddings @ query
+        if self.scales is not None:
+            scores *= self.scales
+
+        top_k = min(top_k, len(scores))
+        if top_k == 0:
+            return []
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(i), float(scores[i])) for i in best]
+
+    @classmethod
+    def write(cls, path: str, nodes: list[TextNode], embeddings: np.ndarray, quantize: bool = False):
+        os.makedirs(path, exist_ok=True)
+
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.where(norms == 0, 1.0, norms)
+
+        if quantize:
+            scales = np.abs(embeddings).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            np.save(os.path.join(path, EMBEDDINGS_FILE), np.round(embeddings / scales[:, None]).astype(np.int8))
+            np.save(os.path.join(path, SCALES_FILE), scales.astype(np.float32))
+        else:
+            np.save(os.path.join(path, EMBEDDINGS_FILE), np.ascontiguousarray(embeddings))
+
+        offsets = [0]
+        with open(os.path.join(path, NODES_FILE), "wb") as f:
+            for node in nodes:
+                record = {
+                    "id_": node.node_id,
+                    "text": node.get_content(metadata_mode=MetadataMode.NONE),
+                    "metadata": node.metadata,
+                    "excluded_embed_metadata_keys": node.excluded_embed_metadata_keys,
+                    "excluded_llm_metadata_keys": node.excluded_llm_metadata_keys,
+                }
+                f.write(json.dumps(record, ensure_ascii=False).encode() + b"\n")
+                offsets.append(f.tell())
+        np.save(os.path.join(path, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+
+        with open(os.path.join(path, META_FILE), "w") as f:
+            json.dump({"quantized": quantize, "dim": int(embeddings.shape[1]), "count": len(nodes)}, f)
+
+
+class MmapRetriever(BaseRetriever):
+    def __init__(
+        self,
+        vector_store: MmapVectorStore,
+        embed_model: BaseEmbedding | None = None,
+        similarity_top_k: int = 2,
+        callback_manager: CallbackManager | None = None,
+    ):
+        self.vector_store = vector_store
+        self.embed_model = embed_model
+        self.similarity_top_k = similarity_top_k
+        super().__init__(callback_manager=callback_manager)
+
+    def _get_embed_model(self) -> BaseEmbedding:
+        # Resolved per query so the globally configured model is picked up even
+        # when it is set after this retriever is built.
+        return self.embed_model or Settings.embed_model
+
+    def _to_nodes(self, embedding: list[float]) -> list[NodeWithScore]:
+        return [
+            NodeWithScore(node=self.vector_store.get_node(i), score=score)
+            for i, score in self.vector_store.query(embedding, self.similarity_top_k)
+        ]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        embedding = query_bundle.embedding or self._get_embed_model().get_query_embedding(query_bundle.query_str)
+        return self._to_nodes(embedding)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        embedding = query_bundle.embedding or await self._get_embed_model().aget_query_embedding(query_bundle.query_str)
+        return self._to_nodes(embedding)
+
+
+def convert_simple_store(
+    persist_dir: str,
+    out_dir: str,
+    quantize: bool = False,
+    get_embed_model: Callable[[], BaseEmbedding] | None = None,
+) -> int:
+    """
+    Convert a persisted SimpleVectorStore index into an MmapVectorStore.
+    Nodes without a stored embedding are embedded with the model returned by
+    `get_embed_model`, which is only loaded when needed.
+    """
+    docstore = SimpleDocumentStore.from_persist_dir(persist_dir)
+    vector_path = os.path.join(persist_dir, "default__vector_store.json")
+    embedding_dict = (
+        SimpleVectorStore.from_persist_path(vector_path).data.embedding_dict
+        if os.path.exists(vector_path) else {}
+    )
+
+    nodes = [node for node in docstore.docs.values() if isinstance(node, TextNode)]
+    missing = [node for node in nodes if node.node_id not in embedding_dict]
+    if missing:
+        if get_embed_model is None:
+            raise ValueError(f"{len(missing)} nodes have no stored embedding and no embedding model was given")
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in missing]
+        for node, embedding in zip(missing, get_embed_model().get_text_embedding_batch(texts, show_progress=True)):
+            embedding_dict[node.node_id] = embedding
+
+    MmapVectorStore.write(out_dir, nodes, np.array([embedding_dict[node.node_id] for node in nodes]), quantize)
+    return len(nodes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("store_path", help="Persisted llama-index storage directory")
+    parser.add_argument("out_path", help="Output directory for the memory-mapped store")
+    parser.add_argument("--quantize", action="store_true", help="Store int8 embeddings with per-row scales")
+    args = parser.parse_args()
+
+    def get_embed_model() -> BaseEmbedding:
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        from src.config import get_agent_settings
+
+        return HuggingFaceEmbedding(model_name=get_agent_settings().hf_embeddings_model)
+
+    from src.versions import current_version
+
+    count = convert_simple_store(current_version(args.store_path), args.out_path, args.quantize, get_embed_model)
+    print(f"Wrote {count} nodes to {args.out_path}")
+
+
+if __name__ == "__main__":
+    main()
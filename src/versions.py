@@ -0,0 +1,43 @@
+"""
+Versioned directories that are replaced atomically.
+
+A versioned directory `path` keeps each version under `path/versions/`, and
+a relative `path/current` symlink points at the complete one. Writers fill a
+new version and swap the link with an atomic rename, so readers that resolve
+`current` once always see a whole version. The previous version is kept for
+readers still loading it. `path` itself stays a plain directory, so copying
+it keeps a working `current`, and files written there before versioning are
+read until the first swap.
+"""
+import glob
+import os
+import shutil
+import time
+
+CURRENT_LINK = "current"
+VERSIONS_DIR = "versions"
+
+
+def current_version(path: str) -> str:
+    """The directory holding the current version at `path`; a directory written before versioning is `path` itself."""
+    current = os.path.join(path, CURRENT_LINK)
+    return os.path.realpath(current) if os.path.exists(current) else path
+
+
+def new_version_path(path: str) -> str:
+    """A fresh directory under `path` for the next version."""
+    return os.path.join(path, VERSIONS_DIR, f"v{time.time_ns()}")
+
+
+def swap_in(new_path: str, path: str):
+    """Point `path/current` at `new_path`, then drop every version older than the one it replaced."""
+    current = os.path.join(path, CURRENT_LINK)
+    previous = os.path.realpath(current) if os.path.islink(current) else None
+    link_path = os.path.join(path, f".{CURRENT_LINK}-{os.getpid()}")
+    os.symlink(os.path.relpath(new_path, path), link_path)
+    os.replace(link_path, current)
+
+    keep = {os.path.realpath(new_path), previous}
+    for version in glob.glob(os.path.join(glob.escape(path), VERSIONS_DIR, "v*")):
+        if os.path.realpath(version) not in keep:
+            shutil.rmtree(version, ignore_errors=True)
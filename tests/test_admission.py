@@ -0,0 +1,67 @@
+import asyncio
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import StreamingResponse
+from starlette.routing import Route
+
+from src.admission import AdmissionController, AdmissionMiddleware
+
+EVENTS = 5
+EVENT_INTERVAL = 0.05
+
+
+async def slow_events(request):
+    await asyncio.sleep(float(request.query_params.get("delay", 0)))
+
+    async def events():
+        for i in range(EVENTS):
+            yield f"event: token\ndata: {i}\n\n"
+            await asyncio.sleep(EVENT_INTERVAL)
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def create_client() -> httpx.AsyncClient:
+    app = Starlette(routes=[Route("/state/stream", slow_events, methods=["POST"])])
+    controller = AdmissionController(limits={"/state": 1}, priorities={"/state": 0})
+    return httpx.AsyncClient(transport=httpx.ASGITransport(AdmissionMiddleware(app, controller)), base_url="http://test")
+
+
+def post(params: dict, timeout_ms: int) -> httpx.Response:
+    async def run() -> httpx.Response:
+        async with create_client() as client:
+            return await client.post("/state/stream", params=params, headers={"X-Request-Timeout-Ms": str(timeout_ms)})
+
+    return asyncio.run(run())
+
+
+def test_client_deadline_does_not_cut_a_started_stream():
+    # The whole stream takes longer than the deadline, but its first byte is on time.
+    response = post({}, timeout_ms=int(EVENTS * EVENT_INTERVAL * 1000 / 2))
+
+    assert response.status_code == 200
+    assert response.text.count("event: token") == EVENTS
+    assert response.text.endswith("event: done\ndata: {}\n\n")
+
+
+def test_client_deadline_before_first_byte_is_504():
+    response = post({"delay": 0.2}, timeout_ms=50)
+
+    assert response.status_code == 504
+    assert response.json() == {"detail": "Deadline exceeded"}
+
+
+def test_invalid_client_deadline_falls_back_to_max_wait():
+    middleware = AdmissionMiddleware(None, AdmissionController(limits={"/state": 1}, priorities={"/state": 0}, max_wait=2.0))
+
+    for value in (b"nan", b"inf", b"-inf", b"0", b"-5", b"soon"):
+        assert middleware.deadline({"headers": [(b"x-request-timeout-ms", value)]}, 10.0) == (12.0, False)
+
+
+def test_client_deadline_is_capped_at_max_wait():
+    middleware = AdmissionMiddleware(None, AdmissionController(limits={"/state": 1}, priorities={"/state": 0}, max_wait=2.0))
+
+    assert middleware.deadline({"headers": [(b"x-request-timeout-ms", b"500")]}, 10.0) == (10.5, True)
+    assert middleware.deadline({"headers": [(b"x-request-timeout-ms", b"1e9")]}, 10.0) == (12.0, True)
@@ -0,0 +1,23 @@
+import os
+
+import chess
+import chess.polyglot
+
+from src.book import ENTRIES_FILE, KEYS_FILE, PositionTable
+from src.versions import current_version
+
+
+def test_write_swaps_in_keys_and_entries_together(tmp_path):
+    path = str(tmp_path / "position_table")
+    board = chess.Board()
+    key = chess.polyglot.zobrist_hash(board)
+
+    PositionTable.write(path, {key: {"move": "e2e4", "centipawns": 30, "mate": None, "depth": 20}})
+    first = current_version(path)
+    PositionTable.write(path, {key: {"move": "d2d4", "centipawns": 25, "mate": None, "depth": 22}})
+    second = current_version(path)
+
+    assert first != second
+    assert sorted(os.listdir(second)) == sorted([ENTRIES_FILE, KEYS_FILE])
+    assert PositionTable(first).lookup(board.fen())["move"] == "e2e4"
+    assert PositionTable(second).lookup(board.fen())["move"] == "d2d4"
@@ -0,0 +1,50 @@
+import sqlite3
+
+from src.cache import SqliteCache
+
+
+def accessed_at(cache: SqliteCache, key: str) -> float:
+    with sqlite3.connect(cache.path) as conn:
+        (value,) = conn.execute(f"SELECT accessed_at FROM {cache.table} WHERE key = ?", (key,)).fetchone()
+    return value
+
+
+def test_memory_hits_refresh_accessed_at(tmp_path, monkeypatch):
+    cache = SqliteCache(str(tmp_path / "cache.sqlite3"))
+    cache.set("hot", {"value": 1})
+    written = accessed_at(cache, "hot")
+
+    monkeypatch.setattr("src.cache.time.time", lambda: written + cache.touch_interval + 1)
+    assert cache.get("hot") == {"value": 1}
+
+    assert cache.memory_hits == 1
+    assert accessed_at(cache, "hot") == written + cache.touch_interval + 1
+
+
+def test_memory_hits_within_the_interval_do_not_write(tmp_path, monkeypatch):
+    cache = SqliteCache(str(tmp_path / "cache.sqlite3"))
+    cache.set("hot", {"value": 1})
+    written = accessed_at(cache, "hot")
+
+    monkeypatch.setattr("src.cache.time.time", lambda: written + 1)
+    cache.get("hot")
+
+    assert accessed_at(cache, "hot") == written
+
+
+def test_pruning_keeps_entries_hot_in_memory(tmp_path, monkeypatch):
+    cache = SqliteCache(str(tmp_path / "cache.sqlite3"), max_entries=1)
+    now = [1000.0]
+    monkeypatch.setattr("src.cache.time.time", lambda: now[0])
+    cache.set("hot", {"value": 1})
+    now[0] += 1
+    cache.set("cold", {"value": 2})
+    now[0] += cache.touch_interval
+    cache.get("hot")
+
+    conn = cache._connect()
+    cache._prune(conn, now[0])
+    conn.commit()
+
+    with sqlite3.connect(cache.path) as conn:
+        assert [key for (key,) in conn.execute(f"SELECT key FROM {cache.table}")] == ["hot"]
@@ -0,0 +1,79 @@
+import chess
+import chess.engine
+import pytest
+
+from src.engines import UciEnginePool, build_analysis
+
+# Scholar's mate: black is checkmated.
+BLACK_MATED = "r1bqkb1r/pppp1Qpp/2n2n2/4p3/2B1P3/8/PPPP1PPP/RNB1K1NR b KQkq - 0 4"
+# Fool's mate: white is checkmated.
+WHITE_MATED = "rnb1kbnr/pppp1ppp/8/4p3/6Pq/5P2/PPPPP2P/RNBQKBNR w KQkq - 1 3"
+
+
+def test_win_chance_when_black_is_mated():
+    analysis = build_analysis(chess.Board(BLACK_MATED), None, centipawns=100_000, mate=0)
+
+    assert analysis["winChance"] == 100.0
+
+
+def test_win_chance_when_white_is_mated():
+    analysis = build_analysis(chess.Board(WHITE_MATED), None, centipawns=-100_000, mate=0)
+
+    assert analysis["winChance"] == 0.0
+
+
+def test_win_chance_of_forced_mates():
+    board = chess.Board()
+
+    assert build_analysis(board, None, centipawns=100_000, mate=3)["winChance"] == 100.0
+    assert build_analysis(board, None, centipawns=-100_000, mate=-2)["winChance"] == 0.0
+
+
+class FakeEngine:
+    def quit(self):
+        pass
+
+
+class FlakyPool(UciEnginePool):
+    """A pool whose engines are FakeEngines and whose restarts fail while `spawn_fails` is set."""
+
+    def __init__(self, size: int):
+        self.spawn_fails = False
+        super().__init__("fake-engine", size=size, checkout_timeout=0.1)
+
+    def _spawn(self):
+        if self.spawn_fails:
+            raise OSError("engine binary missing")
+        return FakeEngine()
+
+
+def crash(pool: UciEnginePool):
+    with pytest.raises(chess.engine.EngineTerminatedError):
+        with pool.checkout():
+            raise chess.engine.EngineTerminatedError("engine died")
+
+
+def test_dead_engine_is_not_returned_when_restart_fails():
+    pool = FlakyPool(size=2)
+    pool.spawn_fails = True
+    crash(pool)
+
+    assert pool._engines.qsize() == 1
+    with pool.checkout() as engine:
+        assert isinstance(engine, FakeEngine)
+
+
+def test_pool_is_replenished_once_restarts_succeed():
+    pool = FlakyPool(size=2)
+    pool.spawn_fails = True
+    crash(pool)
+    crash(pool)
+    with pytest.raises(TimeoutError):
+        with pool.checkout():
+            pass
+
+    pool.spawn_fails = False
+    with pool.checkout():
+        pass
+
+    assert pool._engines.qsize() == 2
@@ -0,0 +1,13 @@
+from src.prefetch import Prefetcher, PrefetchUser
+
+
+def test_sessions_of_one_client_share_its_budget():
+    prefetcher = Prefetcher(user_budget=2)
+    first, second = PrefetchUser("10.0.0.1", "a"), PrefetchUser("10.0.0.1", "b")
+
+    with prefetcher.foreground(first), prefetcher.foreground(second):
+        pass
+
+    assert prefetcher._user(first) is not prefetcher._user(second)
+    assert prefetcher._user(first).bucket is prefetcher._user(second).bucket
+    assert prefetcher._user(PrefetchUser("10.0.0.2", "a")).bucket is not prefetcher._user(first).bucket
@@ -0,0 +1,66 @@
+import asyncio
+
+import chess
+
+from src import tools
+from src.cache import EvaluationCache
+from src.engines import EvaluationBackend, build_analysis
+
+START = chess.STARTING_FEN
+AFTER_E4 = "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"
+
+
+class FirstMoveBackend(EvaluationBackend):
+    def __init__(self):
+        self.calls = 0
+
+    def analyse(self, fen: str) -> dict:
+        self.calls += 1
+        board = chess.Board(fen)
+        move = next(iter(board.legal_moves))
+        return build_analysis(board, move, centipawns=0, depth=1, continuation=[move])
+
+
+def test_batch_counts_each_miss_once(tmp_path, monkeypatch):
+    cache = EvaluationCache(str(tmp_path / "evaluations.sqlite3"))
+    backend = FirstMoveBackend()
+    monkeypatch.setattr(tools, "get_evaluation_cache", lambda: cache)
+    monkeypatch.setattr(tools, "get_evaluation_backend", lambda: backend)
+    monkeypatch.setattr(tools, "lookup_position", lambda fen: None)
+
+    results = list(tools.get_stockfish_analyses([START, AFTER_E4, START], max_concurrency=2))
+
+    assert [result["fen"] for result in results] == [START, AFTER_E4, START]
+    assert backend.calls == 2
+    assert cache.stats()["misses"] == 2
+
+    list(tools.get_stockfish_analyses([START, AFTER_E4]))
+
+    assert backend.calls == 2
+    assert cache.stats()["hits"] == 2
+
+
+def test_sync_and_async_variants_report_under_the_tool_name():
+    from src.metrics import TOOL_OUTPUT_TOKENS
+    from src.tool_output import reporting_tool
+
+    def lookup(fen: str) -> dict:
+        """Look up a position."""
+        return {"fen": fen}
+
+    async def alookup(fen: str) -> dict:
+        return {"fen": fen}
+
+    def count() -> float:
+        return sum(
+            sample.value for metric in TOOL_OUTPUT_TOKENS.collect() for sample in metric.samples
+            if sample.name.endswith("_count") and sample.labels["tool"] == "lookup"
+        )
+
+    tool = reporting_tool(fn=lookup, async_fn=alookup)
+    before = count()
+    tool.call(fen="8/8/8/8/8/8/8/8 w - - 0 1")
+    asyncio.run(tool.acall(fen="8/8/8/8/8/8/8/8 w - - 0 1"))
+
+    assert tool.metadata.name == "lookup"
+    assert count() == before + 2
@@ -0,0 +1,61 @@
+import os
+
+from src.versions import current_version, new_version_path, swap_in
+
+
+def write_version(store_path: str, content: str) -> str:
+    path = new_version_path(store_path)
+    os.makedirs(path)
+    with open(os.path.join(path, "docstore.json"), "w") as f:
+        f.write(content)
+    return path
+
+
+def read(store_path: str) -> str:
+    with open(os.path.join(current_version(store_path), "docstore.json")) as f:
+        return f.read()
+
+
+def test_swap_leaves_a_plain_store_directory_in_place(tmp_path):
+    store_path = str(tmp_path / "store")
+    os.makedirs(store_path)
+    with open(os.path.join(store_path, "docstore.json"), "w") as f:
+        f.write("legacy")
+    assert read(store_path) == "legacy"
+
+    swap_in(write_version(store_path, "v1"), store_path)
+
+    assert not os.path.islink(store_path)
+    assert read(store_path) == "v1"
+    assert not os.path.isabs(os.readlink(os.path.join(store_path, "current")))
+    assert os.listdir(tmp_path) == ["store"]
+
+
+def test_swap_keeps_the_previous_version_only(tmp_path):
+    store_path = str(tmp_path / "store")
+    v1 = write_version(store_path, "v1")
+    swap_in(v1, store_path)
+    v2 = write_version(store_path, "v2")
+    swap_in(v2, store_path)
+
+    assert read(store_path) == "v2"
+    assert os.path.exists(v1)
+
+    v3 = write_version(store_path, "v3")
+    swap_in(v3, store_path)
+
+    assert read(store_path) == "v3"
+    assert not os.path.exists(v1)
+    assert os.path.exists(v2)
+    assert sorted(os.listdir(store_path)) == ["current", "versions"]
+
+
+def test_copied_store_keeps_its_current_version(tmp_path):
+    import shutil
+
+    store_path = str(tmp_path / "store")
+    swap_in(write_version(store_path, "v1"), store_path)
+    shutil.copytree(store_path, str(tmp_path / "copy"), symlinks=True)
+    shutil.rmtree(store_path)
+
+    assert read(str(tmp_path / "copy")) == "v1"